@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Compare the objects created per second with bika_api.create and with the
+bulk create path of the sync
+
+Run it with the instance script so it has the Zope app and the site:
+
+    bin/instance run scripts/bench_bulk_create.py [site] [systems] [batch]
+
+Creates a client and a location in the site (senaite by default), then the
+given number of systems (1000 by default) in the location, once with
+bika_api.create as a sync run does and once with a BulkCreator built on
+SyncLocationsView.create, finishing the systems every `batch` systems (100
+by default) as a run saves its changes. Each way ends with a savepoint so
+the writing of the objects is included, and nothing is committed: the
+transaction is aborted after each way.
+"""
+
+import sys
+import time
+
+from AccessControl.SecurityManagement import newSecurityManager
+from bika.lims import api as bika_api
+from senaite.locationsync.browser.sync_locations_view import SyncLocationsView
+from senaite.locationsync.bulk import BulkCreator
+from Testing.makerequest import makerequest
+import transaction
+from zope.component.hooks import setSite
+
+
+def get_site(app, site_id):
+    app = makerequest(app)
+    site = app[site_id]
+    setSite(site)
+    user = app.acl_users.getUser("admin")
+    newSecurityManager(None, user.__of__(app.acl_users))
+    return site
+
+
+def new_location(site):
+    client = bika_api.create(site.clients, "Client", ClientID="BENCH", title="Bench")
+    return bika_api.create(client, "SamplePointLocation", title="Bench")
+
+
+def run(site, mode, count, batch):
+    location = new_location(site)
+    view = SyncLocationsView(site, site.REQUEST)
+    creator = BulkCreator(view.create, view.finish_created, view.index_created)
+    start = time.time()
+    for i in range(count):
+        title = "System {}".format(i)
+        if mode == "api":
+            bika_api.create(location, "SamplePoint", title=title)
+            continue
+        creator.add(location, "SamplePoint", title=title)
+        if (i + 1) % batch == 0:
+            creator.flush()
+    creator.flush()
+    transaction.savepoint(optimistic=True)
+    elapsed = time.time() - start
+    transaction.abort()
+    print(
+        "{:5} {:8} systems {:8.2f} s {:8.1f} systems per second".format(
+            mode, count, elapsed, count / elapsed
+        )
+    )
+
+
+def main(app):
+    site_id = sys.argv[1] if len(sys.argv) > 1 else "senaite"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    batch = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    site = get_site(app, site_id)
+    for mode in ("api", "bulk"):
+        run(site, mode, count, batch)
+
+
+if __name__ == "__main__":
+    main(app)  # noqa: F821 the instance script provides app
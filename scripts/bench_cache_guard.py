@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Compare the memory of a run that wakes many objects with and without
+minimizing the ZODB cache
+
+Run it with the instance interpreter so senaite.locationsync is importable:
+
+    bin/zopepy scripts/bench_cache_guard.py [objects] [budget]
+
+Fills a temporary FileStorage with the given number of objects (20000 by
+default) of about 4 KB each, then wakes all of them in one transaction and
+changes one in a hundred, the way a full run goes through the systems.
+The run is repeated for a growing number of objects, once keeping all the
+woken objects in the connection cache and once with a CacheGuard of the
+given budget (5000 by default). Each run is its own process so the peak
+memory reported is its own.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from senaite.locationsync.memory import CacheGuard
+from senaite.locationsync.memory import peak_rss_mb
+import transaction
+import ZODB
+from ZODB.FileStorage import FileStorage
+
+
+class System(Persistent):
+    def __init__(self, number):
+        self.EquipmentID = "E{}".format(number)
+        self.EquipmentDescription = "x" * 4096
+
+
+def fill(file_path, count):
+    db = ZODB.DB(FileStorage(file_path))
+    conn = db.open()
+    systems = conn.root()["systems"] = OOBTree()
+    for i in range(count):
+        systems[i] = System(i)
+        if i % 1000 == 0:
+            transaction.commit()
+    transaction.commit()
+    db.close()
+
+
+def run(file_path, mode, budget):
+    # keep all woken objects unless minimized, like a long request does
+    db = ZODB.DB(FileStorage(file_path), cache_size=10 ** 9)
+    conn = db.open()
+    guard = CacheGuard(conn, budget if mode == "guard" else 0)
+    start = time.time()
+    count = 0
+    for i, system in conn.root()["systems"].items():
+        if system.EquipmentID and i % 100 == 0:
+            system.EquipmentID = "changed"
+        guard.woke()
+        count += 1
+    transaction.commit()
+    elapsed = time.time() - start
+    print(
+        "{:6} {:8} objects {:8.2f} s {:8.1f} MB peak RSS {:8} cached".format(
+            mode, count, elapsed, peak_rss_mb(), guard.cached()
+        )
+    )
+    db.close()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ("cache", "guard"):
+        run(sys.argv[2], sys.argv[1], int(sys.argv[3]))
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    budget = sys.argv[2] if len(sys.argv) > 2 else "5000"
+    folder = tempfile.mkdtemp()
+    try:
+        for size in (count // 4, count // 2, count):
+            file_path = os.path.join(folder, "{}.fs".format(size))
+            fill(file_path, size)
+            for mode in ("cache", "guard"):
+                subprocess.check_call(
+                    [sys.executable, __file__, mode, file_path, budget]
+                )
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
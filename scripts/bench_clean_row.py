@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Compare the throughput of the original row cleaning and the way the
+reader cleans rows now
+
+Run it with the instance interpreter so senaite.locationsync is importable:
+
+    bin/zopepy scripts/bench_clean_row.py [rows]
+
+The generated lines are read with the csv reader and cleaned by
+reference_clean_row, and read through decoded_lines and cleaned by
+clean_valid_row as the reader does. The results must be identical before
+any timing is reported.
+"""
+
+import csv
+import random
+import sys
+import time
+
+from senaite.locationsync.cleaning import clean_valid_row
+from senaite.locationsync.cleaning import reference_clean_row
+from senaite.locationsync.reader import decoded_lines
+from senaite.locationsync.reader import new_stats
+
+CELLS = [
+    b"ACME Water Treatment",
+    b"  12 Main Street ",
+    b"VIC",
+    b"3000",
+    b"0",
+    b"Cooling Tower 3",
+    b"O\xe2\x80\x99Brien",
+    b"Caf\xc3\xa9\xc2\xa0",
+    b"\xef\xbb\xbfCustomer_Number",
+    b"bad \x92 cp1252",
+]
+
+
+def make_lines(count, width=7, seed=42):
+    rnd = random.Random(seed)
+    # about one row in ten holds a non ASCII cell, like the real files
+    ascii_cells = CELLS[:6]
+    return [
+        b",".join(
+            rnd.choice(CELLS if rnd.random() < 0.1 else ascii_cells)
+            for _ in range(width)
+        )
+        + b"\n"
+        for _ in range(count)
+    ]
+
+
+def reference_rows(lines):
+    return [reference_clean_row(row) for row in csv.reader(lines)]
+
+
+def current_rows(lines):
+    reader = csv.reader(decoded_lines(lines, new_stats()))
+    return [clean_valid_row(row) for row in reader]
+
+
+def run(func, lines):
+    start = time.time()
+    func(lines)
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    lines = make_lines(count)
+    cells = count * 7
+    if current_rows(lines) != reference_rows(lines):
+        print("The rows cleaned differ from the reference")
+        sys.exit(1)
+    print("{} rows, {} cells, output identical".format(count, cells))
+    old = run(reference_rows, lines)
+    new = run(current_rows, lines)
+    print("reference: {:12.0f} cells/s".format(cells / old))
+    print("current:   {:12.0f} cells/s".format(cells / new))
+    print("speedup:   {:12.1f}x".format(old / new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Compare the client lookups of the accounts and locations passes
+
+Run it with the instance interpreter so senaite.locationsync is importable:
+
+    bin/zopepy scripts/bench_client_index.py [rows]
+
+For a growing number of clients, looks up the Customer_Number of each row
+once the way the passes used to, a list membership test followed by a scan
+of all brains, and once in the index built by index_brains. Plain dicts
+stand in for the catalog brains. The time taken to prepare the list or the
+index once per pass is reported apart from the time per row.
+"""
+
+import random
+import sys
+import time
+
+from senaite.locationsync.indexes import index_brains
+
+
+def make_brains(count):
+    return [
+        {"getClientID": "C{}".format(i), "Title": "Client {}".format(i)}
+        for i in range(count)
+    ]
+
+
+def list_lookup(clients):
+    client_ids = [c["getClientID"] for c in clients]
+
+    def lookup(number):
+        if number in client_ids:
+            return [c for c in clients if number == c["getClientID"]][0]
+
+    return lookup
+
+
+def index_lookup(clients):
+    index = index_brains(clients, "getClientID")
+
+    def lookup(number):
+        if number in index:
+            return index[number]
+
+    return lookup
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rnd = random.Random(1)
+    print(
+        "{:>8} {:>12} {:>14} {:>12} {:>14}".format(
+            "clients", "list ms", "list us/row", "index ms", "index us/row"
+        )
+    )
+    for count in (1000, 5000, 10000, 20000):
+        clients = make_brains(count)
+        numbers = ["C{}".format(rnd.randrange(count)) for _ in range(rows)]
+        timings = []
+        for prepare in (list_lookup, index_lookup):
+            start = time.time()
+            lookup = prepare(clients)
+            timings.append((time.time() - start) * 1e3)
+            start = time.time()
+            for number in numbers:
+                lookup(number)
+            timings.append((time.time() - start) / rows * 1e6)
+        print("{:8} {:12.2f} {:14.2f} {:12.2f} {:14.2f}".format(count, *timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Compare reading a large systems file through the file object and mmap
+
+Run it with the instance interpreter so senaite.locationsync is importable:
+
+    bin/zopepy scripts/bench_reader.py [size in MB] [file path]
+
+Generates a systems file of the given size (1024 MB by default, kept when a
+path is given so later runs can reuse it) and reads it through the whole
+row pipeline, decoding, splitting and cleaning, once from the lines of the
+file object and once from a memory map, as the mmap request flag of the
+view does. Each reader runs in its own process so the peak memory reported
+is its own.
+"""
+
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from senaite.locationsync.reader import decoded_lines
+from senaite.locationsync.reader import file_lines
+from senaite.locationsync.reader import iter_values
+from senaite.locationsync.reader import new_stats
+from senaite.locationsync.reader import read_header
+from senaite.locationsync.records import SYSTEM_FILE_HEADERS
+
+
+def generate(file_path, size):
+    block = []
+    for i in range(10000):
+        block.append(
+            'L{},E{},S{},"Cooling tower, roof",System {},0,tower\r\n'.format(
+                i // 20, i, i, i
+            )
+        )
+    block = "".join(block).encode("utf-8")
+    with open(file_path, "wb") as f:
+        f.write(",".join(SYSTEM_FILE_HEADERS).encode("utf-8") + b"\r\n")
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+
+def read(file_path, mode):
+    stats = new_stats()
+    start = time.time()
+    count = 0
+    with open(file_path, "rb") as csvfile:
+        lines = file_lines(csvfile, use_mmap=mode == "mmap")
+        reader = csv.reader(decoded_lines(lines, stats), delimiter=",", quotechar='"')
+        read_header(reader, file_path, SYSTEM_FILE_HEADERS)
+        for _, values in iter_values(
+            reader, file_path, SYSTEM_FILE_HEADERS, stats, lambda msg: None
+        ):
+            count += 1
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(
+        "{:6} {:10} rows {:8.2f} s {:10.0f} rows/s {:8.1f} MB peak RSS".format(
+            mode, count, elapsed, count / elapsed, peak
+        )
+    )
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ("file", "mmap"):
+        read(sys.argv[2], sys.argv[1])
+        return
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    if len(sys.argv) > 2:
+        file_path, keep = sys.argv[2], True
+    else:
+        fd, file_path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        keep = False
+    try:
+        if not keep or not os.path.exists(file_path):
+            generate(file_path, size * 1024 * 1024)
+        size = os.path.getsize(file_path) / 1024.0 / 1024.0
+        print("Systems file of {:.0f} MB".format(size))
+        for mode in ("file", "mmap"):
+            subprocess.check_call([sys.executable, __file__, mode, file_path])
+    finally:
+        if not keep:
+            os.remove(file_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Compare the catalog time of a sync run with and without defer_reindex
+
+Run it with the instance script so it has the Zope app and the site:
+
+    bin/instance run scripts/bench_reindex.py [site]
+
+Processes all the rows of the files in the current folder of the sync base
+folder of the site (senaite by default), once with each change reindexed
+in all indexes straight away (defer_reindex=false) and once with the
+changed objects reindexed once per batch in the changed indexes. Nothing
+is committed: the transaction is aborted after each run. Each run works on
+a temporary copy of the sync base folder, so the files it moves or writes,
+like the rejected rows, never reach the real folders.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from AccessControl.SecurityManagement import newSecurityManager
+from senaite.locationsync.browser.sync_locations_view import SyncLocationsView
+from Testing.makerequest import makerequest
+import transaction
+from zope.component.hooks import setSite
+
+
+def get_site(app, site_id):
+    app = makerequest(app)
+    site = app[site_id]
+    setSite(site)
+    user = app.acl_users.getUser("admin")
+    newSecurityManager(None, user.__of__(app.acl_users))
+    return site
+
+
+def use_copy(view, base_folder):
+    """Point the folders of the view at a copy of its sync base folder"""
+    view.sync_base_folder = base_folder
+    view.sync_current_folder = os.path.join(base_folder, "current")
+    view.sync_archive_folder = os.path.join(base_folder, "archive")
+    view.sync_error_folder = os.path.join(base_folder, "errors")
+    view.sync_logs_folder = os.path.join(base_folder, "logs")
+    view.sync_history_folder = os.path.join(base_folder, "all")
+
+
+def run(site, deferred):
+    view = SyncLocationsView(site, site.REQUEST)
+    view.full_sync = True
+    view.defer_reindex = deferred
+    if not view.sync_base_folder or not os.path.exists(view.sync_base_folder):
+        print("The sync base folder {} does not exist".format(view.sync_base_folder))
+        return
+    temp_folder = tempfile.mkdtemp()
+    try:
+        base_folder = os.path.join(temp_folder, "sync")
+        shutil.copytree(view.sync_base_folder, base_folder)
+        use_copy(view, base_folder)
+        start = time.time()
+        view.sync_locations()
+        elapsed = time.time() - start
+        transaction.abort()
+    finally:
+        shutil.rmtree(temp_folder)
+    queue = view.reindex_queue
+    if queue is None:
+        print("The sync folders are not set up, see the run log")
+        return
+    print(
+        "defer_reindex={:5} {:6} changes {:6} reindexed {:8.2f} s in the catalog {:8.2f} s in all".format(
+            str(deferred).lower(),
+            queue.changes,
+            queue.reindexed,
+            queue.seconds,
+            elapsed,
+        )
+    )
+
+
+def main(app):
+    site_id = sys.argv[1] if len(sys.argv) > 1 else "senaite"
+    site = get_site(app, site_id)
+    for deferred in (False, True):
+        run(site, deferred)
+
+
+if __name__ == "__main__":
+    main(app)  # noqa: F821 the instance script provides app
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Compare header keyed dict rows with the SystemRow records
+
+Run it with the instance interpreter so senaite.locationsync is importable:
+
+    bin/zopepy scripts/bench_row_records.py [rows]
+
+Builds the rows of a generated systems file both ways and reports the
+memory held by the row containers and the time taken to construct them.
+The cell values are shared by both, so only the per row overhead differs.
+"""
+
+import gc
+import sys
+import time
+
+from senaite.locationsync.records import SYSTEM_FILE_HEADERS
+from senaite.locationsync.records import SystemRow
+
+
+def make_values(count):
+    return [
+        [
+            u"L{}".format(i // 20),
+            u"E{}".format(i),
+            u"S{}".format(i),
+            u"Cooling tower",
+            u"System {}".format(i),
+            u"0",
+            u"tower",
+        ]
+        for i in range(count)
+    ]
+
+
+def as_dicts(values):
+    return [dict(zip(SYSTEM_FILE_HEADERS, row)) for row in values]
+
+
+def as_records(values):
+    return [SystemRow(*row) for row in values]
+
+
+def measure(func, values):
+    gc.collect()
+    start = time.time()
+    rows = func(values)
+    elapsed = time.time() - start
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(row) for row in rows)
+    return rows, elapsed, size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    values = make_values(count)
+    print("{} rows of the systems file".format(count))
+    for name, func in (("dict", as_dicts), ("SystemRow", as_records)):
+        rows, elapsed, size = measure(func, values)
+        print(
+            "{:10} {:8.1f} MB {:8.0f} bytes/row {:8.2f} s to build".format(
+                name, size / 1024.0 / 1024.0, size / float(count), elapsed
+            )
+        )
+        del rows
+
+
+if __name__ == "__main__":
+    main()
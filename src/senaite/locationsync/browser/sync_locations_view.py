@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 
+from Acquisition import aq_base
 from bika.lims.api.mail import compose_email
 from bika.lims.api.mail import send_email
 from bika.lims import api as bika_api
 from bika.lims.api import get_brain_by_uid
 import csv
 from DateTime import DateTime
+from functools import partial
 
 # from email.mime.multipart import MIMEMultipart
 # from email.mime.text import MIMEText
@@ -19,16 +21,67 @@ from Products.statusmessages.interfaces import IStatusMessage
 from senaite import api
 from senaite.core import logger
 from senaite.locationsync import _
+from senaite.locationsync.bulk import BulkCreator
+from senaite.locationsync.bulk import CreatedBrain
+from senaite.locationsync.commits import COMMIT_OBJECTS
+from senaite.locationsync.commits import COMMIT_ROWS
+from senaite.locationsync.commits import COMMIT_SECONDS
+from senaite.locationsync.commits import CommitPolicy
+from senaite.locationsync.delta import changed_rows
+from senaite.locationsync.delta import latest_archived_file
+from senaite.locationsync.delta import PARENT_KEYS
+from senaite.locationsync.delta import read_snapshot
+from senaite.locationsync.external_ids import get_storage
+from senaite.locationsync.external_ids import index_object
+from senaite.locationsync.fingerprints import file_fingerprint
+from senaite.locationsync.fingerprints import read_fingerprints
+from senaite.locationsync.fingerprints import write_fingerprints
+from senaite.locationsync.indexes import CATALOGS
+from senaite.locationsync.indexes import ExternalIdIndex
+from senaite.locationsync.indexes import frozen_address
+from senaite.locationsync.indexes import normalized_email
+from senaite.locationsync.indexes import parent_path
+from senaite.locationsync.indexes import PREFETCH_ROWS
+from senaite.locationsync.indexes import StoredBrain
+from senaite.locationsync.indexes import SyncIndex
+from senaite.locationsync.memory import CACHE_BUDGET
+from senaite.locationsync.memory import CacheGuard
+from senaite.locationsync.memory import ObjectCache
+from senaite.locationsync.preflight import preflight
+from senaite.locationsync.reader import data_file_path
+from senaite.locationsync.reader import decoded_lines
+from senaite.locationsync.reader import decoding_warnings
+from senaite.locationsync.reader import file_lines
+from senaite.locationsync.reader import GZIP_SUFFIX
+from senaite.locationsync.reader import is_gzipped
+from senaite.locationsync.reader import iter_chunks
+from senaite.locationsync.reader import iter_values
+from senaite.locationsync.reader import new_stats
+from senaite.locationsync.reader import open_data_file
+from senaite.locationsync.reader import read_header
+from senaite.locationsync.reindex import ReindexQueue
+from senaite.locationsync.rejected import rejected_file_name
+from senaite.locationsync.rejected import RejectedFiles
+from senaite.locationsync.records import ACCOUNT_FILE_HEADERS
+from senaite.locationsync.records import CONTACT_FILE_HEADERS
+from senaite.locationsync.records import LOCATION_FILE_HEADERS
+from senaite.locationsync.records import NATURAL_KEYS
+from senaite.locationsync.records import RECORD_TYPES
+from senaite.locationsync.records import REQUIRED_FIELDS
+from senaite.locationsync.records import SYSTEM_FILE_HEADERS
+from senaite.locationsync.validation import format_rows
+from senaite.locationsync.validation import new_report
+from senaite.locationsync.validation import validated_rows
 import subprocess
 import time
 
 # from smtplib import SMTPRecipientsRefused
 # from smtplib import SMTPServerDisconnected
 import transaction
+from ZODB.POSException import ConflictError
 from zope.interface import Interface, alsoProvides
 
 EMAIL_SUPER = True
-COMMIT_COUNT = 100
 FORCE_ABORT = False
 SETUP_RUN = False
 
@@ -37,32 +90,13 @@ ACCOUNT_FILE_NAME = "Account lims.csv"
 LOCATION_FILE_NAME = "location lims.csv"
 SYSTEM_FILE_NAME = "system lims.csv"
 CONTACT_FILE_NAME = "attention contact lims.csv"
-
-ACCOUNT_FILE_HEADERS = ["Customer_Number", "Account_name", "Inactive", "On_HOLD"]
-LOCATION_FILE_HEADERS = [
-    "Customer_Number",
-    "location_name",
-    "Locations_id",
-    "account_manager1",
-    "street",
-    "city",
-    "state",
-    "postcode",
-    "branch",
-    "Contract_Number",
-    "HOLD",
-    "Cancel_Box",
-]
-SYSTEM_FILE_HEADERS = [
-    "Location_id",
-    "Equipment_ID",
-    "SystemID",
-    "Equipment_Description2",
-    "system_name",
-    "Inactive_Retired_Flag",
-    "system",
+SYNC_FILES = [
+    ("Accounts", ACCOUNT_FILE_NAME, ACCOUNT_FILE_HEADERS),
+    ("Locations", LOCATION_FILE_NAME, LOCATION_FILE_HEADERS),
+    ("Systems", SYSTEM_FILE_NAME, SYSTEM_FILE_HEADERS),
+    ("Contacts", CONTACT_FILE_NAME, CONTACT_FILE_HEADERS),
 ]
-CONTACT_FILE_HEADERS = ["contactID", "Locations_id", "WS_Contact_Name", "email"]
+SYNC_FILE_NAMES = dict((file_type, name) for file_type, name, _ in SYNC_FILES)
 
 
 class ISyncLocationsView(Interface):
@@ -83,6 +117,42 @@ class SyncLocationsView(BrowserView):
         self.sync_error_folder = "{}/errors".format(self.sync_base_folder)
         self.sync_logs_folder = "{}/logs".format(self.sync_base_folder)
         self.sync_history_folder = "{}/all".format(self.sync_base_folder)
+        self.full_sync = False
+        self.use_preflight = False
+        self.preflight_results = {}
+        self.fingerprints = {}
+        self.archived_fingerprints = {}
+        # natural keys of the rows processed by file type, None for all rows
+        self.changed_keys = {}
+        self.index = None
+        # objects woken from brains during the run
+        self.woken = 0
+        self.memory = None
+        # commit as the run goes instead of taking savepoints
+        self.commit_changes = False
+        self.policy = None
+        # process the rejected rows of earlier runs instead of the files
+        self.replay = False
+        # rows rolled back by file type
+        self.rejected = {}
+        self.rejected_count = 0
+        self.rejected_files = None
+        # (location brain, client title) of the locations on hold, their
+        # systems are deactivated together once all rows are processed
+        self.held = []
+        # reindex the changed objects once per batch, in the indexes changed
+        self.defer_reindex = True
+        self.reindex_queue = None
+        # create new objects in bulk, for first loads
+        self.bulk = False
+        self.bulk_creator = None
+        # read the data files from a memory map, for very large files
+        self.use_mmap = False
+        # the steps since the changes were last saved, made again after a
+        # conflict, with the logs they wrote and the rejected rows before them
+        self.batch = None
+        # the objects woken last by path
+        self.objects = ObjectCache()
 
     def __call__(self):
         logger.info("location sync invoked")
@@ -93,6 +163,16 @@ class SyncLocationsView(BrowserView):
             logger.info(msg)
             return
         no_abort = self.request.form.get("no-abort") is not None
+        self.full_sync = self.request.form.get("full", "false").lower() == "true"
+        self.use_preflight = (
+            self.request.form.get("preflight", "false").lower() == "true"
+        )
+        self.replay = self.request.form.get("replay", "false").lower() == "true"
+        if self.replay:
+            # all the rejected rows are processed, from the errors folder
+            self.sync_current_folder = self.sync_error_folder
+            self.full_sync = True
+            self.use_preflight = False
         logger.info("form = {}".format(self.request.form))
         if self.request.form.get("confirm", "false").lower() == "false":
             msg = "Command not confirmed"
@@ -102,12 +182,16 @@ class SyncLocationsView(BrowserView):
             return
         else:
             logger.info("Parameter confirm = true")
-        if self.request.form.get("commit", "false").lower() == "true":
-            logger.info("Commit every 100 transactions")
-            COMMIT_COUNT = 100
+        self.commit_changes = self.request.form.get("commit", "false").lower() == "true"
+        if self.commit_changes:
+            logger.info("Commit as the run goes")
         else:
             logger.info("Only commit at the end of the run")
-            COMMIT_COUNT = 0
+        self.defer_reindex = (
+            self.request.form.get("defer_reindex", "true").lower() == "true"
+        )
+        self.bulk = self.request.form.get("bulk", "false").lower() == "true"
+        self.use_mmap = self.request.form.get("mmap", "false").lower() == "true"
         # if self.request.form.get("get_emails", "true").lower() == "true":
         #     err_code = self.get_emails()
         #     if err_code is not None:
@@ -122,6 +206,12 @@ class SyncLocationsView(BrowserView):
         # else:
         #     logger.info("Do not get emaiuls")
         logger.info("SyncLocationsView: no_abort = {}".format(no_abort))
+        logger.info("SyncLocationsView: full = {}".format(self.full_sync))
+        logger.info("SyncLocationsView: preflight = {}".format(self.use_preflight))
+        logger.info("SyncLocationsView: replay = {}".format(self.replay))
+        logger.info("SyncLocationsView: defer_reindex = {}".format(self.defer_reindex))
+        logger.info("SyncLocationsView: bulk = {}".format(self.bulk))
+        logger.info("SyncLocationsView: mmap = {}".format(self.use_mmap))
         if (
             self.sync_base_folder is None
             or len(self.sync_base_folder) == 0
@@ -146,23 +236,43 @@ class SyncLocationsView(BrowserView):
         actions = [log for log in self.logs if log["action"] != "Info"]
         additions = [act for act in actions if act["action"] == "Added"]
         self.log(
-            "Stats: found {} errors, {} warnings and {} actions ({} additions)".format(
-                len(errors), len(warnings), len(actions), len(additions)
+            "Stats: found {} errors ({} rejected rows), {} warnings and {} actions ({} additions)".format(
+                len(errors),
+                self.rejected_count,
+                len(warnings),
+                len(actions),
+                len(additions),
             )
         )
-        # Move data files
-        if len(errors) == 0:
-            self._move_file(ACCOUNT_FILE_NAME, self.sync_archive_folder)
-            self._move_file(LOCATION_FILE_NAME, self.sync_archive_folder)
-            self._move_file(SYSTEM_FILE_NAME, self.sync_archive_folder)
-            self._move_file(CONTACT_FILE_NAME, self.sync_archive_folder)
+        # Move data files, the rows rejected were rolled back on their own and
+        # are kept to be replayed
+        if len(errors) == self.rejected_count:
+            if self.replay:
+                logger.info("Replayed the rejected rows, no data files to move")
+            else:
+                # the next run compares its files with the archive, they are
+                # only archived once the changes they made are committed
+                transaction.get().addAfterCommitHook(self.archive_files)
+                self.log(
+                    "Data files are archived once the changes are committed, "
+                    "failures to archive them are only logged in the instance log"
+                )
         else:
-            self._move_file(ACCOUNT_FILE_NAME, self.sync_error_folder)
-            self._move_file(LOCATION_FILE_NAME, self.sync_error_folder)
-            self._move_file(SYSTEM_FILE_NAME, self.sync_error_folder)
-            self._move_file(CONTACT_FILE_NAME, self.sync_error_folder)
+            if not self.replay:
+                # the files replayed are already in the errors folder
+                self._move_file(ACCOUNT_FILE_NAME, self.sync_error_folder)
+                self._move_file(LOCATION_FILE_NAME, self.sync_error_folder)
+                self._move_file(SYSTEM_FILE_NAME, self.sync_error_folder)
+                self._move_file(CONTACT_FILE_NAME, self.sync_error_folder)
             if not no_abort:
                 self.log("Abort all transactions because errors we found")
+                if self.policy is not None and self.policy.commits:
+                    self.log(
+                        "The changes of {} earlier commits are kept, only the changes since the last commit are aborted".format(
+                            self.policy.commits
+                        ),
+                        level="warn",
+                    )
                 transaction.abort()
 
         # Create log file
@@ -380,61 +490,483 @@ class SyncLocationsView(BrowserView):
             }
         )
 
+    def log_after_run(self, message, context="Main", level="info", action=False):
+        """Log to the instance log only, for what happens once the run log
+        was written, like archiving the data files after the commit
+        """
+        log_level = logging.getLevelName(level.upper())
+        logger.log(level=log_level, msg="{}: {}".format(context, message))
+
     def sync_locations(self):
         if not self._all_folder_exist():
             return
         self.log("Folder check was successful")
+        self.archived_fingerprints = read_fingerprints(self.sync_archive_folder)
 
         self.log("Sync process started")
-        self.process_file("Accounts", ACCOUNT_FILE_NAME, ACCOUNT_FILE_HEADERS)
-        self.process_file("Locations", LOCATION_FILE_NAME, LOCATION_FILE_HEADERS)
-        self.process_file("Systems", SYSTEM_FILE_NAME, SYSTEM_FILE_HEADERS)
-        self.process_file("Contacts", CONTACT_FILE_NAME, CONTACT_FILE_HEADERS)
+        jar = getattr(api.get_portal(), "_p_jar", None)
+        self.policy = CommitPolicy(
+            jar,
+            commit=self.commit_changes,
+            rows=self.get_setting("commit_rows", COMMIT_ROWS),
+            seconds=self.get_setting("commit_seconds", COMMIT_SECONDS),
+            objects=self.get_setting("commit_objects", COMMIT_OBJECTS),
+            on_save=self.saved,
+            before_save=self.flush_batch,
+            replay=self.replay_batch,
+        )
+        self.memory = CacheGuard(
+            jar,
+            self.get_setting("cache_budget", CACHE_BUDGET),
+            savepoint=self.policy.savepoint,
+        )
+        self.log("Memory at start: {}".format(self.memory.report()))
+        self.rejected_files = RejectedFiles(
+            self.sync_error_folder, self.rejected, replace=self.replay
+        )
+        self.reindex_queue = ReindexQueue(self.defer_reindex)
+        if self.bulk:
+            self.bulk_creator = BulkCreator(
+                self.create, self.finish_created, self.index_created
+            )
+        self.log(self.policy.describe())
+        self.new_batch()
+        storage = get_storage()
+        if storage is None:
+            self.index = SyncIndex(self.search_portal_type, self.get_lab_contacts)
+        else:
+            self.log("Rows are looked up in the external ID index")
+            self.index = ExternalIdIndex(
+                storage, self.search_portal_type, self.get_lab_contacts
+            )
+        if self.use_preflight:
+            self.run_preflight()
+        for file_type, file_name, headers in SYNC_FILES:
+            if self.replay:
+                self.replay_file(file_type, file_name, headers)
+            else:
+                self.process_file(file_type, file_name, headers)
+        self.log(
+            "Sync index loaded with {} catalog queries".format(self.index.searches)
+        )
+        self.log(
+            "Woke {} objects from their brains, {} were revisited".format(
+                self.woken, self.objects.hits
+            )
+        )
+        self.log(self.reindex_queue.report())
+        if self.bulk_creator is not None:
+            self.log(self.bulk_creator.report())
+        self.log(self.policy.report())
         self.log("Sync process completed")
 
+    def run_preflight(self):
+        """Parse and validate the changed files concurrently before processing"""
+        jobs = []
+        for file_type, file_name, headers in SYNC_FILES:
+            file_path = data_file_path(self.sync_current_folder, file_name)
+            if file_path is None or self.fingerprint_unchanged(file_name):
+                continue
+            jobs.append((file_type, file_name, file_path, headers, self.use_mmap))
+        if not jobs:
+            return
+        start = time.time()
+        try:
+            self.preflight_results = preflight(jobs)
+        except Exception as e:
+            self.log(
+                "Preflight failed so files are read while processing: {}".format(e),
+                level="warn",
+            )
+            self.preflight_results = {}
+            return
+        for file_type, file_name, file_path, headers, use_mmap in jobs:
+            result = self.preflight_results[file_type]
+            for msg in result["errors"]:
+                self.log(msg, context=file_type, level="error")
+            for msg in result["warnings"]:
+                self.log(msg, context=file_type, level="warn")
+            self.log(
+                "Preflight found {} valid rows in {} with {} errors".format(
+                    result["num_rows"], file_name, len(result["errors"])
+                ),
+                context=file_type,
+            )
+        self.log("Preflight completed in {:.1f} seconds".format(time.time() - start))
+
     def process_file(self, file_type, file_name, headers=[]):
-        data = self.read_file_data(file_type, file_name, headers=headers)
+        if self.file_unchanged(file_type, file_name):
+            self.changed_keys[file_type] = set()
+            return
+        if file_type in self.preflight_results:
+            data = self.preflight_data(file_type, headers)
+        else:
+            data = self.read_file_data(file_type, file_name, headers=headers)
         if "FileNotFound" in data.get("errors", []):
             return
+        if data.get("errors", []):
+            # header errors are found before any row is read
+            self.log(
+                "File {} not processed because its headers are incorrect".format(
+                    file_name
+                ),
+                context=file_type,
+            )
+            return
+        data["validation"] = new_report()
+        data["rows"] = validated_rows(
+            data["rows"],
+            REQUIRED_FIELDS[file_type],
+            NATURAL_KEYS[file_type],
+            data["validation"],
+        )
+        self.apply_delta(file_type, file_name, data)
 
+        # Process Rules, rows are read from the file as they are consumed
+        if file_type == "Accounts":
+            self.process_account_rules(data, self.index)
+        elif file_type == "Locations":
+            self.process_locations_rules(data, self.index)
+        elif file_type == "Systems":
+            self.process_systems_rules(data, self.index)
+        elif file_type == "Contacts":
+            self.process_contacts_rules(data, self.index)
+        self.keep_rejected(file_type, headers)
+        self.policy.save()
         self.log(
-            "Found {} rows in {} with {} errros".format(
-                len(data["rows"]),
+            "Processed {} rows in {} with {} errros".format(
+                data["num_rows"],
                 file_name,
                 len(data["errors"]),
             ),
             context=file_type,
         )
-        if data.get("errors", []):
+        self.log_validation(file_type, file_name, data["validation"])
+        self.log(
+            "Memory after the {} pass: {}".format(file_type, self.memory.report()),
+            context=file_type,
+        )
+        delta = data.get("delta")
+        if delta is not None:
+            self.log(
+                "Skipped {} unchanged rows of {} that are in {}, processed {}".format(
+                    delta["unchanged"],
+                    file_name,
+                    os.path.basename(delta["file_path"]),
+                    delta["changed"],
+                ),
+                context=file_type,
+            )
+        return True
+
+    def replay_file(self, file_type, file_name, headers):
+        """Process the rejected rows of a data file
+
+        They are replaced by the rows rejected again, the file is removed
+        once all of them were processed.
+        """
+        rejected_name = rejected_file_name(file_name)
+        if not os.path.exists(os.path.join(self.sync_error_folder, rejected_name)):
+            self.log(
+                "No rejected rows of {} to replay".format(file_name), context=file_type
+            )
             return
+        self.process_file(file_type, rejected_name, headers)
 
-        # Process Rules
-        if file_type == "Accounts":
-            self.process_account_rules(data)
-        elif file_type == "Locations":
-            self.process_locations_rules(data)
-        elif file_type == "Systems":
-            self.process_systems_rules(data)
-        elif file_type == "Contacts":
-            self.process_contacts_rules(data)
-        if COMMIT_COUNT > 0:
-            transaction.commit()
-
-    def clean_row(self, row):
-        illegal_chars = ["\xef\xbb\xbf", "\xa0", "\u2019"]
-        cleaned = []
-        for cell in row:
-            cell = cell.strip()
-            cell = safe_unicode(cell).encode("utf-8")
-            new = ""
-            for char in cell:
-                if ord(char) > 128:
-                    continue
-                if char in illegal_chars:
-                    continue
-                new += char
-            cleaned.append(new)
-        return cleaned
+    def keep_rejected(self, file_type, headers):
+        """Keep the rows of a file that were rolled back, to be replayed
+
+        They are written to the rejected rows file of the data file once
+        the changes of the file are committed.
+        """
+        rows = self.rejected.get(file_type, [])
+        if not rows and not self.replay:
+            return
+        file_name = SYNC_FILE_NAMES[file_type]
+        rejected_name = rejected_file_name(file_name)
+        self.rejected_files.keep(file_type, file_name, headers)
+        if rows:
+            msg = "Keep {} rejected rows of {} in {} to be replayed".format(
+                len(rows), file_name, rejected_name
+            )
+        else:
+            msg = "All rejected rows of {} were processed, remove {}".format(
+                file_name, rejected_name
+            )
+        self.log("{}, once the changes are committed".format(msg), context=file_type)
+
+    def process_rows(self, file_type, data, process_row):
+        """Process the rows of a file, each in a savepoint of its own
+
+        A row that fails is rolled back and rejected on its own, the rows
+        before and after it are processed as usual. Rows whose parent row was
+        rejected are rejected with it, so they are replayed after it. Rows
+        are passed on with their number in the file. The objects the rows
+        look up are found a batch of rows at a time.
+        """
+        parent_field, parent_keys = self.rejected_parents(file_type)
+        for batch in iter_chunks(data["rows"], PREFETCH_ROWS):
+            rows = [row for _, row in batch]
+            self.run_step(partial(self.index.prefetch, file_type, rows))
+            for row_num, row in batch:
+                self.policy.row()
+                if parent_keys and getattr(row, parent_field) in parent_keys:
+                    error = "its {} {} was rejected".format(
+                        parent_field, getattr(row, parent_field)
+                    )
+                    step = partial(
+                        self.reject, file_type, row_num, row, error, rolled_back=False
+                    )
+                else:
+                    step = partial(
+                        self.process_row, file_type, row_num, row, process_row
+                    )
+                self.run_step(step)
+
+    def rejected_parents(self, file_type):
+        """Return the parent key field of a file type and the keys of the
+        parent rows that were rejected"""
+        if file_type not in PARENT_KEYS:
+            return None, set()
+        parent_type, parent_field = PARENT_KEYS[file_type]
+        (key_field,) = NATURAL_KEYS[parent_type]
+        rows = self.rejected.get(parent_type, [])
+        return parent_field, set(getattr(row, key_field) for row in rows)
+
+    def process_row(self, file_type, row_num, row, process_row):
+        """Process a row in a savepoint, rejecting it when it fails"""
+        logger.info("Process row {} from {} file".format(row_num, file_type))
+        marks = self.mark_changes()
+        try:
+            process_row(row_num, row)
+        except ConflictError:
+            raise
+        except Exception as e:
+            logger.exception("Row {} of the {} file failed".format(row_num, file_type))
+            self.rollback_changes(marks)
+            self.reject(file_type, row_num, row, e)
+
+    def mark_changes(self):
+        """Take a savepoint and mark what is queued and indexed at it"""
+        return (
+            self.policy.savepoint(),
+            self.reindex_queue.mark(),
+            self.index.mark(),
+            self.bulk_creator.mark() if self.bulk_creator else None,
+        )
+
+    def rollback_changes(self, marks):
+        """Roll the changes made since the marks were taken back"""
+        savepoint, queued, indexed, created = marks
+        savepoint.rollback()
+        self.reindex_queue.rollback(queued)
+        self.index.rollback(indexed)
+        if self.bulk_creator is not None:
+            self.bulk_creator.rollback(created)
+
+    def run_step(self, step):
+        """Make changes that are made again when the batch conflicts"""
+        self.batch["steps"].append(step)
+        try:
+            self.logged_step(step)
+        except ConflictError as e:
+            self.policy.retry(e)
+
+    def logged_step(self, step):
+        """Make a step, noting the logs it wrote"""
+        start = len(self.logs)
+        try:
+            step()
+        finally:
+            self.batch["logs"].append((start, len(self.logs)))
+
+    def new_batch(self):
+        """Start the steps of the changes until they are saved"""
+        self.batch = {
+            "steps": [],
+            # (start, end) of the logs of each step
+            "logs": [],
+            "rejected": dict(
+                (file_type, len(rows)) for file_type, rows in self.rejected.items()
+            ),
+            "rejected_count": self.rejected_count,
+            "held": len(self.held),
+        }
+
+    def flush_batch(self):
+        """Reindex the changed objects and finish the ones created in bulk
+
+        The rejected rows files kept are written when the transaction the
+        changes are saved in commits, it is a new one after a conflict.
+        """
+        self.rejected_files.join()
+        self.reindex_queue.flush()
+        if self.bulk_creator is not None:
+            self.bulk_creator.flush()
+
+    def saved(self):
+        """Start a new batch once the changes were saved"""
+        self.memory.committed()
+        self.index.saved()
+        self.new_batch()
+
+    def replay_batch(self):
+        """Make the changes of the batch again after a conflict aborted them
+
+        What the steps logged, rejected and loaded is forgotten first, the
+        steps do it again.
+        """
+        batch = self.batch
+        for start, end in reversed(batch["logs"]):
+            del self.logs[start:end]
+        batch["logs"] = []
+        for file_type, rows in self.rejected.items():
+            count = batch["rejected"].get(file_type, 0)
+            del rows[count:]
+        self.rejected_count = batch["rejected_count"]
+        count = batch["held"]
+        del self.held[count:]
+        self.reindex_queue.clear()
+        if self.bulk_creator is not None:
+            self.bulk_creator.clear()
+        self.index.reset()
+        self.objects.clear()
+        self.log(
+            "Changes since the last commit conflicted, making them again with {} steps, retry {} of {}".format(
+                len(batch["steps"]), self.policy.attempts, self.policy.retries
+            ),
+            level="warn",
+        )
+        for step in batch["steps"]:
+            self.logged_step(step)
+
+    def reject(self, file_type, row_num, row, error, rolled_back=True):
+        """Keep a row that was rolled back and forget what it changed"""
+        self.rejected.setdefault(file_type, []).append(row)
+        self.rejected_count += 1
+        # objects woken for the row may have been created by it and be gone
+        # after the rollback, the index was rolled back with the row
+        self.objects.clear()
+        self.log(
+            "Row {} of the {} file was {}rejected: {}".format(
+                row_num, file_type, "rolled back and " if rolled_back else "", error
+            ),
+            context=file_type,
+            level="error",
+        )
+
+    def log_validation(self, file_type, file_name, report):
+        """Log the rows held back by the validation of a file"""
+        for field, row_nums in sorted(report["missing"].items()):
+            self.log(
+                "Skipped {} rows of {} that have no {} value: rows {}".format(
+                    len(row_nums), file_name, field, format_rows(row_nums)
+                ),
+                context=file_type,
+                level="error",
+            )
+        if report["duplicates"]:
+            num_rows = sum(len(nums) - 1 for nums in report["duplicates"].values())
+            self.log(
+                "Skipped {} rows of {} that repeat the {} of an earlier row".format(
+                    num_rows, file_name, ", ".join(NATURAL_KEYS[file_type])
+                ),
+                context=file_type,
+                level="warn",
+            )
+            for key, row_nums in sorted(report["duplicates"].items()):
+                self.log(
+                    "{} {} is on rows {} of {}, only row {} was processed".format(
+                        ", ".join(NATURAL_KEYS[file_type]),
+                        ", ".join(key),
+                        format_rows(row_nums),
+                        file_name,
+                        row_nums[0],
+                    ),
+                    context=file_type,
+                    level="warn",
+                )
+
+    def apply_delta(self, file_type, file_name, data):
+        """Only pass on the rows added or changed since the last archived file
+
+        Rows whose parent row (e.g. the location of a system) was passed on
+        are passed on as well. Nothing is filtered on a full sync, when there
+        is no usable archived file or when the parent rows were not filtered.
+        """
+        self.changed_keys[file_type] = None
+        if self.full_sync:
+            return
+        parent_field = None
+        parent_keys = None
+        if file_type in PARENT_KEYS:
+            parent_type, parent_field = PARENT_KEYS[file_type]
+            parent_keys = self.changed_keys.get(parent_type, set())
+            if parent_keys is None:
+                self.log(
+                    "Process all rows of {} because all {} rows were processed".format(
+                        file_name, parent_type
+                    ),
+                    context=file_type,
+                )
+                return
+        file_path = latest_archived_file(self.sync_archive_folder, file_name)
+        if file_path is None:
+            self.log(
+                "Process all rows of {} because it has no archived file".format(
+                    file_name
+                ),
+                context=file_type,
+            )
+            return
+        key_fields = NATURAL_KEYS[file_type]
+        snapshot = read_snapshot(file_path, data["headers"], key_fields)
+        if snapshot is None:
+            self.log(
+                "Process all rows of {} because the headers of {} are incorrect".format(
+                    file_name, file_path
+                ),
+                context=file_type,
+            )
+            return
+        self.changed_keys[file_type] = set()
+        data["delta"] = {"file_path": file_path, "changed": 0, "unchanged": 0}
+        data["rows"] = changed_rows(
+            data["rows"],
+            snapshot,
+            key_fields,
+            data["delta"],
+            self.changed_keys[file_type],
+            parent_field=parent_field,
+            parent_keys=parent_keys,
+        )
+
+    def file_unchanged(self, file_type, file_name):
+        """Check the file against its fingerprint in the last archived run
+
+        The fingerprint is kept so it can be stored once the files of this
+        run are archived. A full sync never skips a file.
+        """
+        if data_file_path(self.sync_current_folder, file_name) is None:
+            return False
+        if not self.fingerprint_unchanged(file_name):
+            return False
+        self.log(
+            "File {} is unchanged since the last archived run, skip it".format(
+                file_name
+            ),
+            context=file_type,
+        )
+        return True
+
+    def fingerprint_unchanged(self, file_name):
+        """Fingerprint a file once and compare it with the last archived run"""
+        if file_name not in self.fingerprints:
+            file_path = data_file_path(self.sync_current_folder, file_name)
+            self.fingerprints[file_name] = file_fingerprint(file_path)
+        if self.full_sync:
+            return False
+        return self.archived_fingerprints.get(file_name) == self.fingerprints[file_name]
 
     def write_log_file(self):
         timestamp = DateTime.strftime(DateTime(), "%Y%m%d-%H%M-%S")
@@ -459,80 +991,131 @@ class SyncLocationsView(BrowserView):
         return file_name
 
     def read_file_data(self, file_type, file_name, headers):
+        """Open a data file and validate its header row
+
+        The returned dict holds a `rows` generator that reads, cleans and
+        converts one row at a time, with its number in the file, so rules can be applied to the first rows
+        before the last ones are parsed. Header errors are in `errors` when
+        this returns, row errors are appended while `rows` is consumed and
+        `num_rows` counts the rows yielded so far.
+        """
         # self.log("Get {} data file started".format(file_type))
-        file_path = "{}/{}".format(self.sync_current_folder, file_name)
-        if not os.path.exists(file_path):
+        file_path = data_file_path(self.sync_current_folder, file_name)
+        if file_path is None:
             self.log(
                 "{} file not found".format(file_type), context=file_type, level="error"
             )
-            return {"headers": [], "rows": [], "errors": ["FileNotFound"]}
-
-        rows = []
-        errors = []
-        with open(file_path) as csvfile:
-            reader = csv.reader(csvfile, delimiter=",", quotechar='"')
-            for i, row in enumerate(reader):
-                if len(row) == 0:
-                    continue
-                row = self.clean_row(row)
-                if i == 0:
-                    if len(headers) != len(row):
-                        msg = "File {} has incorrect number of headers: found {}, it must be {}".format(
-                            file_name, len(row), len(headers)
-                        )
-                        self.log(msg, context=file_type, level="error")
-                        errors.append(msg)
-                        break
-                    if headers != row:
-                        msg = "File {} has incorrect headers: found [{}], it must be [{}]".format(
-                            file_name, ", ".join(row), ", ".join(headers)
-                        )
-                        self.log(msg, context=file_type, level="error")
-                        errors.append(msg)
-                        break
-                    self.log(
-                        "File {} with correct {} header columns".format(
-                            file_name, len(row)
-                        ),
-                        context=file_type,
-                    )
-                    continue
-                if len(headers) != len(row):
-                    msg = "File {} incorrect number of columns {} in row {}".format(
-                        file_name,
-                        len(row),
-                        i,
-                    )
-                    errors.append(msg)
-                    continue
-                # Process cells in row
-                adict = {}
-                for idx, cell in enumerate(row):
-                    try:
-                        val = row[idx].decode("utf-8", "strict")
-                    except UnicodeDecodeError:
-                        self.log(
-                            "Error on row {} of file {} because of decoding of value {} in field {}. But offending characters have been replaced with spaces".format(
-                                i,
-                                file_name,
-                                row[idx],
-                                headers[idx],
-                            ),
-                            context=file_type,
-                            level="warn",
-                        )
-                        val = row[idx].decode("utf-8", "replace").replace("\ufffd", " ")
-                    adict[headers[idx]] = val
-                rows.append(adict)
-                # self.log("File {} row {}: {}".format(file_name, i, ", ".join(row)))
+            return {"headers": [], "rows": iter([]), "errors": ["FileNotFound"]}
+
+        data = {"headers": headers, "rows": iter([]), "errors": [], "num_rows": 0}
+        stats = new_stats()
+        csvfile = open_data_file(file_path)
+        reader = csv.reader(
+            decoded_lines(file_lines(csvfile, self.use_mmap), stats),
+            delimiter=",",
+            quotechar='"',
+        )
+        msg = read_header(reader, file_name, headers)
+        if msg is not None:
+            csvfile.close()
+            self.log(msg, context=file_type, level="error")
+            data["errors"].append(msg)
+            return data
+
+        self.log(
+            "File {} with correct {} header columns".format(file_name, len(headers)),
+            context=file_type,
+        )
+        data["rows"] = self._iter_file_rows(
+            csvfile, reader, file_type, file_name, data, stats
+        )
+        return data
+
+    def _iter_file_rows(self, csvfile, reader, file_type, file_name, data, stats):
+        """Yield the row number and the record of the file type of the data
+        rows of an open csv file"""
+        record = RECORD_TYPES[file_type]
+
+        def on_error(msg):
+            self.log(msg, context=file_type, level="error")
+            data["errors"].append(msg)
+
+        try:
+            for row_num, values in iter_values(
+                reader, file_name, data["headers"], stats, on_error
+            ):
+                data["num_rows"] += 1
+                yield row_num, record(*values)
+        finally:
+            csvfile.close()
+        for msg in decoding_warnings(file_name, stats):
+            self.log(msg, context=file_type, level="warn")
         self.log("Read {} data file complete".format(file_type), context=file_type)
-        return {"headers": headers, "rows": rows, "errors": errors}
 
-    def _move_file(self, file_name, dest_folder):
-        from_file_path = "{}/{}".format(self.sync_current_folder, file_name)
-        if not os.path.exists(from_file_path):
-            self.log(
-                "Cannot move file {} because it's not found".format(from_file_path),
+    def preflight_data(self, file_type, headers):
+        """Return the preflight result of a file like read_file_data does
+
+        Errors and warnings were logged by the preflight already.
+        """
+        result = self.preflight_results.pop(file_type)
+        data = {
+            "headers": headers,
+            "rows": iter([]),
+            "errors": [],
+            "num_rows": result["num_rows"],
+        }
+        if "header_error" in result:
+            data["errors"].append(result["header_error"])
+            return data
+        data["rows"] = self._iter_preflight_rows(file_type, result, data)
+        return data
+
+    def _iter_preflight_rows(self, file_type, result, data):
+        """Yield the row number and the record of the file type of the rows in
+        the preflight batches"""
+        record = RECORD_TYPES[file_type]
+        data["errors"].extend(result["errors"])
+        batches = result["batches"]
+        while batches:
+            for row_num, values in batches.pop(0):
+                yield row_num, record(*values)
+
+    def archive_files(self, committed):
+        """Archive the data files and their fingerprints, after the commit
+
+        When the commit failed the files are left in the current folder to
+        be processed again. The run log was written and emailed already, so
+        the files moved are only logged in the instance log.
+        """
+        if not committed:
+            logger.error(
+                "The changes of the sync were not committed, the data files are not archived"
+            )
+            return
+        self._move_file(
+            ACCOUNT_FILE_NAME, self.sync_archive_folder, log=self.log_after_run
+        )
+        self._move_file(
+            LOCATION_FILE_NAME, self.sync_archive_folder, log=self.log_after_run
+        )
+        self._move_file(
+            SYSTEM_FILE_NAME, self.sync_archive_folder, log=self.log_after_run
+        )
+        self._move_file(
+            CONTACT_FILE_NAME, self.sync_archive_folder, log=self.log_after_run
+        )
+        write_fingerprints(self.sync_archive_folder, self.fingerprints)
+
+    def _move_file(self, file_name, dest_folder, log=None):
+        """Move a data file to a folder, logged with self.log by default"""
+        if log is None:
+            log = self.log
+        from_file_path = data_file_path(self.sync_current_folder, file_name)
+        if from_file_path is None:
+            log(
+                "Cannot move file {} because it's not found".format(
+                    "{}/{}".format(self.sync_current_folder, file_name)
+                ),
                 context="MoveFiles",
                 level="error",
             )
@@ -541,575 +1124,568 @@ class SyncLocationsView(BrowserView):
             file_name = ".".join(file_name.split(".")[:-1])
             timestamp = DateTime.strftime(DateTime(), "%Y%m%d.%H%M")
             to_file_path = "{}/{}.{}.csv".format(dest_folder, file_name, timestamp)
+            if is_gzipped(from_file_path):
+                # archived as it is, still compressed
+                to_file_path += GZIP_SUFFIX
             os.rename(from_file_path, to_file_path)
-            self.log(
+            log(
                 "Moved file {} to {} folder".format(file_name, dest_folder),
                 context="MoveFiles",
             )
             return
         dest_file_path = "{}/{}".format(dest_folder, file_name)
         if os.path.exists(dest_file_path):
-            self.log(
+            log(
                 "Cannot move file {} because it's already in {} folder".format(
                     file_name, dest_folder
                 ),
                 context="MoveFiles",
             )
             return
-        self.log(
+        log(
             "Cannot move file {}".format(file_name), context="MoveFiles", level="error"
         )
 
-    def process_account_rules(self, data):
-        portal = api.get_portal()
+    def search_portal_type(self, portal_type, **query):
+        """Return the brains of a portal type matching query, for the sync index"""
+        query["portal_type"] = portal_type
+        return bika_api.search(query, catalog=CATALOGS[portal_type])
+
+    def get_lab_contacts(self):
+        """Return the lab contacts, for the sync index"""
+        return api.get_portal().bika_setup.bika_labcontacts.values()
+
+    def wake(self, brain):
+        """Return the object of a brain, keeping the objects used last"""
+        if isinstance(brain, CreatedBrain):
+            return brain.getObject()
+        if not api.is_brain(brain) and not isinstance(brain, StoredBrain):
+            return api.get_object(brain)
+        return self.objects.get(brain.getPath(), lambda: self.load(brain))
+
+    def load(self, brain):
+        """Wake the object of a brain, the cache is minimized over budget"""
+        self.woken += 1
+        self.memory.woke()
+        if isinstance(brain, StoredBrain):
+            return api.get_object_by_path(brain.getPath())
+        return api.get_object(brain)
+
+    def get_setting(self, name, default):
+        """Return a setting of the control panel, default if it has no value"""
+        value = api.get_registry_record(
+            "senaite.locationsync.location_sync_control_panel.{}".format(name),
+            default=None,
+        )
+        if value is None:
+            return default
+        return value
 
-        # Prep clients
-        clients = bika_api.search(
-            {"portal_type": "Client"}, catalog="senaite_catalog_client"
+    def create_object(self, container, portal_type, **values):
+        """Create an object, in bulk when the run creates in bulk"""
+        if self.bulk_creator is None:
+            return bika_api.create(container, portal_type, **values)
+        return self.bulk_creator.add(container, portal_type, **values)
+
+    def created_brain(self, obj, **metadata):
+        """Return the brain of a created object, None if it is not found
+
+        Objects created in bulk are not indexed yet, a CreatedBrain with the
+        metadata given stands in for their brain.
+        """
+        if self.bulk_creator is None:
+            return get_brain_by_uid(obj.UID())
+        return CreatedBrain(obj, api.get_workflow_status_of(obj), **metadata)
+
+    def do_transition(self, obj, transition, index):
+        """Transition an object and note its new review state in the index"""
+        obj = self.wake(obj)
+        api.do_transition_for(obj, transition)
+        index.set_review_state(api.get_path(obj), api.get_workflow_status_of(obj))
+        index_object(obj)
+
+    def process_account_rules(self, data, index):
+        self.process_rows(
+            "Accounts", data, lambda i, row: self.process_account_row(i, row, index)
         )
-        client_ids = [c["getClientID"] for c in clients]
-        num_rows = len(data["rows"])
-        for i, row in enumerate(data["rows"]):
-            if COMMIT_COUNT > 0 and i % COMMIT_COUNT == 0:
-                transaction.commit()
-            logger.info("Process row {} of {} from Accounts file".format(i, num_rows))
-            if len(row.get("Customer_Number", "")) == 0:
-                self.log(
-                    "Row {} of Account file has no Customer_Number value".format(i),
-                    context="Accounts",
-                    level="error",
-                )
-                continue
-            if SETUP_RUN and (row["Inactive"] == "1" or row["On_HOLD"] == "1"):
-                self.log(
-                    "Row {} of Contact file is inactive so has been ignored in this setup run".format(
-                        i
-                    ),
-                    context="Accounts",
-                    level="info",
-                )
-                continue
-            if row["Customer_Number"] in client_ids:
-                # Client Already Exists
-                client = [
-                    c for c in clients if row["Customer_Number"] == c["getClientID"]
-                ][0]
-                self.log(
-                    "Found Client {} ({})".format(
-                        row["Account_name"], row["Customer_Number"]
-                    ),
-                    context="Accounts",
-                )
-                current_state = api.get_workflow_status_of(client)
-                if row["Inactive"] == "1" or row["On_HOLD"] == "1":
-                    if current_state == "inactive":
-                        self.log(
-                            "Client {} already inactive".format(row["Account_name"]),
-                            context="Accounts",
-                        )
-                    else:
-                        api.do_transition_for(client, "deactivate")
-                        self.log(
-                            "Deactivated Client {}".format(row["Account_name"]),
-                            context="Accounts",
-                            action="Deactivated",
-                        )
+        return True
+
+    def process_account_row(self, i, row, index):
+        portal = api.get_portal()
+        if SETUP_RUN and (row.Inactive == "1" or row.On_HOLD == "1"):
+            self.log(
+                "Row {} of Contact file is inactive so has been ignored in this setup run".format(
+                    i
+                ),
+                context="Accounts",
+                level="info",
+            )
+            return
+        client = index.get_client(row.Customer_Number)
+        if client is not None:
+            # Client Already Exists
+            self.log(
+                "Found Client {} ({})".format(row.Account_name, row.Customer_Number),
+                context="Accounts",
+            )
+            current_state = index.get_review_state(client)
+            if row.Inactive == "1" or row.On_HOLD == "1":
+                if current_state == "inactive":
+                    self.log(
+                        "Client {} already inactive".format(row.Account_name),
+                        context="Accounts",
+                    )
                 else:
-                    # marked in file as active
-                    if current_state == "inactive":
-                        api.do_transition_for(client, "activate")
-                        self.log(
-                            "Activated Client {}".format(row["Account_name"]),
-                            context="Accounts",
-                            action="Activated",
-                        )
-                    if client.Title != row["Account_name"]:
-                        client = api.get_object(client)
-                        self.log(
-                            "Rename Client '{}' title to {}".format(
-                                client.Title(), row["Account_name"]
-                            ),
-                            context="Accounts",
-                            action="Renamed",
-                        )
-                        client.setTitle(row["Account_name"])
-                        client.reindexObject()
+                    self.do_transition(client, "deactivate", index)
+                    self.log(
+                        "Deactivated Client {}".format(row.Account_name),
+                        context="Accounts",
+                        action="Deactivated",
+                    )
             else:
-                # Client not in DB
-                client = bika_api.create(
-                    portal.clients,
-                    "Client",
-                    ClientID=row["Customer_Number"],
-                    title=row["Account_name"],
-                )
-
-                self.log(
-                    "Created Client {}".format(row["Account_name"]),
-                    action="Created",
-                    context="Accounts",
-                )
-                if row["Inactive"] == "1" or row["On_HOLD"] == "1":
-                    api.do_transition_for(client, "deactivate")
+                # marked in file as active
+                if current_state == "inactive":
+                    self.do_transition(client, "activate", index)
                     self.log(
-                        "Deactivate newly created client {}".format(
-                            row["Account_name"]
+                        "Activated Client {}".format(row.Account_name),
+                        context="Accounts",
+                        action="Activated",
+                    )
+                if client.Title != row.Account_name:
+                    client = self.wake(client)
+                    self.log(
+                        "Rename Client '{}' title to {}".format(
+                            client.Title(), row.Account_name
                         ),
                         context="Accounts",
-                        action="Deactivated",
+                        action="Renamed",
                     )
+                    client.setTitle(row.Account_name)
+                    self.reindex_queue.add(client, "title")
+                    index_object(client)
+        else:
+            # Client not in DB
+            client = self.create_object(
+                portal.clients,
+                "Client",
+                ClientID=row.Customer_Number,
+                title=row.Account_name,
+            )
+
+            self.log(
+                "Created Client {}".format(row.Account_name),
+                action="Created",
+                context="Accounts",
+            )
+            index_object(client)
+            client_brain = self.created_brain(client, getClientID=row.Customer_Number)
+            if client_brain:
+                index.add_client(row.Customer_Number, client_brain)
+            if row.Inactive == "1" or row.On_HOLD == "1":
+                self.do_transition(client, "deactivate", index)
+                self.log(
+                    "Deactivate newly created client {}".format(row.Account_name),
+                    context="Accounts",
+                    action="Deactivated",
+                )
+
+    def process_locations_rules(self, data, index):
+        del self.held[:]
+
+        def process_row(i, row):
+            row_held = []
+            self.process_location_row(i, row, index, row_held)
+            self.held.extend(row_held)
+
+        self.process_rows("Locations", data, process_row)
+        self.run_step(lambda: self.deactivate_systems(self.held, index))
         return True
 
-    def process_locations_rules(self, data):
+    def process_location_row(self, i, row, index, held):
         portal = api.get_portal()
-
-        # Prep lab_contacts
         lab_contacts_folder = portal.bika_setup.bika_labcontacts
-        lab_contact_names = []
-        lab_contacts = []
-        for contact in lab_contacts_folder.values():
-            lab_contacts.append(contact)
-            contact_title = contact.Title().strip("--- ")
-            lab_contact_names.append(contact_title)
-
-        # Prep clients
-        clients = bika_api.search(
-            {"portal_type": "Client"}, catalog="senaite_catalog_client"
+        if SETUP_RUN and (row.HOLD == "1" or row.Cancel_Box == "1"):
+            self.log(
+                "Row {} of Locations file is on hold so has been ignored in this setup run".format(
+                    i
+                ),
+                context="Locations",
+                level="info",
+            )
+            return
+        # field validation - client must exist
+        client = index.get_client(row.Customer_Number)
+        if client is None:
+            self.log(
+                "Client ID {} on row {} of the locations file was not found in DB".format(
+                    row.Customer_Number, i
+                ),
+                context="Locations",
+                level="warn",
+            )
+            return
+        self.log(
+            "Found Client {} ({})".format(client.Title, row.Customer_Number),
+            context="Locations",
         )
-        client_ids = [c["getClientID"] for c in clients]
-        num_rows = len(data["rows"])
-        for i, row in enumerate(data["rows"]):
-            if COMMIT_COUNT > 0 and i % COMMIT_COUNT == 0:
-                transaction.commit()
-            logger.info("Process row {} of {} from Locations file".format(i, num_rows))
-            if SETUP_RUN and (row["HOLD"] == "1" or row["Cancel_Box"] == "1"):
+
+        location = None
+        location_brain = index.get_location(client.getPath(), row.Locations_id)
+        if location_brain is not None:
+            # Location exists
+            # If row['HOLD'] or row['Cancel_Box'], see code below
+            # If row['account_manager1'], see code below
+            # For address field in row, see code below
+            self.log("Found location {}".format(row.Locations_id), context="Locations")
+        else:
+            # Location does NOT exist
+            client_obj = self.wake(client)
+            title = row.location_name
+            location = self.create_object(
+                client_obj,
+                "SamplePointLocation",
+                title=title,
+                # sample_point_location_id=row.Locations_id,
+            )
+            location.setSamplePointLocationID(row.Locations_id)
+            self.reindex_queue.add(location, "SamplePointLocationID")
+            index_object(location)
+            client_path = "/".join(client_obj.getPhysicalPath())
+            # location_path = "/".join(location.getPhysicalPath())
+            self.log(
+                "Created location {} in Client {} at {}".format(
+                    title, client.Title, client_path
+                ),
+                context="Locations",
+                action="Created",
+            )
+            location_brain = self.created_brain(
+                location,
+                getSamplePointLocationID=row.Locations_id,
+                getAccountManagers=[],
+            )
+            if not location_brain:
                 self.log(
-                    "Row {} of Locations file is on hold so has been ignored in this setup run".format(
-                        i
+                    "Failed to find newly created location {} and client {}".format(
+                        title,
+                        client.Title,
                     ),
                     context="Locations",
-                    level="info",
-                )
-                continue
-            # field validation - required fields
-            if len(row.get("Customer_Number", "")) == 0:
-                self.log(
-                    "Row {} of Locations file has no Customer_Number value".format(i),
-                    context="Locations",
                     level="error",
+                    action="ReportToSysAdmin",
                 )
-                continue
-            if len(row.get("Locations_id", "")) == 0:
-                self.log(
-                    "Row {} of Locations file has no Locations_id value".format(i),
-                    context="Locations",
-                    level="error",
-                )
-                continue
-            # field validation - client must exist
-            if row["Customer_Number"] not in client_ids:
+                return
+            else:
+                index.add_location(client_path, row.Locations_id, location_brain)
                 self.log(
-                    "Client ID {} on row {} of the locations file was not found in DB".format(
-                        row["Customer_Number"], i
+                    "Found newly created location {} and client {}".format(
+                        location_brain.Title,
+                        client.Title,
                     ),
                     context="Locations",
-                    level="warn",
+                    level="info",
                 )
-                continue
-            client = [c for c in clients if row["Customer_Number"] == c["getClientID"]][
-                0
-            ]
-            self.log(
-                "Found Client {} ({})".format(client.Title, row["Customer_Number"]),
-                context="Locations",
-            )
 
-            locations = bika_api.search(
-                {
-                    "portal_type": "SamplePointLocation",
-                    "path": {"query": client.getPath()},
-                    "getSamplePointLocationID": row["Locations_id"],
-                },
-                catalog="senaite_catalog_setup",
-            )
-            location = None
-            if locations:
-                # Location exists
-                location_brain = locations[0]
-                # If row['HOLD'] or row['Cancel_Box'], see code below
-                # If row['account_manager1'], see code below
-                # For address field in row, see code below
+        # Rules for if location existed or has just been created
+        if row.HOLD == "1" or row.Cancel_Box == "1":
+            # deactivate location and children
+            current_state = "active"
+            if hasattr(location_brain, "review_state"):
+                current_state = index.get_review_state(location_brain)
+            if current_state == "active":
+                if location is None:
+                    location = self.wake(location_brain)
+                self.do_transition(location, "deactivate", index)
                 self.log(
-                    "Found location {}".format(row["Locations_id"]), context="Locations"
-                )
-            else:
-                # Location does NOT exist
-                client_obj = api.get_object(client)
-                title = row["location_name"]
-                location = bika_api.create(
-                    client_obj,
-                    "SamplePointLocation",
-                    title=title,
-                    # sample_point_location_id=row["Locations_id"],
+                    "Location {} in Client {} has been deactivated".format(
+                        location_brain.Title, client.Title
+                    ),
+                    context="Locations",
+                    action="Deactivated",
                 )
-                location.setSamplePointLocationID(row["Locations_id"])
-                client_path = "/".join(client_obj.getPhysicalPath())
-                # location_path = "/".join(location.getPhysicalPath())
+            held.append((location_brain, client.Title))
+        if row.account_manager1:
+            contact_uid = index.get_lab_contact(row.account_manager1)
+            if contact_uid is not None:
+                contact_title = index.get_lab_contact_title(contact_uid)
                 self.log(
-                    "Created location {} in Client {} at {}".format(
-                        title, client.Title, client_path
+                    "Found lab contact {} for Location {}".format(
+                        contact_title, location_brain.Title
                     ),
                     context="Locations",
-                    action="Created",
                 )
-                location_brain = get_brain_by_uid(location.UID())
-                if not location_brain:
-                    self.log(
-                        "Failed to find newly created location {} and client {}".format(
-                            title,
-                            client.Title,
-                        ),
-                        context="Locations",
-                        level="error",
-                        action="ReportToSysAdmin",
+            else:
+                firstname = " ".join(row.account_manager1.split(" ")[:-1])
+                if len(firstname) == 0:
+                    firstname = "---"
+                surname = row.account_manager1.split(" ")[-1]
+                try:
+                    contact = bika_api.create(
+                        lab_contacts_folder,
+                        "LabContact",
+                        Surname=surname,
+                        Firstname=firstname,
                     )
-                    continue
-                else:
+                except Exception:
                     self.log(
-                        "Found newly created location {} and client {}".format(
+                        "Failed creating Lab Contact {} for location {} and client {}".format(
+                            row.account_manager1,
                             location_brain.Title,
                             client.Title,
                         ),
                         context="Locations",
-                        level="info",
+                        level="error",
+                        action="ReportToSysAdmin",
                     )
+                    return
 
-            # Rules for if location existed or has just been created
-            if row["HOLD"] == "1" or row["Cancel_Box"] == "1":
-                # deactivate location and children
-                current_state = "active"
-                if hasattr(location_brain, "review_state"):
-                    current_state = location_brain.review_state
-                if current_state == "active":
-                    if location is None:
-                        location = api.get_object(location_brain)
-                    api.do_transition_for(location, "deactivate")
-                    self.log(
-                        "Location {} in Client {} has been deactivated".format(
-                            location_brain.Title, client.Title
-                        ),
-                        context="Locations",
-                        action="Deactivated",
-                    )
-                systems = bika_api.search(
-                    {
-                        "portal_type": "SamplePoint",
-                        "path": {"query": location_brain.getPath()},
-                    },
-                    catalog="senaite_catalog_setup",
+                contact_uid = contact.UID()
+                contact_title = contact.Title()
+                index.add_lab_contact(row.account_manager1, contact_uid, contact_title)
+                self.log(
+                    "Created a Lab Contact {} for location {} and client {}".format(
+                        contact_title, location_brain.Title, client.Title
+                    ),
+                    context="Locations",
+                    action="Created",
                 )
-                for system in systems:
-                    if system.review_state == "active":
-                        system = api.get_object(system)
-                        api.do_transition_for(system, "deactivate")
-                        self.log(
-                            "System {} in Location {} in Client {} has been deactivated".format(
-                                system.Title(), location_brain.Title, client.Title
-                            ),
-                            context="Locations",
-                            action="Deactivated",
-                        )
-            if row["account_manager1"]:
-                if row["account_manager1"] in lab_contact_names:
-                    contact = [
-                        c
-                        for c in lab_contacts
-                        if row["account_manager1"] == c.Title().strip("--- ")
-                    ][0]
-                    self.log(
-                        "Found lab contact {} for Location {}".format(
-                            contact.Title(), location_brain.Title
-                        ),
-                        context="Locations",
-                    )
-                else:
-                    firstname = " ".join(row["account_manager1"].split(" ")[:-1])
-                    if len(firstname) == 0:
-                        firstname = "---"
-                    surname = row["account_manager1"].split(" ")[-1]
-                    try:
-                        contact = bika_api.create(
-                            lab_contacts_folder,
-                            "LabContact",
-                            Surname=surname,
-                            Firstname=firstname,
-                        )
-                    except Exception:
-                        self.log(
-                            "Failed creating Lab Contact {} for location {} and client {}".format(
-                                contact.Title(),
-                                location_brain.Title,
-                                client.Title,
-                            ),
-                            context="Locations",
-                            level="error",
-                            action="ReportToSysAdmin",
-                        )
-                        continue
-
-                    lab_contacts.append(contact)
-                    contact_title = contact.Title().strip("--- ")
-                    lab_contact_names.append(contact_title)
+                # TODO Notify lab admin that new lab contact created with no email
+            contacts = None
+            if hasattr(location_brain, "getAccountManagers"):
+                contacts = location_brain.getAccountManagers
+            if contacts is None:
+                contacts = []
+            if contact_uid not in contacts:
+                contacts.append(contact_uid)
+                if location is None:
+                    location = self.wake(location_brain)
+                location.setAccountManagers(contacts)
+                self.reindex_queue.add(location, "AccountManagers")
+                self.log(
+                    "Added Lab Contact {} to location {} and client {}".format(
+                        contact_title, location_brain.Title, client.Title
+                    ),
+                    context="Locations",
+                    action="Added",
+                )
+            # Get address from row and update location, new or old
+            address = self._get_address_field(row, row_num=i)
+            if address:
+                values = (frozen_address([address]),)
+                if location is None and index.get_values(location_brain) != values:
+                    location = self.wake(location_brain)
+            if address and location is not None:
+                old_address = location.getAddress()
+                if [address] != old_address:
+                    location.setAddress([address])
+                    self.reindex_queue.add(location, "Address")
                     self.log(
-                        "Created a Lab Contact {} for location {} and client {}".format(
-                            contact.Title(), location_brain.Title, client.Title
+                        "Changed Address to location {} and client {} from {} to {}".format(
+                            location_brain.Title, client.Title, old_address, address
                         ),
                         context="Locations",
-                        action="Created",
+                        action="Added",
                     )
-                    # TODO Notify lab admin that new lab contact created with no email
-                contacts = None
-                if hasattr(location_brain, "getAccountManagers"):
-                    contacts = location_brain.getAccountManagers
-                if contacts is None:
-                    contacts = []
-                if contact.UID() not in contacts:
-                    contacts.append(contact.UID())
-                    if location is None:
-                        location = api.get_object(location_brain)
-                    location.setAccountManagers(contacts)
+        if location is not None:
+            index_object(location)
+
+    def deactivate_systems(self, held, index):
+        """Deactivate the active systems of the locations on hold
+
+        The systems of all locations are found at once. Locations that are
+        inactive already are included, the systems pass may have created
+        active systems in them since they were deactivated. Each system is
+        deactivated in a savepoint, one that fails is rolled back and logged.
+        """
+        paths = [location_brain.getPath() for location_brain, _ in held]
+        systems = index.get_active_systems_in(paths)
+        for location_brain, client_title in held:
+            for system in systems.pop(location_brain.getPath(), []):
+                marks = self.mark_changes()
+                try:
+                    self.deactivate_system(system, location_brain, client_title, index)
+                except ConflictError:
+                    raise
+                except Exception as e:
+                    logger.exception("Deactivating {} failed".format(system.getPath()))
+                    self.rollback_changes(marks)
                     self.log(
-                        "Added Lab Contact {} to location {} and client {}".format(
-                            contact.Title(), location_brain.Title, client.Title
+                        "System {} in Location {} could not be deactivated and was rolled back: {}".format(
+                            system.Title, location_brain.Title, e
                         ),
                         context="Locations",
-                        action="Added",
+                        level="error",
                     )
-                # Get address from row and update location, new or old
-                address = self._get_address_field(row, row_num=i)
-                if address:
-                    if location is None:
-                        location = api.get_object(location_brain)
-                    old_address = location.getAddress()
-                    if [address] != old_address:
-                        location.setAddress([address])
-                        self.log(
-                            "Changed Address to location {} and client {} from {} to {}".format(
-                                location_brain.Title, client.Title, old_address, address
-                            ),
-                            context="Locations",
-                            action="Added",
-                        )
 
-        return True
+    def deactivate_system(self, system, location_brain, client_title, index):
+        system = self.wake(system)
+        self.do_transition(system, "deactivate", index)
+        self.log(
+            "System {} in Location {} in Client {} has been deactivated".format(
+                system.Title(), location_brain.Title, client_title
+            ),
+            context="Locations",
+            action="Deactivated",
+        )
 
-    def process_systems_rules(self, data):
-        locations = bika_api.search(
-            {"portal_type": "SamplePointLocation"}, catalog="senaite_catalog_setup"
+    def process_systems_rules(self, data, index):
+        self.process_rows(
+            "Systems", data, lambda i, row: self.process_system_row(i, row, index)
         )
-        location_ids = [loc.getSamplePointLocationID for loc in locations]
-        num_rows = len(data["rows"])
-        for i, row in enumerate(data["rows"]):
-            if COMMIT_COUNT > 0 and i % COMMIT_COUNT == 0:
-                transaction.commit()
-            logger.info("Process row {} of {} from Systems file".format(i, num_rows))
-            if SETUP_RUN and row["Inactive_Retired_Flag"] == "1":
-                self.log(
-                    "Row {} of System file is on hold so has been ignored in this setup run".format(
-                        i
-                    ),
-                    context="Systems",
-                    level="info",
-                )
-                continue
-            # field validation - required fields
-            if len(row.get("SystemID", "")) == 0:
-                self.log(
-                    "System on row {} with name {} in location {} has no SystemID field".format(
-                        i,
-                        row.get("system_name", "missing"),
-                        row.get("Location_id", "missing"),
-                    ),
-                    context="Systems",
-                    level="error",
-                )
-                continue
-            if row["Location_id"] not in location_ids:
-                msg = "Location {} on row {} in systems file not found in DB".format(
-                    row["Location_id"], i
-                )
-                self.log(msg, level="warn", context="Systems")
-                continue
-            location = None
-            location_brain = [
-                loc
-                for loc in locations
-                if row["Location_id"] == loc.getSamplePointLocationID
-            ][0]
-            self.log("Found Location {}".format(row["Location_id"]), context="Systems")
-            systems = bika_api.search(
-                {
-                    "portal_type": "SamplePoint",
-                    "path": {"query": location_brain.getPath()},
-                    "getSamplePointID": row["SystemID"],
-                },
-                catalog="senaite_catalog_setup",
+        return True
+
+    def process_system_row(self, i, row, index):
+        if SETUP_RUN and row.Inactive_Retired_Flag == "1":
+            self.log(
+                "Row {} of System file is on hold so has been ignored in this setup run".format(
+                    i
+                ),
+                context="Systems",
+                level="info",
             )
-            reindex = False
-            if len(systems) > 0:
-                system = api.get_object(systems[0])
-                self.log(
-                    "Found System {} with ID {} in Location {}".format(
-                        system.Title(), row["SystemID"], location_brain.Title
-                    ),
-                    context="Systems",
-                )
-                if row["Inactive_Retired_Flag"] == "1":
-                    if api.get_workflow_status_of(system) == "active":
-                        self.log(
-                            "Deactivate System {} in location {} beacuse it's marked as Inactive_Retired_Flag".format(
-                                row["system_name"], location_brain.Title
-                            ),
-                            context="Systems",
-                            action="Deactivated",
-                        )
-                        api.do_transition_for(system, "deactivate")
-            else:
-                # Create new system
-                if row["Inactive_Retired_Flag"] == "1":
+            return
+        location_brain = index.get_location_by_id(row.Location_id)
+        if location_brain is None:
+            msg = "Location {} on row {} in systems file not found in DB".format(
+                row.Location_id, i
+            )
+            self.log(msg, level="warn", context="Systems")
+            return
+        location = None
+        self.log("Found Location {}".format(row.Location_id), context="Systems")
+        system = None
+        system_brain = index.get_system(location_brain.getPath(), row.SystemID)
+        changed = []
+        if system_brain is not None:
+            self.log(
+                "Found System {} with ID {} in Location {}".format(
+                    system_brain.Title, row.SystemID, location_brain.Title
+                ),
+                context="Systems",
+            )
+            if row.Inactive_Retired_Flag == "1":
+                if index.get_review_state(system_brain) == "active":
                     self.log(
-                        "System {} in location {} doesn't exists but is marked as Inactive_Retired_Flag".format(
-                            row["system_name"], location_brain.Title
+                        "Deactivate System {} in location {} beacuse it's marked as Inactive_Retired_Flag".format(
+                            row.system_name, location_brain.Title
                         ),
                         context="Systems",
+                        action="Deactivated",
                     )
-                    continue
-                if location is None:
-                    location = api.get_object(location_brain)
-                system = bika_api.create(
-                    location,
-                    "SamplePoint",
-                    title=row["system_name"],
-                )
-                system.SamplePointId = row["SystemID"]
-                reindex = True
-                client_title = location.aq_parent.Title()
+                    system = self.wake(system_brain)
+                    self.do_transition(system, "deactivate", index)
+            values = (row.Equipment_ID, row.system, row.Equipment_Description2)
+            if system is None and index.get_values(system_brain) != values:
+                system = self.wake(system_brain)
+        else:
+            # Create new system
+            if row.Inactive_Retired_Flag == "1":
                 self.log(
-                    "Created system {} in location {} in client {}".format(
-                        system.Title(), location_brain.Title, client_title
+                    "System {} in location {} doesn't exists but is marked as Inactive_Retired_Flag".format(
+                        row.system_name, location_brain.Title
                     ),
                     context="Systems",
-                    action="Created",
                 )
-            if system.EquipmentID != row["Equipment_ID"]:
-                system.EquipmentID = row["Equipment_ID"]
-                reindex = True
-            if system.EquipmentType != row["system"]:
-                reindex = True
-                system.EquipmentType = row["system"]
-            if system.EquipmentDescription != row["Equipment_Description2"]:
-                reindex = True
-                system.EquipmentDescription = row["Equipment_Description2"]
-            if reindex:
-                system.reindexObject()
-
-        return True
-
-    def process_contacts_rules(self, data):
-        locations = api.search(
-            {"portal_type": "SamplePointLocation"}, catalog="senaite_catalog_setup"
-        )
-        locations = [api.get_object(loc) for loc in locations]
-        location_ids = [loc.getSamplePointLocationID() for loc in locations]
-        num_rows = len(data["rows"])
-        for i, row in enumerate(data["rows"]):
-            if COMMIT_COUNT > 0 and i % COMMIT_COUNT == 0:
-                transaction.commit()
-            logger.info("Process row {} of {} from Contacts file".format(i, num_rows))
-            if len(row.get("contactID", "")) == 0:
-                self.log(
-                    "Contact on row {} in location {} has no contactID field".format(
-                        i, row.get("Locations_id", "missing")
-                    ),
-                    context="Contacts",
-                    level="error",
-                )
-                continue
-            if len(row.get("Locations_id", "")) == 0:
-                self.log(
-                    "Contact on row {} with contactID {} has no Locations_id field".format(
-                        i, row.get("contactID", "missing")
-                    ),
-                    context="Contacts",
-                    level="error",
-                )
-                continue
-            if row["Locations_id"] not in location_ids:
-                msg = "Location {} on row {} in contacts file not found in DB".format(
-                    row["Locations_id"], i
-                )
-                self.log(msg, level="warn", context="Contacts")
-                continue
-
+                return
+            if location is None:
+                location = self.wake(location_brain)
+            system = self.create_object(
+                location,
+                "SamplePoint",
+                title=row.system_name,
+            )
+            system.SamplePointId = row.SystemID
+            changed.append("SamplePointId")
+            index_object(system)
+            system_brain = self.created_brain(system, getSamplePointID=row.SystemID)
+            if system_brain:
+                index.add_system(location_brain.getPath(), row.SystemID, system_brain)
+            client_title = location.aq_parent.Title()
             self.log(
-                "Found Location {}".format(row["Locations_id"]), context="Contacts"
+                "Created system {} in location {} in client {}".format(
+                    system.Title(), location_brain.Title, client_title
+                ),
+                context="Systems",
+                action="Created",
             )
-            location = [
-                loc
-                for loc in locations
-                if row["Locations_id"] == loc.getSamplePointLocationID()
-            ][0]
-            location = api.get_object(location)
-            client = location.aq_parent
-            if client.portal_type != "Client":
-                raise RuntimeError(
-                    "Location {} in {} is not inside a client".format(
-                        location.Title(), location.absolute_url()
-                    )
-                )
-            contacts = client.getContacts()
-            found = False
-            for contact in contacts:
-                contact_email = contact.getEmailAddress()
-                if contact_email and row["email"] == contact_email:
-                    self.log(
-                        "Found contact with email {} in location {}".format(
-                            row["email"], location.Title()
-                        ),
-                        context="Contacts",
-                    )
-                    found = True
-                    break
+        if system is None:
+            # the values in the external ID index are the same as the row's
+            return
+        if system.EquipmentID != row.Equipment_ID:
+            system.EquipmentID = row.Equipment_ID
+            changed.append("EquipmentID")
+        if system.EquipmentType != row.system:
+            changed.append("EquipmentType")
+            system.EquipmentType = row.system
+        if system.EquipmentDescription != row.Equipment_Description2:
+            changed.append("EquipmentDescription")
+            system.EquipmentDescription = row.Equipment_Description2
+        if changed:
+            self.reindex_queue.add(system, *changed)
+        index_object(system)
+
+    def process_contacts_rules(self, data, index):
+        self.process_rows(
+            "Contacts", data, lambda i, row: self.process_contact_row(i, row, index)
+        )
+        return True
 
-            if found:
-                continue
+    def process_contact_row(self, i, row, index):
+        location_brain = index.get_location_by_id(row.Locations_id)
+        if location_brain is None:
+            msg = "Location {} on row {} in contacts file not found in DB".format(
+                row.Locations_id, i
+            )
+            self.log(msg, level="warn", context="Contacts")
+            return
 
-            firstname = "--"
-            surname = "Unknown"
-            if len(row.get("WS_Contact_Name", "")) > 0:
-                firstname = " ".join(row["WS_Contact_Name"].split(" ")[:-1])
-                if len(firstname) == 0:
-                    firstname = "---"
-                surname = row["WS_Contact_Name"].split(" ")[-1]
-            contact = bika_api.create(
-                client,
-                "Contact",
+        self.log("Found Location {}".format(row.Locations_id), context="Contacts")
+        client_path = parent_path(location_brain)
+        client_brain = index.get_client_at(client_path)
+        if client_brain is None:
+            raise RuntimeError(
+                "Location {} in {} is not inside a client".format(
+                    location_brain.Title, location_brain.getPath()
+                )
             )
-            contact.Firstname = firstname
-            contact.Surname = surname
-            contact.ContactId = row["contactID"]
-            contact.setEmailAddress(row["email"])
+        email = normalized_email(row.email)
+        if email and email in index.get_contact_emails(client_brain):
             self.log(
-                "Created contact with email {} for location {} in client {}".format(
-                    contact.getEmailAddress(), location.Title(), client.Title()
+                "Found contact with email {} in location {}".format(
+                    row.email, location_brain.Title
                 ),
                 context="Contacts",
-                action="Created",
             )
-            transaction.commit()
-        return True
+            return
+
+        firstname = "--"
+        surname = "Unknown"
+        if len(row.WS_Contact_Name) > 0:
+            firstname = " ".join(row.WS_Contact_Name.split(" ")[:-1])
+            if len(firstname) == 0:
+                firstname = "---"
+            surname = row.WS_Contact_Name.split(" ")[-1]
+        client = self.wake(client_brain)
+        contact = self.create_object(client, "Contact")
+        contact.Firstname = firstname
+        contact.Surname = surname
+        contact.ContactId = row.contactID
+        contact.setEmailAddress(row.email)
+        self.reindex_queue.add(
+            contact, "Firstname", "Surname", "ContactId", "EmailAddress"
+        )
+        index_object(contact)
+        index.add_contact_email(client_brain, row.email)
+        self.log(
+            "Created contact with email {} for location {} in client {}".format(
+                contact.getEmailAddress(), location_brain.Title, client.Title()
+            ),
+            context="Contacts",
+            action="Created",
+        )
 
     def _get_address_field(self, row, row_num):
-        state = row.get("state", "")
+        state = row.state
         if len(state) == 0:
             pass
         state_vocab = {
@@ -1134,42 +1710,59 @@ class SyncLocationsView(BrowserView):
         else:
             div1 = state_vocab[state]
         address = {
-            "address": row.get("street", ""),
-            "city": row.get("city", ""),
+            "address": row.street,
+            "city": row.city,
             "country": "Australia",
             "subdivision1": div1,
             "subdivision2": "",
             "type": "physical",
-            "zip": row.get("postcode", ""),
+            "zip": row.postcode,
         }
         return address
 
-    def create(self, container, portal_type, *args, **kwargs):
-        from bika.lims.utils import tmpID
+    def create(self, container, portal_type, **values):
+        """Create an object the quick way, for the bulk creator
 
-        # from zope.component import getUtility
-        # from zope.event import notify
-        # from zope.lifecycleevent import ObjectCreatedEvent
+        Unlike bika_api.create, its form is not processed: its values are
+        set with their setters and it is renamed with the ID server, as
+        processing the form does, before anything looks its path up. It is
+        notified as initialized and modified and indexed by finish_created.
+        """
+        from bika.lims.idserver import renameAfterCreation
+        from bika.lims.utils import tmpID
         from Products.CMFPlone.utils import _createObjectByType
 
-        # from zope.lifecycleevent import modified
-        # from zope.component.interfaces import IFactory
-
-        if kwargs.get("title") is None:
-            kwargs["title"] = "New {}".format(portal_type)
+        obj = _createObjectByType(portal_type, container, tmpID())
+        # processing the form would have marked the object as created
+        if getattr(aq_base(obj), "unmarkCreationFlag", None) is not None:
+            obj.unmarkCreationFlag()
+        for name, value in values.items():
+            setter = "set{}{}".format(name[0].upper(), name[1:])
+            getattr(obj, setter)(value)
+        # the ID server takes a savepoint, count the changes before it
+        if self.policy is not None:
+            self.policy.note_changed()
+        renameAfterCreation(obj)
+        return obj
 
-        # generate a temporary ID
-        tmp_id = tmpID()
+    def finish_created(self, objects):
+        """Notify objects created in bulk as initialized and modified
 
-        obj = _createObjectByType(portal_type, container, tmp_id)
+        Archetypes objects get the event processing their form sends for
+        new objects, Dexterity objects were notified as created already.
+        """
+        from Products.Archetypes.event import ObjectInitializedEvent
+        from Products.Archetypes.interfaces import IBaseObject
+        from zope.event import notify
+        from zope.lifecycleevent import modified
 
-        # # handle AT Content
-        # if is_at_content(obj):
-        #     obj.processForm()
+        for obj in objects:
+            if IBaseObject.providedBy(obj):
+                notify(ObjectInitializedEvent(obj))
+            modified(obj)
 
-        # Edit after processForm; processForm does AT unmarkCreationFlag.
-        obj.edit(**kwargs)
+    def index_created(self):
+        """Do the catalog operations queued since the last batch at once"""
+        from Products.CMFCore.indexing import processQueue
 
-        # # explicit notification
-        # modified(obj)
-        return obj
+        processQueue()
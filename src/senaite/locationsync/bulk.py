@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Create the objects of a first load in bulk.
+
+Creating an object with bika_api.create processes its form, renames it
+and notifies it as initialized and modified, which reindexes it before the
+next row is processed. A BulkCreator creates the objects the quick way,
+and finishes the objects created in a batch together. They are notified
+and indexed by portal type and container when the changes are saved.
+Until then a CreatedBrain stands in for the catalog brain of an object,
+so the sync does not have to query the catalog for it.
+"""
+
+from collections import OrderedDict
+import time
+
+
+class CreatedBrain(object):
+    """The brain of an object created in bulk, while its indexing is pending
+
+    It has the metadata of the object the sync uses, given by name.
+    """
+
+    def __init__(self, obj, review_state, **metadata):
+        self.obj = obj
+        self.UID = obj.UID()
+        self.Title = obj.Title()
+        self.review_state = review_state
+        for name, value in metadata.items():
+            setattr(self, name, value)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def getPath(self):
+        return "/".join(self.obj.getPhysicalPath())
+
+    def getObject(self):
+        return self.obj
+
+
+class BulkCreator(object):
+    """Create objects with `create(container, portal_type, **values)` and
+    finish them with `finish(objects)` in batches
+
+    The objects of each portal type in each container are finished
+    together when the batch is flushed, then `index()` is called once.
+    """
+
+    def __init__(self, create, finish, index=None, clock=time.time):
+        self.create = create
+        self.finish = finish
+        self.index = index
+        self.clock = clock
+        # objects to finish by (container path, portal type)
+        self.pending = OrderedDict()
+        # the group of each object created, undone by a rollback
+        self.journal = []
+        self.created = 0
+        self.batches = 0
+        self.create_seconds = 0.0
+        self.finish_seconds = 0.0
+
+    def add(self, container, portal_type, **values):
+        """Create an object, it is finished with its batch"""
+        start = self.clock()
+        obj = self.create(container, portal_type, **values)
+        self.create_seconds += self.clock() - start
+        key = ("/".join(container.getPhysicalPath()), portal_type)
+        self.pending.setdefault(key, []).append(obj)
+        self.journal.append(key)
+        self.created += 1
+        return obj
+
+    def mark(self):
+        """Return a mark to forget the objects created after it"""
+        return len(self.journal)
+
+    def rollback(self, mark):
+        """Forget the objects created since the mark, they were rolled back"""
+        while len(self.journal) > mark:
+            key = self.journal.pop()
+            self.pending[key].pop()
+            if not self.pending[key]:
+                del self.pending[key]
+            self.created -= 1
+
+    def clear(self):
+        """Forget the objects to finish, their creation was aborted"""
+        self.created -= len(self.journal)
+        del self.journal[:]
+        self.pending.clear()
+
+    def flush(self):
+        """Finish the objects created since the last flush"""
+        del self.journal[:]
+        if not self.pending:
+            return
+        start = self.clock()
+        while self.pending:
+            key, objects = self.pending.popitem(last=False)
+            self.finish(objects)
+        if self.index is not None:
+            self.index()
+        self.batches += 1
+        self.finish_seconds += self.clock() - start
+
+    def report(self):
+        """Return a line on the objects created so far"""
+        seconds = self.create_seconds + self.finish_seconds
+        rate = self.created / seconds if seconds else 0
+        return "Created {} objects in bulk in {} batches in {:.1f} seconds, {:.1f} finishing them, {:.0f} objects per second".format(
+            self.created, self.batches, seconds, self.finish_seconds, rate
+        )
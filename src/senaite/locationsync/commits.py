@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""When a run saves the changes it made so far.
+
+A CommitPolicy is told about each row processed and saves the changes
+once enough rows were processed, enough time went by or enough objects
+were changed since the changes were last saved. Saving commits the
+transaction when the run commits as it goes. Otherwise it takes a
+savepoint, which moves the changes out of memory but still lets the run
+abort all of them when errors are found.
+
+The objects changed are the ones the ZODB connection has registered. A
+savepoint forgets them, so every savepoint the run takes between two saves
+goes through the policy, which notes them first.
+
+When the run commits as it goes, a ConflictError while processing the rows
+or committing them aborts the changes since the last commit only. They are
+made again by replaying the rows after a growing wait, and committed once
+they no longer conflict.
+"""
+
+import random
+import time
+import transaction
+from ZODB.POSException import ConflictError
+
+# Thresholds when the control panel has no value, 0 turns one off
+COMMIT_ROWS = 100
+COMMIT_SECONDS = 60
+COMMIT_OBJECTS = 5000
+# Times the changes since the last commit are made again after conflicts
+CONFLICT_RETRIES = 3
+# Seconds to wait before the first retry, doubled for each next one
+CONFLICT_WAIT = 1.0
+
+
+def conflict_wait(attempt, first=CONFLICT_WAIT):
+    """Return the seconds to wait before a retry, with some jitter so that
+    conflicting requests do not retry at the same time again"""
+    return first * 2**attempt * random.uniform(0.5, 1.0)
+
+
+class CommitPolicy(object):
+    """Commit or take a savepoint every `rows` rows, `seconds` seconds or
+    `objects` changed objects, whichever comes first
+
+    `jar` is the ZODB connection whose changed objects are counted, the
+    savepoints taken until the next save must be taken with `savepoint`.
+    `before_save()` is called before the changes are saved and `on_save()`
+    after. `replay()` makes the changes since the last save again after
+    they were aborted because of a conflict.
+    """
+
+    def __init__(
+        self,
+        jar,
+        commit=False,
+        rows=COMMIT_ROWS,
+        seconds=COMMIT_SECONDS,
+        objects=COMMIT_OBJECTS,
+        on_save=None,
+        clock=time.time,
+        before_save=None,
+        replay=None,
+        retries=CONFLICT_RETRIES,
+        sleep=time.sleep,
+    ):
+        self.jar = jar
+        self.commit = commit
+        self.rows = rows
+        self.seconds = seconds
+        self.objects = objects
+        self.on_save = on_save
+        self.before_save = before_save
+        self.replay = replay
+        self.retries = retries
+        self.sleep = sleep
+        self.clock = clock
+        self.commits = 0
+        self.savepoints = 0
+        self.rows_since = 0
+        self.saved_at = clock()
+        # oids of the objects changed before the savepoints since the last save
+        self.changed = set()
+        # conflicts since the last save and when the first one happened
+        self.attempts = 0
+        self.conflicted_at = None
+        self.conflicts = 0
+        self.retried = []
+
+    def describe(self):
+        """Return a line on when the changes are saved"""
+        limits = []
+        if self.rows:
+            limits.append("{} rows".format(self.rows))
+        if self.seconds:
+            limits.append("{} seconds".format(self.seconds))
+        if self.objects:
+            limits.append("{} changed objects".format(self.objects))
+        how = "Commit" if self.commit else "Take a savepoint"
+        if not limits:
+            return "{} after each file only".format(how)
+        return "{} every {} and after each file".format(how, " or ".join(limits))
+
+    def note_changed(self):
+        """Note the objects changed since the last savepoint"""
+        if self.jar is not None:
+            self.changed.update(obj._p_oid for obj in self.jar._registered_objects)
+
+    def changed_objects(self):
+        """Return the number of objects changed since the last save"""
+        self.note_changed()
+        return len(self.changed)
+
+    def savepoint(self, optimistic=False):
+        """Take a savepoint, the objects changed before it are still counted"""
+        self.note_changed()
+        return transaction.savepoint(optimistic)
+
+    def due(self):
+        """Return whether a threshold is reached"""
+        if self.rows and self.rows_since >= self.rows:
+            return True
+        if self.seconds and self.clock() - self.saved_at >= self.seconds:
+            return True
+        return bool(self.objects) and self.changed_objects() >= self.objects
+
+    def row(self):
+        """Count a processed row, saving the changes once a threshold is reached"""
+        self.rows_since += 1
+        if self.due():
+            self.save()
+
+    def save(self):
+        """Commit the changes, or take a savepoint when the run can be aborted"""
+        if self.commit:
+            while True:
+                try:
+                    if self.before_save is not None:
+                        self.before_save()
+                    transaction.commit()
+                    break
+                except ConflictError as e:
+                    self.retry(e)
+            self.commits += 1
+        else:
+            if self.before_save is not None:
+                self.before_save()
+            transaction.savepoint(optimistic=True)
+            self.savepoints += 1
+        if self.conflicted_at is not None:
+            self.retried.append(self.clock() - self.conflicted_at)
+        self.attempts = 0
+        self.conflicted_at = None
+        self.rows_since = 0
+        self.changed.clear()
+        self.saved_at = self.clock()
+        if self.on_save is not None:
+            self.on_save()
+
+    def retry(self, error):
+        """Abort the changes since the last commit after a conflict, wait and
+        make them again
+
+        The conflict is raised again when the run does not commit as it goes,
+        the whole run is aborted then, or once the retries are used up.
+        """
+        while True:
+            self.conflicts += 1
+            if self.conflicted_at is None:
+                self.conflicted_at = self.clock()
+            if not self.commit or self.replay is None or self.attempts >= self.retries:
+                raise error
+            transaction.abort()
+            self.changed.clear()
+            self.sleep(conflict_wait(self.attempts))
+            self.attempts += 1
+            try:
+                self.replay()
+                return
+            except ConflictError as e:
+                error = e
+
+    def report(self):
+        """Return a line on the conflicts resolved by retrying"""
+        if not self.conflicts:
+            return "No conflicts"
+        return "{} conflicts, {} batches saved after retrying, at most {:.1f} seconds after their first conflict and {:.1f} seconds in all".format(
+            self.conflicts,
+            len(self.retried),
+            max(self.retried or [0]),
+            sum(self.retried),
+        )
@@ -29,6 +29,45 @@ class ILocationSyncControlPanel(Interface):
         required=True,
         readonly=False,
     )
+    cache_budget = schema.Int(
+        title=_(
+            "Number of objects a sync can load before the ZODB cache is minimized, 0 to only reduce it at commits",
+        ),
+        required=False,
+        readonly=False,
+        default=5000,
+        min=0,
+    )
+    commit_rows = schema.Int(
+        title=_(
+            "Save the changes of a sync every number of rows, 0 to not count rows",
+        ),
+        required=False,
+        readonly=False,
+        default=100,
+        min=0,
+    )
+    commit_seconds = schema.Int(
+        title=_(
+            "Save the changes of a sync every number of seconds, 0 to not time them",
+        ),
+        required=False,
+        readonly=False,
+        default=60,
+        min=0,
+    )
+    commit_objects = schema.Int(
+        title=_(
+            "Save the changes of a sync once this number of objects was changed, 0 to not count them",
+        ),
+        description=_(
+            "The changes are committed when the sync is run with commit=true, otherwise a savepoint is taken so the whole sync can still be aborted when errors are found",
+        ),
+        required=False,
+        readonly=False,
+        default=5000,
+        min=0,
+    )
     # sync_ftp_server = schema.TextLine(
     #     title=_(
     #         "The FTP server from which sync files are retrieved",
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Row level delta of a sync file against the last archived one.
+
+A snapshot maps the natural key of every row of the archived file to a
+digest of the row values. Rows of the current file are only passed on when
+they are new, when their values changed, or when the row they depend on in
+the parent file (e.g. the location of a system) was passed on itself.
+"""
+
+import csv
+import hashlib
+import os
+import re
+
+from senaite.locationsync.reader import decoded_lines
+from senaite.locationsync.reader import GZIP_SUFFIX
+from senaite.locationsync.reader import iter_values
+from senaite.locationsync.reader import new_stats
+from senaite.locationsync.reader import open_data_file
+from senaite.locationsync.reader import read_header
+
+# File type: (parent file type, field holding the parent natural key)
+PARENT_KEYS = {
+    "Locations": ("Accounts", "Customer_Number"),
+    "Systems": ("Locations", "Location_id"),
+    "Contacts": ("Locations", "Locations_id"),
+}
+
+
+def row_digest(values):
+    """Return a digest of the values of a row"""
+    return hashlib.md5(u"\x1f".join(values).encode("utf-8")).digest()
+
+
+def latest_archived_file(folder, file_name):
+    """Return the path of the last archived copy of file_name, if any
+
+    Archived files are named <name>.<YYYYmmdd>.<HHMM>.csv by _move_file,
+    with the GZIP_SUFFIX added when they were gzipped.
+    """
+    stem = ".".join(file_name.split(".")[:-1])
+    pattern = re.compile(
+        r"^{}\.(\d{{8}})\.(\d{{4}})\.csv(?:{})?$".format(
+            re.escape(stem), re.escape(GZIP_SUFFIX)
+        )
+    )
+    latest = None
+    for name in os.listdir(folder):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        if latest is None or match.groups() > latest[0]:
+            latest = (match.groups(), name)
+    if latest is None:
+        return None
+    return os.path.join(folder, latest[1])
+
+
+def read_snapshot(file_path, headers, key_fields):
+    """Return the digest of each row of a file by its natural key
+
+    Rows are cleaned and decoded like the rows of the current file, so equal
+    rows get equal digests. Returns None when the headers do not match.
+    """
+    key_idxs = [headers.index(field) for field in key_fields]
+    snapshot = {}
+    stats = new_stats()
+    with open_data_file(file_path) as csvfile:
+        reader = csv.reader(
+            decoded_lines(csvfile, stats), delimiter=",", quotechar='"'
+        )
+        if read_header(reader, file_path, headers) is not None:
+            return None
+        for _, values in iter_values(
+            reader, file_path, headers, stats, lambda msg: None
+        ):
+            key = tuple(values[idx] for idx in key_idxs)
+            snapshot[key] = row_digest(values)
+    return snapshot
+
+
+def changed_rows(rows, snapshot, key_fields, stats, changed_keys,
+                 parent_field=None, parent_keys=None):
+    """Yield the (row number, row) of the rows that are not identical to the
+    snapshot
+
+    The keys of the rows yielded are added to changed_keys and the number of
+    rows yielded and skipped are counted in stats.
+    """
+    for row_num, row in rows:
+        key = tuple(getattr(row, field) for field in key_fields)
+        parent_changed = (
+            parent_field is not None and (getattr(row, parent_field),) in parent_keys
+        )
+        if not parent_changed and snapshot.get(key) == row_digest(row):
+            stats["unchanged"] += 1
+            continue
+        stats["changed"] += 1
+        changed_keys.add(key)
+        yield row_num, row
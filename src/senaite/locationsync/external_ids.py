@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""Persistent index of the objects synced by their external IDs.
+
+The IDs the sync files use for clients, locations, systems and contacts
+are mapped to UIDs in BTrees kept in an annotation of the portal, so a
+sync can look rows up without searching the catalogs:
+
+    Client               ClientID -> UID
+    SamplePointLocation  (SamplePointLocationID, client path) -> UID
+    SamplePoint          (location path, SamplePointId) -> UID
+    Contact              (client path, normalized email) -> UID
+
+`objects` maps each indexed UID back to its entry and `paths` maps the
+path of each indexed object to its UID. `values` keeps the fields the sync
+compares with the rows by UID, so an object is only woken to be changed,
+and `metadata` the title, review state and other catalog metadata the sync
+reads, so it needs no brains from the catalogs. Indexes built before
+`metadata` was kept get it when their objects are indexed again or when
+they are rebuilt. The index only exists once it was built with `rebuild`. From then on the
+subscribers keep it current as objects are added, modified, moved or
+removed, and the sync indexes the objects whose IDs and values it sets
+itself.
+"""
+
+from Acquisition import aq_base
+from BTrees.OOBTree import OOBTree
+from senaite import api
+from senaite.locationsync.indexes import CATALOGS
+from senaite.locationsync.indexes import frozen_address
+from senaite.locationsync.indexes import normalized_email
+from senaite.locationsync.indexes import SYSTEM_FIELDS
+import transaction
+from zope.annotation.interfaces import IAnnotations
+
+ANNOTATION_KEY = "senaite.locationsync.external_ids"
+PORTAL_TYPES = ("Client", "SamplePointLocation", "SamplePoint", "Contact")
+# Objects woken between savepoints while the index is built
+SAVEPOINT_SIZE = 1000
+
+
+def get_storage():
+    """Return the BTrees of the index, None if it was never built"""
+    return IAnnotations(api.get_portal()).get(ANNOTATION_KEY)
+
+
+def new_storage():
+    """Return empty BTrees for the index"""
+    storage = OOBTree()
+    for name in PORTAL_TYPES + ("objects", "paths", "values", "metadata"):
+        storage[name] = OOBTree()
+    return storage
+
+
+def object_key(obj, portal_type):
+    """Return the external key of an object, None if it has no external ID"""
+    if portal_type == "Client":
+        return obj.getClientID() or None
+    parent_path = api.get_path(obj.aq_parent)
+    if portal_type == "SamplePointLocation":
+        location_id = obj.getSamplePointLocationID()
+        return (location_id, parent_path) if location_id else None
+    if portal_type == "SamplePoint":
+        # set as an attribute by the sync, see process_systems_rules
+        system_id = getattr(obj, "SamplePointId", None)
+        return (parent_path, system_id) if system_id else None
+    if portal_type == "Contact":
+        email = normalized_email(obj.getEmailAddress())
+        return (parent_path, email) if email else None
+    return None
+
+
+def object_values(obj, portal_type):
+    """Return the values of an object the sync compares, None if there are none"""
+    if portal_type == "SamplePointLocation":
+        return (frozen_address(obj.getAddress()),)
+    if portal_type == "SamplePoint":
+        # set as attributes by the sync, see process_systems_rules
+        return tuple(getattr(obj, name, None) for name in SYSTEM_FIELDS)
+    return None
+
+
+def object_metadata(obj, entry):
+    """Return the (name, value) pairs of the metadata the sync reads from the
+    brain of an object, None for contacts, which are not looked up by brain
+    """
+    portal_type, key = entry[:2]
+    if portal_type == "Contact":
+        return None
+    metadata = [
+        ("Title", obj.Title()),
+        ("review_state", api.get_workflow_status_of(obj)),
+    ]
+    if portal_type == "Client":
+        metadata.append(("getClientID", key))
+    elif portal_type == "SamplePointLocation":
+        metadata.append(("getSamplePointLocationID", key[0]))
+        metadata.append(
+            ("getAccountManagers", tuple(obj.getAccountManagers() or ()))
+        )
+    else:
+        metadata.append(("getSamplePointID", key[1]))
+    return tuple(metadata)
+
+
+def object_entry(obj):
+    """Return (portal type, key, UID, path) of an object, None if not indexed"""
+    portal_type = api.get_portal_type(obj)
+    if portal_type not in PORTAL_TYPES:
+        return None
+    key = object_key(obj, portal_type)
+    if key is None:
+        return None
+    return portal_type, key, api.get_uid(obj), api.get_path(obj)
+
+
+def store_entry(storage, entry, values=None, metadata=None):
+    """Store an entry, a key already used by another object is kept"""
+    portal_type, key, uid, path = entry
+    if key not in storage[portal_type]:
+        storage[portal_type][key] = uid
+    storage["objects"][uid] = (portal_type, key, path)
+    storage["paths"][path] = uid
+    if values is not None:
+        storage["values"][uid] = values
+    if metadata is not None:
+        if "metadata" not in storage:
+            # an index built before the metadata was kept
+            storage["metadata"] = OOBTree()
+        storage["metadata"][uid] = metadata
+
+
+def remove_entry(storage, uid):
+    """Remove the entry of a UID, if it was indexed"""
+    entry = storage["objects"].get(uid)
+    if entry is None:
+        return
+    portal_type, key, path = entry
+    if storage[portal_type].get(key) == uid:
+        del storage[portal_type][key]
+    if storage["paths"].get(path) == uid:
+        del storage["paths"][path]
+    del storage["objects"][uid]
+    if uid in storage["values"]:
+        del storage["values"][uid]
+    if uid in storage.get("metadata", ()):
+        del storage["metadata"][uid]
+
+
+def stored_metadata(storage, uid):
+    """Return the stored metadata of a UID, None if there is none"""
+    metadata = storage.get("metadata")
+    if metadata is None:
+        return None
+    return metadata.get(uid)
+
+
+def is_indexed_type(obj):
+    """Return whether objects of the type of obj are indexed
+
+    The subscribers see all objects, the portal type is not acquired so that
+    other objects in a client are not taken for one.
+    """
+    return getattr(aq_base(obj), "portal_type", None) in PORTAL_TYPES
+
+
+def index_object(obj):
+    """Index an object by its external ID, does nothing without an index
+
+    Nothing is written when the stored entry and values are unchanged, so
+    that editing an object does not conflict with a running sync.
+    """
+    if not is_indexed_type(obj):
+        return
+    storage = get_storage()
+    if storage is None:
+        return
+    uid = api.get_uid(obj)
+    entry = object_entry(obj)
+    values = metadata = None
+    if entry is not None:
+        values = object_values(obj, entry[0])
+        metadata = object_metadata(obj, entry)
+    stored = storage["objects"].get(uid)
+    if (
+        entry is not None
+        and stored == entry[:2] + entry[3:]
+        and storage["values"].get(uid) == values
+        and stored_metadata(storage, uid) == metadata
+    ):
+        return
+    if stored is not None:
+        remove_entry(storage, uid)
+    if entry is not None:
+        store_entry(storage, entry, values, metadata)
+
+
+def unindex_object(obj):
+    """Remove an object from the index, does nothing without an index"""
+    if not is_indexed_type(obj):
+        return
+    storage = get_storage()
+    if storage is None:
+        return
+    remove_entry(storage, api.get_uid(obj))
+
+
+def iter_objects():
+    """Yield all objects that can be indexed, from the catalogs
+
+    Contacts are not in the catalogs searched, they are taken from their
+    clients. A savepoint every SAVEPOINT_SIZE objects lets the woken objects
+    be released.
+    """
+    count = 0
+    for portal_type in ("Client", "SamplePointLocation", "SamplePoint"):
+        brains = api.search({"portal_type": portal_type}, CATALOGS[portal_type])
+        for brain in brains:
+            obj = api.get_object(brain)
+            yield obj
+            if portal_type == "Client":
+                for contact in obj.getContacts():
+                    yield contact
+            count += 1
+            if count % SAVEPOINT_SIZE == 0:
+                transaction.savepoint(optimistic=True)
+
+
+def iter_entries():
+    """Yield the entries, values and metadata of all objects that have an
+    external ID"""
+    for obj in iter_objects():
+        entry = object_entry(obj)
+        if entry is not None:
+            yield entry, object_values(obj, entry[0]), object_metadata(obj, entry)
+
+
+def rebuild():
+    """Build the index from scratch, returns the number of objects indexed"""
+    storage = new_storage()
+    for entry, values, metadata in iter_entries():
+        store_entry(storage, entry, values, metadata)
+    IAnnotations(api.get_portal())[ANNOTATION_KEY] = storage
+    return len(storage["objects"])
+
+
+def check():
+    """Compare the index with the objects
+
+    Returns the `missing` entries of objects that are not indexed, the
+    `stale` entries of the index that no object has anymore, the
+    `duplicates`, entries whose key is also used by another object, and the
+    `outdated` entries whose values or metadata differ from the object's.
+    None when the index was never built.
+    """
+    result = {"missing": [], "stale": [], "duplicates": [], "outdated": []}
+    storage = get_storage()
+    if storage is None:
+        return None
+    found = set()
+    for entry, values, metadata in iter_entries():
+        portal_type, key, uid, path = entry
+        found.add(uid)
+        stored = storage["objects"].get(uid)
+        stored_uid = storage[portal_type].get(key)
+        if stored != (portal_type, key, path):
+            result["missing"].append(entry)
+        elif stored_uid != uid:
+            result["duplicates"].append(entry)
+        elif (
+            storage["values"].get(uid) != values
+            or stored_metadata(storage, uid) != metadata
+        ):
+            result["outdated"].append(entry)
+    for uid, (portal_type, key, path) in storage["objects"].items():
+        if uid not in found:
+            result["stale"].append((portal_type, key, uid, path))
+    return result
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Content fingerprints of the sync files.
+
+The fingerprints of the files of the last successfully archived run are
+kept in a json file in the archive folder, so a file whose content did not
+change since can be skipped. Gzipped files are fingerprinted by their
+decompressed content, the same rows compressed again match.
+"""
+
+import hashlib
+import json
+import os
+
+from senaite.locationsync.reader import open_data_file
+
+FINGERPRINTS_FILE_NAME = ".fingerprints.json"
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_fingerprint(file_path):
+    """Return the sha1 hex digest of the content of a file, decompressed"""
+    digest = hashlib.sha1()
+    with open_data_file(file_path) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_fingerprints(folder):
+    """Return the stored fingerprints by file name, empty if there are none"""
+    file_path = os.path.join(folder, FINGERPRINTS_FILE_NAME)
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def write_fingerprints(folder, fingerprints):
+    """Merge the fingerprints by file name into the ones stored in folder"""
+    stored = read_fingerprints(folder)
+    stored.update(fingerprints)
+    file_path = os.path.join(folder, FINGERPRINTS_FILE_NAME)
+    tmp_path = "{}.tmp".format(file_path)
+    with open(tmp_path, "w") as f:
+        json.dump(stored, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, file_path)
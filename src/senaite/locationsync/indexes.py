@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+"""In memory lookups of the catalog brains used while processing a file.
+
+The brains of a portal type are fetched with one catalog query and kept in
+a dict by the value that identifies them in the sync files, so looking a
+row up does not depend on the number of brains. Values that are matched
+loosely, like email addresses, are normalized first.
+
+A SyncIndex holds all of them for one run, so the four passes share a
+single query per portal type and see what the earlier passes created. An
+ExternalIdIndex does the same from the persistent index of external_ids,
+which also keeps the metadata of the objects the sync uses, so rows are
+resolved without querying the catalogs. It also knows the values the sync
+compares with the rows, so unchanged objects need not be woken.
+"""
+
+from functools import partial
+
+# Catalog of each portal type loaded into the SyncIndex
+CATALOGS = {
+    "Client": "senaite_catalog_client",
+    "SamplePointLocation": "senaite_catalog_setup",
+    "SamplePoint": "senaite_catalog_setup",
+}
+
+# Attributes of a system compared with the columns of the systems file
+SYSTEM_FIELDS = ("EquipmentID", "EquipmentType", "EquipmentDescription")
+
+# Rows whose objects an ExternalIdIndex fetches together
+PREFETCH_ROWS = 100
+
+
+def index_brains(brains, key):
+    """Return the brains by the value of their key metadata column
+
+    The first brain wins when several have the same value, like taking the
+    first match of a search did.
+    """
+    index = {}
+    for brain in brains:
+        index.setdefault(brain[key], brain)
+    return index
+
+
+def parent_path(brain):
+    """Return the path of the container of a brain's object"""
+    return brain.getPath().rsplit("/", 1)[0]
+
+
+def index_brains_in(brains, key):
+    """Return the brains by their container path and key metadata column
+
+    Lookups are restricted to one container, like a search with a path
+    query and the key was. The first brain wins as in index_brains.
+    """
+    index = {}
+    for brain in brains:
+        index.setdefault((parent_path(brain), brain[key]), brain)
+    return index
+
+
+def normalized_name(name):
+    """Return a person's name the way it is matched against lab contacts
+
+    Lab contacts without a first name have "---" as first name, which is
+    left out like the whitespace around and between the names.
+    """
+    return " ".join(name.strip("- ").split()).lower()
+
+
+def normalized_email(email):
+    """Return an email address the way it is matched against contacts"""
+    return (email or "").strip().lower()
+
+
+def frozen_address(address):
+    """Return an address field value as nested tuples, for comparing"""
+    return tuple(tuple(sorted(item.items())) for item in address or [])
+
+
+def contact_emails(contacts):
+    """Return the set of normalized email addresses of contacts"""
+    emails = set()
+    for contact in contacts:
+        email = normalized_email(contact.getEmailAddress())
+        if email:
+            emails.add(email)
+    return emails
+
+
+class SyncIndex(object):
+    """The clients, locations, systems, contacts and lab contacts of a run
+
+    Each kind is loaded on first use: `search(portal_type, **query)` returns
+    the catalog brains of a portal type matching the query and
+    `lab_contacts()` the LabContact objects. The passes add what they create
+    and note the review state of what they transition, so the index stays
+    current for the rest of the run without querying again. What a row
+    loads, adds and notes can be taken out again with `mark` and `rollback`
+    when the row is rolled back.
+    """
+
+    def __init__(self, search, lab_contacts):
+        self.search = search
+        self.lab_contacts = lab_contacts
+        self.searches = 0
+        self.reset()
+
+    def reset(self):
+        """Forget all that was loaded, it is loaded again when used"""
+        # how to undo each change since the index was last saved
+        self.journal = []
+        self.states = {}
+        self._clients = None
+        self._client_paths = None
+        self._locations = None
+        self._location_ids = None
+        self._systems = None
+        self._emails = {}
+        self._lab_contact_uids = None
+        self._lab_contact_titles = None
+
+    def _search(self, portal_type, **query):
+        self.searches += 1
+        return self.search(portal_type, **query)
+
+    def _set(self, mapping, key, value):
+        """Set a key of a dict of the index, noting how to undo it"""
+        if key in mapping:
+            self.journal.append(partial(mapping.__setitem__, key, mapping[key]))
+        else:
+            self.journal.append(partial(mapping.__delitem__, key))
+        mapping[key] = value
+
+    def _loaded(self, *names):
+        """Note that the attributes were loaded, undone by unloading them"""
+        self.journal.append(partial(self._unload, names))
+
+    def _unload(self, names):
+        for name in names:
+            setattr(self, name, None)
+
+    def mark(self):
+        """Return a mark to undo what is changed after it"""
+        return len(self.journal)
+
+    def rollback(self, mark):
+        """Undo what was loaded, added and noted since the mark was taken"""
+        while len(self.journal) > mark:
+            self.journal.pop()()
+
+    def saved(self):
+        """Keep what was changed so far, the changes were saved"""
+        del self.journal[:]
+
+    def prefetch(self, file_type, rows):
+        """Fetch what the rows of a file look up, each portal type is loaded
+        at once on first use already"""
+
+    # Clients by ClientID and by path
+
+    def _load_clients(self):
+        if self._clients is not None:
+            return
+        self._clients = {}
+        self._client_paths = {}
+        self._loaded("_clients", "_client_paths")
+        for brain in self._search("Client"):
+            self._clients.setdefault(brain["getClientID"], brain)
+            self._client_paths[brain.getPath()] = brain
+
+    def get_client(self, client_id):
+        self._load_clients()
+        return self._clients.get(client_id)
+
+    def get_client_at(self, path):
+        self._load_clients()
+        return self._client_paths.get(path)
+
+    def add_client(self, client_id, brain):
+        self._load_clients()
+        self._set(self._clients, client_id, brain)
+        self._set(self._client_paths, brain.getPath(), brain)
+
+    # Locations by client path and ID, and by ID alone
+
+    def _load_locations(self):
+        if self._locations is not None:
+            return
+        brains = self._search("SamplePointLocation")
+        self._locations = index_brains_in(brains, "getSamplePointLocationID")
+        self._location_ids = index_brains(brains, "getSamplePointLocationID")
+        self._loaded("_locations", "_location_ids")
+
+    def get_location(self, client_path, location_id):
+        self._load_locations()
+        return self._locations.get((client_path, location_id))
+
+    def get_location_by_id(self, location_id):
+        self._load_locations()
+        return self._location_ids.get(location_id)
+
+    def add_location(self, client_path, location_id, brain):
+        self._load_locations()
+        self._set(self._locations, (client_path, location_id), brain)
+        if location_id not in self._location_ids:
+            self._set(self._location_ids, location_id, brain)
+
+    # Systems by location path and ID
+
+    def _load_systems(self):
+        if self._systems is not None:
+            return
+        self._systems = {}
+        self._loaded("_systems")
+        for brain in self._search("SamplePoint"):
+            systems = self._systems.setdefault(parent_path(brain), {})
+            systems.setdefault(brain["getSamplePointID"], brain)
+
+    def get_system(self, location_path, system_id):
+        self._load_systems()
+        return self._systems.get(location_path, {}).get(system_id)
+
+    def get_systems_in(self, location_path):
+        """Return the system brains of a location"""
+        self._load_systems()
+        return list(self._systems.get(location_path, {}).values())
+
+    def get_active_systems_in(self, location_paths):
+        """Return the active system brains of locations, by location path"""
+        systems = {}
+        for path in location_paths:
+            systems[path] = [
+                brain
+                for brain in self.get_systems_in(path)
+                if self.get_review_state(brain) == "active"
+            ]
+        return systems
+
+    def add_system(self, location_path, system_id, brain):
+        self._load_systems()
+        self._set(self._systems.setdefault(location_path, {}), system_id, brain)
+
+    # Normalized contact emails by client path
+
+    def get_contact_emails(self, client):
+        """Return the emails of the contacts of a client brain
+
+        They are read from the client's contacts on the first call only,
+        contacts created later are added with add_contact_email.
+        """
+        path = client.getPath()
+        if path not in self._emails:
+            emails = contact_emails(client.getObject().getContacts())
+            self._set(self._emails, path, emails)
+        return self._emails[path]
+
+    def add_contact_email(self, client, email):
+        email = normalized_email(email)
+        emails = self.get_contact_emails(client)
+        if email and email not in emails:
+            emails.add(email)
+            self.journal.append(partial(emails.discard, email))
+
+    # Lab contact UIDs by normalized name
+
+    def _load_lab_contacts(self):
+        if self._lab_contact_uids is not None:
+            return
+        self._lab_contact_uids = {}
+        self._lab_contact_titles = {}
+        self._loaded("_lab_contact_uids", "_lab_contact_titles")
+        for contact in self.lab_contacts():
+            self.add_lab_contact(contact.Title(), contact.UID(), contact.Title())
+
+    def get_lab_contact(self, name):
+        """Return the UID of the lab contact with the name, None if not found"""
+        self._load_lab_contacts()
+        return self._lab_contact_uids.get(normalized_name(name))
+
+    def get_lab_contact_title(self, uid):
+        self._load_lab_contacts()
+        return self._lab_contact_titles[uid]
+
+    def add_lab_contact(self, name, uid, title):
+        self._load_lab_contacts()
+        name = normalized_name(name)
+        if name not in self._lab_contact_uids:
+            self._set(self._lab_contact_uids, name, uid)
+        self._set(self._lab_contact_titles, uid, title)
+
+    # Values compared with the rows
+
+    def get_values(self, brain):
+        """Return the compared values of a brain's object, None if unknown
+
+        The catalogs have no metadata for them, the object has to be woken.
+        """
+        return None
+
+    # Review states
+
+    def get_review_state(self, brain):
+        """Return the review state of a brain, as transitioned during the run"""
+        return self.states.get(brain.getPath(), brain.review_state)
+
+    def set_review_state(self, path, state):
+        self._set(self.states, path, state)
+
+
+class StoredBrain(object):
+    """The brain of an object in the external ID index
+
+    It has the path of the object and the metadata the sync uses, as they
+    are stored in the index. The object is traversed to from its path when
+    it has to be woken.
+    """
+
+    def __init__(self, uid, path, metadata):
+        self.UID = uid
+        self.path = path
+        for name, value in metadata:
+            # a list like the metadata of a catalog brain
+            if isinstance(value, tuple):
+                value = list(value)
+            setattr(self, name, value)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def getPath(self):
+        return self.path
+
+
+def keys_with_prefix(tree, prefix):
+    """Yield the tuple keys of a BTree that start with prefix, in order"""
+    for key in tree.keys(min=prefix):
+        if key[: len(prefix)] != prefix:
+            break
+        yield key
+
+
+class ExternalIdIndex(SyncIndex):
+    """A SyncIndex that looks rows up in the persistent external ID index
+
+    Nothing is loaded up front: `storage` holds the BTrees of the index,
+    which give the UID, path and metadata of the object of each key, and a
+    StoredBrain is made of them when a key is first looked up. Only the
+    entries without stored metadata, of an index built before the metadata
+    was kept, are fetched by UID with `search`. `prefetch` fetches those of
+    a batch of rows with one query per portal type.
+
+    The active systems of the locations on hold are still found with one
+    path query per batch, as systems the sync did not create have no
+    external ID and are not in the index.
+    """
+
+    def __init__(self, storage, search, lab_contacts):
+        self.storage = storage
+        super(ExternalIdIndex, self).__init__(search, lab_contacts)
+
+    def reset(self):
+        """Forget the brains resolved, the storage is rolled back with the rest"""
+        super(ExternalIdIndex, self).reset()
+        self._clients = {}
+        self._client_paths = {}
+        self._locations = {}
+        self._location_ids = {}
+        self._systems = {}
+        # brains fetched by UID, None for UIDs the catalog does not have
+        self._brains = {}
+
+    def _stored_brain(self, uid):
+        """Return the StoredBrain of a UID, None without stored metadata"""
+        entry = self.storage["objects"].get(uid)
+        metadata = self.storage.get("metadata")
+        if entry is None or metadata is None or uid not in metadata:
+            return None
+        return StoredBrain(uid, entry[2], metadata[uid])
+
+    def _fetch(self, portal_type, uids):
+        """Resolve the brains of UIDs from the index, the ones without stored
+        metadata are fetched with one query"""
+        stale = []
+        for uid in sorted(set(uids)):
+            if uid in self._brains:
+                continue
+            brain = self._stored_brain(uid)
+            if brain is None:
+                stale.append(uid)
+            else:
+                self._set(self._brains, uid, brain)
+        if not stale:
+            return
+        found = dict(
+            (brain.UID, brain) for brain in self._search(portal_type, UID=stale)
+        )
+        for uid in stale:
+            self._set(self._brains, uid, found.get(uid))
+
+    def _resolve(self, portal_type, uid):
+        if uid is None:
+            return None
+        self._fetch(portal_type, [uid])
+        return self._brains[uid]
+
+    def _path_of(self, uid):
+        """Return the stored path of the object of a UID"""
+        entry = self.storage["objects"].get(uid)
+        return entry[2] if entry is not None else None
+
+    def _location_uid(self, location_id):
+        tree = self.storage["SamplePointLocation"]
+        for key in keys_with_prefix(tree, (location_id,)):
+            return tree[key]
+        return None
+
+    def prefetch(self, file_type, rows):
+        """Resolve the brains the rows of a file look up, the ones without
+        stored metadata with one query per portal type for all of them"""
+        uids = {}
+
+        def add(portal_type, uid):
+            if uid is not None:
+                uids.setdefault(portal_type, []).append(uid)
+            return uid
+
+        for row in rows:
+            if file_type in ("Accounts", "Locations"):
+                client_uid = add(
+                    "Client", self.storage["Client"].get(row.Customer_Number)
+                )
+                if file_type == "Accounts" or client_uid is None:
+                    continue
+                key = (row.Locations_id, self._path_of(client_uid))
+                add("SamplePointLocation", self.storage["SamplePointLocation"].get(key))
+                continue
+            location_id = (
+                row.Location_id if file_type == "Systems" else row.Locations_id
+            )
+            location_uid = add("SamplePointLocation", self._location_uid(location_id))
+            if location_uid is None:
+                continue
+            location_path = self._path_of(location_uid)
+            if file_type == "Systems":
+                key = (location_path, row.SystemID)
+                add("SamplePoint", self.storage["SamplePoint"].get(key))
+            else:
+                client_path = location_path.rsplit("/", 1)[0]
+                add("Client", self.storage["paths"].get(client_path))
+        for portal_type, batch in uids.items():
+            self._fetch(portal_type, batch)
+
+    def get_client(self, client_id):
+        if client_id not in self._clients:
+            uid = self.storage["Client"].get(client_id)
+            self._set(self._clients, client_id, self._resolve("Client", uid))
+        return self._clients[client_id]
+
+    def get_client_at(self, path):
+        if path not in self._client_paths:
+            uid = self.storage["paths"].get(path)
+            self._set(self._client_paths, path, self._resolve("Client", uid))
+        return self._client_paths[path]
+
+    def get_location(self, client_path, location_id):
+        key = (client_path, location_id)
+        if key not in self._locations:
+            uid = self.storage["SamplePointLocation"].get((location_id, client_path))
+            self._set(self._locations, key, self._resolve("SamplePointLocation", uid))
+        return self._locations[key]
+
+    def get_location_by_id(self, location_id):
+        if location_id not in self._location_ids:
+            uid = self._location_uid(location_id)
+            brain = self._resolve("SamplePointLocation", uid)
+            self._set(self._location_ids, location_id, brain)
+        return self._location_ids[location_id]
+
+    def add_location(self, client_path, location_id, brain):
+        self._set(self._locations, (client_path, location_id), brain)
+        if self._location_ids.get(location_id) is None:
+            self._set(self._location_ids, location_id, brain)
+
+    def get_system(self, location_path, system_id):
+        key = (location_path, system_id)
+        systems = self._systems.setdefault(location_path, {})
+        if system_id not in systems:
+            uid = self.storage["SamplePoint"].get(key)
+            self._set(systems, system_id, self._resolve("SamplePoint", uid))
+        return systems[system_id]
+
+    def get_systems_in(self, location_path):
+        tree = self.storage["SamplePoint"]
+        keys = list(keys_with_prefix(tree, (location_path,)))
+        self._fetch("SamplePoint", [tree[key] for key in keys])
+        for key in keys:
+            self.get_system(*key)
+        systems = self._systems.get(location_path, {}).values()
+        return [brain for brain in systems if brain is not None]
+
+    def get_active_systems_in(self, location_paths):
+        """Return the active system brains of locations with one query"""
+        systems = dict((path, []) for path in location_paths)
+        if not systems:
+            return systems
+        brains = self._search(
+            "SamplePoint",
+            path={"query": list(systems), "depth": 1},
+            review_state="active",
+        )
+        for brain in brains:
+            path = parent_path(brain)
+            systems_in = self._systems.setdefault(path, {})
+            if brain["getSamplePointID"] not in systems_in:
+                self._set(systems_in, brain["getSamplePointID"], brain)
+            if path in systems and self.get_review_state(brain) == "active":
+                systems[path].append(brain)
+        return systems
+
+    def add_system(self, location_path, system_id, brain):
+        self._set(self._systems.setdefault(location_path, {}), system_id, brain)
+
+    def get_contact_emails(self, client):
+        path = client.getPath()
+        if path not in self._emails:
+            tree = self.storage["Contact"]
+            emails = set(key[1] for key in keys_with_prefix(tree, (path,)))
+            self._set(self._emails, path, emails)
+        return self._emails[path]
+
+    def get_values(self, brain):
+        return self.storage["values"].get(brain.UID)
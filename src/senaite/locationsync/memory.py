@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Keep the objects woken by a run from filling the memory of the worker.
+
+Objects woken while the files are processed stay in the ZODB connection
+cache, which is only garbage collected between requests, so a full run
+grows with the size of the files. A CacheGuard counts the objects the
+passes wake and minimizes the cache when a budget is reached, and an
+ObjectCache keeps the few objects the passes revisit, like the location of
+consecutive systems rows, without keeping all of them.
+"""
+
+from collections import OrderedDict
+import os
+import resource
+import transaction
+
+# Objects woken between two minimizations of the connection cache, when the
+# control panel has no value
+CACHE_BUDGET = 5000
+# Objects kept by an ObjectCache
+LRU_SIZE = 100
+
+
+def rss_mb():
+    """Return the resident memory of the process in MB, None if unknown"""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024.0 / 1024.0
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of the process in MB"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class ObjectCache(object):
+    """The objects used last by key, at most `size` of them"""
+
+    def __init__(self, size=LRU_SIZE):
+        self.size = size
+        self.objects = OrderedDict()
+        self.hits = 0
+
+    def get(self, key, load):
+        """Return the object of key, from `load()` if it is not kept"""
+        obj = self.objects.pop(key, None)
+        if obj is None:
+            obj = load()
+            if len(self.objects) >= self.size:
+                self.objects.popitem(last=False)
+        else:
+            self.hits += 1
+        self.objects[key] = obj
+        return obj
+
+    def clear(self):
+        self.objects.clear()
+
+
+class CacheGuard(object):
+    """Release the objects of the connection cache of `jar` as they are woken
+
+    The cache is minimized each time `budget` objects were woken, 0 leaves
+    it to the garbage collection at commits. Changes are saved to a
+    savepoint taken with `savepoint(optimistic)` first, objects with unsaved
+    changes cannot be released.
+    """
+
+    def __init__(self, jar, budget=CACHE_BUDGET, savepoint=transaction.savepoint):
+        self.jar = jar
+        self.budget = budget
+        self.savepoint = savepoint
+        self.woken = 0
+        self.minimized = 0
+
+    def woke(self):
+        """Count a woken object, minimizing the cache once over budget"""
+        self.woken += 1
+        if self.budget and self.woken >= self.budget:
+            self.savepoint(optimistic=True)
+            self.minimize()
+
+    def minimize(self):
+        """Turn all objects in the cache into ghosts"""
+        self.woken = 0
+        if self.jar is None:
+            return
+        self.jar.cacheMinimize()
+        self.minimized += 1
+
+    def committed(self):
+        """Reduce the cache to its configured size after a commit"""
+        if self.jar is not None:
+            self.jar.cacheGC()
+
+    def cached(self):
+        """Return the number of objects in the cache that are not ghosts"""
+        if self.jar is None:
+            return 0
+        return self.jar._cache.cache_non_ghost_count
+
+    def report(self):
+        """Return a line on the memory used by the process and the cache"""
+        rss = rss_mb()
+        rss = "unknown" if rss is None else "{:.1f}".format(rss)
+        return "{} MB resident, {:.1f} MB peak, {} objects cached, {} minimizations".format(
+            rss, peak_rss_mb(), self.cached(), self.minimized
+        )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Preflight of the sync files in a pool of worker processes.
+
+The files are parsed, cleaned and validated concurrently, away from the
+Zope thread and without any database access. Each worker returns the
+values of the valid rows in batches, together with the errors and
+warnings found, so the Zope thread only has to apply the rules.
+"""
+
+import csv
+import multiprocessing
+
+from senaite.locationsync.reader import decoded_lines
+from senaite.locationsync.reader import decoding_warnings
+from senaite.locationsync.reader import file_lines
+from senaite.locationsync.reader import iter_chunks
+from senaite.locationsync.reader import iter_values
+from senaite.locationsync.reader import new_stats
+from senaite.locationsync.reader import open_data_file
+from senaite.locationsync.reader import read_header
+
+BATCH_SIZE = 1000
+
+
+def parse_file(job):
+    """Parse and validate a file, job is (file_type, file_name, file_path,
+    headers, use_mmap)
+
+    Returns a dict with the (row number, values) of the rows in `batches` of
+    tuples, the `errors`
+    and `warnings` found and the number of valid rows in `num_rows`.
+    """
+    file_type, file_name, file_path, headers, use_mmap = job
+    result = {
+        "file_type": file_type,
+        "file_name": file_name,
+        "batches": [],
+        "errors": [],
+        "warnings": [],
+        "num_rows": 0,
+    }
+    stats = new_stats()
+    with open_data_file(file_path) as csvfile:
+        reader = csv.reader(
+            decoded_lines(file_lines(csvfile, use_mmap), stats),
+            delimiter=",",
+            quotechar='"',
+        )
+        msg = read_header(reader, file_name, headers)
+        if msg is not None:
+            result["header_error"] = msg
+            result["errors"].append(msg)
+            return result
+        values = iter_values(reader, file_name, headers, stats, result["errors"].append)
+        for batch in iter_chunks(values, BATCH_SIZE):
+            result["batches"].append([(num, tuple(row)) for num, row in batch])
+    result["warnings"] = decoding_warnings(file_name, stats)
+    result["num_rows"] = sum(len(batch) for batch in result["batches"])
+    return result
+
+
+def preflight(jobs):
+    """Run parse_file for all jobs in a process pool, results by file type"""
+    pool = multiprocessing.Pool(processes=len(jobs))
+    try:
+        results = pool.map(parse_file, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((result["file_type"], result) for result in results)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Parsing helpers shared by the sync view and the preflight workers.
+
+Nothing in here touches the database, so it can run outside of Zope.
+
+A file is decoded once, line by line, before the csv reader splits it:
+plain ASCII lines are passed on as they are, other lines are checked to be
+valid UTF-8 and repaired when they are not. The cells of the rows can then
+be cleaned without decoding each of them again.
+
+Files can also be read from a memory map in chunks of whole lines instead
+of through the file object, see `file_lines`. A sync file may be gzipped,
+in which case it has the GZIP_SUFFIX added to its name and is decompressed
+while it is read.
+"""
+
+import codecs
+import gzip
+import io
+import mmap
+import os
+
+from senaite.locationsync.cleaning import clean_valid_row
+from senaite.locationsync.cleaning import NON_ASCII
+from senaite.locationsync.validation import format_rows
+
+GZIP_SUFFIX = ".gz"
+# Bytes of the memory map split into lines at a time
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def new_stats():
+    """Return empty decoding statistics of a file"""
+    return {"encoding": "utf-8", "bad_offsets": [], "bad_bytes": 0, "replaced": []}
+
+
+def data_file_path(folder, file_name):
+    """Return the path of a sync file in folder, gzipped or not, or None"""
+    for name in (file_name, file_name + GZIP_SUFFIX):
+        file_path = "{}/{}".format(folder, name)
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+
+def is_gzipped(file_path):
+    """Tell whether a sync file is gzipped by its name"""
+    return file_path.endswith(GZIP_SUFFIX)
+
+
+def open_data_file(file_path):
+    """Open a sync file for reading, gzipped files are decompressed as read
+
+    The gzip file is buffered, as its own line reading is much slower.
+    """
+    if is_gzipped(file_path):
+        return io.BufferedReader(gzip.open(file_path, "rb"))
+    return open(file_path, "rb")
+
+
+def file_lines(csvfile, use_mmap=False):
+    """Return the lines of an open file, from a memory map with use_mmap
+
+    Gzipped files are never mapped, the map would hold the compressed data.
+    """
+    if not use_mmap or is_gzipped(csvfile.name):
+        return csvfile
+    return mapped_lines(csvfile)
+
+
+def mapped_lines(csvfile, chunk_size=CHUNK_SIZE):
+    """Yield the lines of an open file from a read only memory map
+
+    The map is split in chunks of about chunk_size bytes that end after a
+    newline, so no line is cut in two. A quoted value spanning lines is put
+    back together by the csv reader, which reads on to the next line while a
+    quote is open, just like it does with the lines of a file object.
+    """
+    size = os.fstat(csvfile.fileno()).st_size
+    if size == 0:
+        return
+    data = mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start = 0
+        while start < size:
+            end = data.rfind(b"\n", start, start + chunk_size)
+            if end == -1:
+                # a line longer than a chunk
+                end = data.find(b"\n", start + chunk_size)
+            if end == -1:
+                end = size - 1
+            stop = end + 1
+            lines = data[start:stop].split(b"\n")
+            start = stop
+            last = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+            if last:
+                yield last
+    finally:
+        data.close()
+
+
+def iter_chunks(items, size):
+    """Yield the items in lists of at most size items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decoded_lines(lines, stats):
+    """Yield the lines of a file as valid UTF-8
+
+    Invalid byte sequences are replaced by U+FFFD, which cleaning drops like
+    it did when each cell was decoded on its own, and their file offsets are
+    collected in stats.
+    """
+    offset = 0
+    for num, line in enumerate(lines):
+        if num == 0 and line.startswith(codecs.BOM_UTF8):
+            stats["encoding"] = "utf-8-sig"
+        size = len(line)
+        if NON_ASCII.search(line) is not None:
+            try:
+                line.decode("utf-8")
+            except UnicodeDecodeError:
+                line = repair_line(line, offset, stats)
+        offset += size
+        yield line
+
+
+def repair_line(line, offset, stats):
+    """Return a line with every invalid UTF-8 sequence replaced by U+FFFD"""
+    stats["encoding"] = "cp1252"
+    parts = []
+    pos = 0
+    while True:
+        try:
+            parts.append(line[pos:].decode("utf-8"))
+            break
+        except UnicodeDecodeError as e:
+            parts.append(line[pos:pos + e.start].decode("utf-8"))
+            parts.append(u"\ufffd")
+            stats["bad_offsets"].append(offset + pos + e.start)
+            stats["bad_bytes"] += e.end - e.start
+            pos += e.end
+    return u"".join(parts).encode("utf-8")
+
+
+def first_row(reader):
+    """Return the first non empty row of a csv reader"""
+    for row in reader:
+        if len(row) > 0:
+            return row
+    return []
+
+
+def header_error(file_name, headers, row):
+    """Return why a cleaned header row is incorrect, None if it is correct"""
+    if len(headers) != len(row):
+        return "File {} has incorrect number of headers: found {}, it must be {}".format(
+            file_name, len(row), len(headers)
+        )
+    if headers != row:
+        return "File {} has incorrect headers: found [{}], it must be [{}]".format(
+            file_name, ", ".join(row), ", ".join(headers)
+        )
+    return None
+
+
+def column_error(file_name, headers, row, row_num):
+    """Return why a cleaned row is incorrect, None if it is correct"""
+    if len(headers) != len(row):
+        return "File {} incorrect number of columns {} in row {}".format(
+            file_name,
+            len(row),
+            row_num,
+        )
+    return None
+
+
+def read_header(reader, file_name, headers):
+    """Read the header row, returns why it is incorrect or None"""
+    return header_error(file_name, headers, clean_valid_row(first_row(reader)))
+
+
+def iter_values(reader, file_name, headers, stats, on_error):
+    """Yield the row number and the cleaned values of the data rows with the
+    right columns
+
+    Rows are numbered from 1 after the header row, the numbers all messages
+    about a row refer to. Values are native strings, except for the few cells that keep a 0x80
+    byte after cleaning, which are decoded with U+FFFD replacements as
+    before and recorded in stats. on_error is called with the message of
+    each row that has the wrong number of columns.
+    """
+    replaced = stats["replaced"]
+    for i, row in enumerate(reader, 1):
+        if len(row) == 0:
+            continue
+        row = clean_valid_row(row)
+        msg = column_error(file_name, headers, row, i)
+        if msg is not None:
+            on_error(msg)
+            continue
+        for idx, cell in enumerate(row):
+            if b"\x80" in cell:
+                row[idx] = cell.decode("utf-8", "replace")
+                replaced.append((i, headers[idx]))
+        yield i, row
+
+
+def decoding_warnings(file_name, stats):
+    """Return the aggregated warnings about the encoding of a file"""
+    warnings = []
+    if stats["bad_offsets"]:
+        warnings.append(
+            "File {} is not valid UTF-8 (probably {}), {} bytes that could not be "
+            "decoded were dropped at byte offsets {}".format(
+                file_name,
+                stats["encoding"],
+                stats["bad_bytes"],
+                format_rows(stats["bad_offsets"]),
+            )
+        )
+    if stats["replaced"]:
+        warnings.append(
+            "File {} has {} values with characters that were replaced: {}".format(
+                file_name,
+                len(stats["replaced"]),
+                format_rows(
+                    ["row {} {}".format(num, field) for num, field in stats["replaced"]]
+                ),
+            )
+        )
+    return warnings
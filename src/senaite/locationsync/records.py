@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Headers of the sync files and the record types their rows are read into.
+
+Each file type gets its own namedtuple class, generated from the file
+headers, so a row is an immutable tuple with attribute access by header
+name instead of a dict keyed by the header strings.
+"""
+
+from collections import namedtuple
+
+ACCOUNT_FILE_HEADERS = ["Customer_Number", "Account_name", "Inactive", "On_HOLD"]
+LOCATION_FILE_HEADERS = [
+    "Customer_Number",
+    "location_name",
+    "Locations_id",
+    "account_manager1",
+    "street",
+    "city",
+    "state",
+    "postcode",
+    "branch",
+    "Contract_Number",
+    "HOLD",
+    "Cancel_Box",
+]
+SYSTEM_FILE_HEADERS = [
+    "Location_id",
+    "Equipment_ID",
+    "SystemID",
+    "Equipment_Description2",
+    "system_name",
+    "Inactive_Retired_Flag",
+    "system",
+]
+CONTACT_FILE_HEADERS = ["contactID", "Locations_id", "WS_Contact_Name", "email"]
+
+
+def make_record_class(name, headers):
+    """Return a namedtuple class with one field per header
+
+    The class has empty `__slots__`, so records carry no instance dict.
+    """
+    base = namedtuple(name, headers)
+    return type(name, (base,), {"__slots__": ()})
+
+
+AccountRow = make_record_class("AccountRow", ACCOUNT_FILE_HEADERS)
+LocationRow = make_record_class("LocationRow", LOCATION_FILE_HEADERS)
+SystemRow = make_record_class("SystemRow", SYSTEM_FILE_HEADERS)
+ContactRow = make_record_class("ContactRow", CONTACT_FILE_HEADERS)
+
+RECORD_TYPES = {
+    "Accounts": AccountRow,
+    "Locations": LocationRow,
+    "Systems": SystemRow,
+    "Contacts": ContactRow,
+}
+
+# Fields that identify a row of each file type
+NATURAL_KEYS = {
+    "Accounts": ("Customer_Number",),
+    "Locations": ("Locations_id",),
+    "Systems": ("SystemID",),
+    "Contacts": ("contactID", "Locations_id"),
+}
+
+# Fields that must have a value in every row of each file type
+REQUIRED_FIELDS = {
+    "Accounts": ("Customer_Number",),
+    "Locations": ("Customer_Number", "Locations_id"),
+    "Systems": ("SystemID",),
+    "Contacts": ("contactID", "Locations_id"),
+}
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Reindex the objects a run changes once per batch, only where they changed.
+
+Reindexing an object right after each change updates all the indexes of
+all its catalogs, again for each change. A ReindexQueue collects the
+objects changed by the rows of a batch with the attributes changed, and
+reindexes each object once when the batch is saved, limited to the indexes
+of those attributes. The metadata columns are updated whenever an object
+is reindexed, whatever its indexes, and the modification date is updated
+as a full reindex does.
+"""
+
+from collections import OrderedDict
+import time
+
+# Catalog indexes that follow the attributes the sync changes. Catalogs
+# leave out the indexes they do not have. Attributes that are metadata
+# columns only use the UID index, every catalog has it and it is cheap.
+ATTRIBUTE_INDEXES = {
+    "title": ("title", "Title", "sortable_title", "listing_searchable_text"),
+    "SamplePointLocationID": ("getSamplePointLocationID", "listing_searchable_text"),
+    "SamplePointId": ("getSamplePointID", "listing_searchable_text"),
+    "EquipmentID": ("listing_searchable_text",),
+    "EquipmentType": ("listing_searchable_text",),
+    "EquipmentDescription": ("listing_searchable_text",),
+    "AccountManagers": ("UID",),
+    "Address": ("UID",),
+    "Firstname": ("getFullname", "sortable_title", "title", "listing_searchable_text"),
+    "Surname": ("getFullname", "sortable_title", "title", "listing_searchable_text"),
+    "ContactId": ("UID",),
+    "EmailAddress": ("getEmailAddress", "listing_searchable_text"),
+}
+
+
+def indexes_of(attributes):
+    """Return the indexes to update for changed attributes"""
+    indexes = set()
+    for attribute in attributes:
+        indexes.update(ATTRIBUTE_INDEXES[attribute])
+    return indexes
+
+
+def object_path(obj):
+    return "/".join(obj.getPhysicalPath())
+
+
+class ReindexQueue(object):
+    """The objects to reindex by path, with the indexes to update
+
+    With `deferred` off, objects are reindexed in all their indexes as
+    soon as they are added, the way the sync used to.
+    """
+
+    def __init__(self, deferred=True, clock=time.time):
+        self.deferred = deferred
+        self.clock = clock
+        self.queued = OrderedDict()
+        # (path, indexes before) of each add, undone by a rollback
+        self.journal = []
+        self.changes = 0
+        self.reindexed = 0
+        self.seconds = 0.0
+
+    def add(self, obj, *attributes):
+        """Reindex an object whose attributes changed"""
+        self.changes += 1
+        indexes = indexes_of(attributes)
+        if not self.deferred:
+            self.reindex(obj, [])
+            return
+        path = object_path(obj)
+        if path in self.queued:
+            queued = self.queued[path][1]
+            self.journal.append((path, set(queued)))
+            queued.update(indexes)
+        else:
+            self.journal.append((path, None))
+            self.queued[path] = (obj, indexes)
+
+    def mark(self):
+        """Return a mark to forget what is added after it"""
+        return len(self.journal)
+
+    def rollback(self, mark):
+        """Forget the objects and indexes added since the mark was taken"""
+        while len(self.journal) > mark:
+            path, indexes = self.journal.pop()
+            if indexes is None:
+                del self.queued[path]
+            else:
+                self.queued[path] = (self.queued[path][0], indexes)
+
+    def clear(self):
+        """Forget the queued objects, their changes were aborted"""
+        del self.journal[:]
+        self.queued.clear()
+
+    def flush(self):
+        """Reindex the queued objects, each once"""
+        del self.journal[:]
+        while self.queued:
+            path, (obj, indexes) = self.queued.popitem(last=False)
+            self.reindex(obj, sorted(indexes))
+
+    def reindex(self, obj, indexes):
+        start = self.clock()
+        if indexes and hasattr(obj, "notifyModified"):
+            # only a full reindex updates the modification date itself
+            obj.notifyModified()
+            indexes.append("modified")
+        obj.reindexObject(idxs=indexes)
+        self.seconds += self.clock() - start
+        self.reindexed += 1
+
+    def report(self):
+        """Return a line on the reindexing done so far"""
+        how = "in the indexes changed" if self.deferred else "in all indexes"
+        return "Reindexed {} objects {} for {} changes in {:.2f} seconds".format(
+            self.reindexed, how, self.changes, self.seconds
+        )
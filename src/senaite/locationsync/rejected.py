@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Rows rolled back because processing them failed, kept to be replayed.
+
+The rejected rows of a data file are written to the errors folder with the
+header of the file, as `<file name>.rejected.csv`, so a replay run can
+process them like a data file. Rows rejected again are added once, the
+rows of earlier runs are kept until a replay processes them. The files are
+only written once the changes of the run are committed.
+"""
+
+import csv
+import os
+
+import transaction
+
+REJECTED_SUFFIX = ".rejected.csv"
+
+
+def rejected_file_name(file_name):
+    """Return the name of the rejected rows file of a data file"""
+    return os.path.splitext(file_name)[0] + REJECTED_SUFFIX
+
+
+def encoded(value):
+    """Return a cell value as UTF-8 bytes for the csv writer"""
+    if isinstance(value, bytes):
+        return value
+    return value.encode("utf-8")
+
+
+def read_rejected(file_path):
+    """Return the rows of a rejected rows file without its header"""
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, "rb") as csvfile:
+        rows = list(csv.reader(csvfile, delimiter=",", quotechar='"'))
+    return rows[1:]
+
+
+def write_rejected(file_path, headers, rows, replace=False):
+    """Write rejected rows to a file, returns the number of rows in it
+
+    The rows are added to those already in the file, unless `replace` is
+    set as when a replay processed them. The file is removed when it ends
+    up without rows.
+    """
+    kept = [] if replace else read_rejected(file_path)
+    for row in rows:
+        row = [encoded(value) for value in row]
+        if row not in kept:
+            kept.append(row)
+    if not kept:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return 0
+    with open(file_path, "wb") as csvfile:
+        writer = csv.writer(csvfile, delimiter=",", quotechar='"')
+        writer.writerow(headers)
+        writer.writerows(kept)
+    return len(kept)
+
+
+class RejectedFiles(object):
+    """The rejected rows files of a run, written once its changes commit
+
+    `rows` holds the rows rolled back by file type, as the run rejects
+    them. The files noted with `keep` are written by an after-commit hook
+    of the transaction, so a run that is aborted or fails to commit leaves
+    them as they were. With `replace` set, as for a replay, the rows in a
+    file are replaced by the rows rejected again.
+    """
+
+    def __init__(self, folder, rows, replace=False):
+        self.folder = folder
+        self.rows = rows
+        self.replace = replace
+        # (file type, data file name, headers) of the files to write
+        self.kept = []
+
+    def keep(self, file_type, file_name, headers):
+        """Write the rejected rows of a data file once the changes commit"""
+        self.kept.append((file_type, file_name, headers))
+        self.join()
+
+    def join(self):
+        """Write the kept files when the current transaction commits"""
+        txn = transaction.get()
+        hooks = [hook for hook, _, _ in txn.getAfterCommitHooks()]
+        if self.kept and self.write not in hooks:
+            txn.addAfterCommitHook(self.write)
+
+    def write(self, committed):
+        """Write the kept files, unless the transaction failed to commit"""
+        if not committed:
+            return
+        while self.kept:
+            file_type, file_name, headers = self.kept.pop(0)
+            write_rejected(
+                os.path.join(self.folder, rejected_file_name(file_name)),
+                headers,
+                self.rows.get(file_type, []),
+                replace=self.replace,
+            )
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Event subscribers keeping the external ID index current."""
+
+from senaite.locationsync.external_ids import index_object
+from senaite.locationsync.external_ids import unindex_object
+
+
+def object_moved(obj, event):
+    """Index added and moved objects and unindex removed ones"""
+    if event.newParent is None:
+        unindex_object(obj)
+    else:
+        index_object(obj)
+
+
+def object_modified(obj, event):
+    """Index a modified object again, its external ID may have changed"""
+    index_object(obj)
+
+
+def object_transitioned(obj, event):
+    """Index an object again, its review state is kept in the index"""
+    index_object(obj)
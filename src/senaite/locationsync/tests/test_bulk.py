@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from senaite.locationsync.bulk import BulkCreator
+from senaite.locationsync.bulk import CreatedBrain
+
+
+class Content(object):
+    def __init__(self, path, title=""):
+        self.path = path
+        self.title = title
+
+    def getPhysicalPath(self):
+        return tuple(self.path.split("/"))
+
+    def UID(self):
+        return "uid-" + self.path
+
+    def Title(self):
+        return self.title
+
+
+class BulkCreatorTest(unittest.TestCase):
+    def setUp(self):
+        self.finished = []
+        self.indexed = []
+        self.creator = BulkCreator(
+            self.create, self.finished.append, lambda: self.indexed.append(1)
+        )
+        self.client = Content("/plone/clients/c1")
+        self.location = Content("/plone/clients/c1/l1")
+
+    def create(self, container, portal_type, **values):
+        return Content("{}/{}".format(container.path, values["title"]), values["title"])
+
+    def titles(self, objects):
+        return [obj.title for obj in objects]
+
+    def test_objects_are_finished_by_container(self):
+        self.creator.add(self.client, "SamplePointLocation", title="l2")
+        self.creator.add(self.location, "SamplePoint", title="s1")
+        self.creator.add(self.client, "SamplePointLocation", title="l3")
+        self.assertEqual(self.finished, [])
+        self.creator.flush()
+        self.assertEqual(
+            [self.titles(objects) for objects in self.finished],
+            [["l2", "l3"], ["s1"]],
+        )
+        self.assertEqual(self.indexed, [1])
+        self.creator.flush()
+        self.assertEqual(self.indexed, [1])
+        self.assertEqual(self.creator.created, 3)
+        self.assertEqual(self.creator.batches, 1)
+
+    def test_rollback_forgets_created_objects(self):
+        self.creator.add(self.location, "SamplePoint", title="s1")
+        mark = self.creator.mark()
+        self.creator.add(self.location, "SamplePoint", title="s2")
+        self.creator.add(self.client, "SamplePointLocation", title="l2")
+        self.creator.rollback(mark)
+        self.creator.flush()
+        self.assertEqual([self.titles(objects) for objects in self.finished], [["s1"]])
+        self.assertEqual(self.creator.created, 1)
+
+    def test_clear(self):
+        self.creator.add(self.location, "SamplePoint", title="s1")
+        self.creator.flush()
+        self.creator.add(self.location, "SamplePoint", title="s2")
+        self.creator.clear()
+        self.creator.flush()
+        self.assertEqual(len(self.finished), 1)
+        self.assertEqual(self.creator.created, 1)
+
+    def test_created_brain(self):
+        obj = Content("/plone/clients/c1/l1/s1", "System 1")
+        brain = CreatedBrain(obj, "active", getSamplePointID="S1")
+        self.assertEqual(brain.getPath(), "/plone/clients/c1/l1/s1")
+        self.assertEqual(brain["getSamplePointID"], "S1")
+        self.assertEqual(brain.Title, "System 1")
+        self.assertEqual(brain.UID, obj.UID())
+        self.assertEqual(brain.review_state, "active")
+        self.assertIs(brain.getObject(), obj)
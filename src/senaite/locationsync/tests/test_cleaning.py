@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from senaite.locationsync.cleaning import clean_valid_row
+from senaite.locationsync.cleaning import reference_clean_row
+from senaite.locationsync.reader import decoded_lines
+from senaite.locationsync.reader import new_stats
+
+
+def decoded(cell):
+    """Return a raw cell the way decoded_lines passes it on"""
+    return list(decoded_lines([cell], new_stats()))[0]
+
+
+class CleanValidRowTest(unittest.TestCase):
+    def test_ascii_row_is_stripped(self):
+        row = [b" C1 ", b"Client One\t", b"0", b""]
+        self.assertEqual(clean_valid_row(row), [b"C1", b"Client One", b"0", b""])
+
+    def test_non_ascii_bytes_are_dropped(self):
+        row = [b"\xef\xbb\xbfCustomer_Number", b"Caf\xc3\xa9", b"x \xc2\xa0"]
+        self.assertEqual(clean_valid_row(row), [b"Customer_Number", b"Caf", b"x "])
+
+    def test_matches_reference_once_decoded(self):
+        rnd = random.Random(0)
+        alphabet = bytearray(b" abc\t") + bytearray(range(0x80, 0x100))
+        samples = [
+            b"O\xe2\x80\x99Brien",
+            b"\xc3\x80 grave",
+            b"bad \x92 cp1252",
+            b"\xe2\x80",
+        ]
+        for _ in range(2000):
+            size = rnd.randint(0, 12)
+            samples.append(bytes(bytearray(rnd.choice(alphabet) for _ in range(size))))
+        for cell in samples:
+            self.assertEqual(
+                clean_valid_row([decoded(cell)]), reference_clean_row([cell]), cell
+            )
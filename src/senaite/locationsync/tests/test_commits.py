@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+from persistent.mapping import PersistentMapping
+import transaction
+import unittest
+import ZODB
+
+from senaite.locationsync.commits import CommitPolicy
+from senaite.locationsync.commits import conflict_wait
+from ZODB.POSException import ConflictError
+
+
+class Jar(object):
+    def __init__(self):
+        self._registered_objects = []
+
+
+class Changed(object):
+    def __init__(self, oid):
+        self._p_oid = oid
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CommitPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.jar = Jar()
+        self.clock = Clock()
+        self.saved = []
+        self.slept = []
+        self.replayed = []
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+
+    def policy(self, **kwargs):
+        kwargs.setdefault("rows", 0)
+        kwargs.setdefault("seconds", 0)
+        kwargs.setdefault("objects", 0)
+        kwargs.setdefault("replay", lambda: self.replayed.append(1))
+        return CommitPolicy(
+            self.jar,
+            on_save=lambda: self.saved.append(1),
+            clock=self.clock,
+            sleep=self.slept.append,
+            **kwargs
+        )
+
+    def conflicting(self, count):
+        """Return a before_save that conflicts count times"""
+        conflicts = [ConflictError() for i in range(count)]
+
+        def before_save():
+            self.clock.now += 1
+            if conflicts:
+                raise conflicts.pop()
+
+        return before_save
+
+    def test_every_rows(self):
+        policy = self.policy(rows=3)
+        for i in range(7):
+            policy.row()
+        self.assertEqual(policy.savepoints, 2)
+        self.assertEqual(policy.commits, 0)
+        self.assertEqual(len(self.saved), 2)
+
+    def test_every_seconds(self):
+        policy = self.policy(seconds=60)
+        policy.row()
+        self.clock.now = 59
+        policy.row()
+        self.assertEqual(policy.savepoints, 0)
+        self.clock.now = 60
+        policy.row()
+        self.assertEqual(policy.savepoints, 1)
+        self.clock.now = 100
+        policy.row()
+        self.assertEqual(policy.savepoints, 1)
+
+    def test_changed_objects(self):
+        policy = self.policy(objects=2)
+        self.jar._registered_objects.append(Changed(1))
+        policy.row()
+        self.assertEqual(policy.savepoints, 0)
+        self.jar._registered_objects.append(Changed(2))
+        policy.row()
+        self.assertEqual(policy.savepoints, 1)
+
+    def test_changed_objects_are_counted_across_savepoints(self):
+        policy = self.policy(objects=3)
+        for oid in (1, 2, 1):
+            self.jar._registered_objects.append(Changed(oid))
+            policy.savepoint()
+            # a savepoint forgets the registered objects
+            del self.jar._registered_objects[:]
+            policy.row()
+        self.assertEqual(policy.changed_objects(), 2)
+        self.assertEqual(policy.savepoints, 0)
+        self.jar._registered_objects.append(Changed(3))
+        policy.row()
+        self.assertEqual(policy.savepoints, 1)
+        del self.jar._registered_objects[:]
+        self.assertEqual(policy.changed_objects(), 0)
+
+    def test_commit(self):
+        policy = self.policy(rows=1, commit=True)
+        policy.row()
+        self.assertEqual(policy.commits, 1)
+        self.assertEqual(policy.savepoints, 0)
+
+    def test_before_save(self):
+        calls = []
+        policy = self.policy(rows=2, before_save=lambda: calls.append(len(self.saved)))
+        for i in range(4):
+            policy.row()
+        self.assertEqual(calls, [0, 1])
+
+    def test_conflicts_are_retried(self):
+        policy = self.policy(commit=True, before_save=self.conflicting(2))
+        policy.save()
+        self.assertEqual(policy.commits, 1)
+        self.assertEqual(policy.conflicts, 2)
+        self.assertEqual(len(self.replayed), 2)
+        self.assertEqual(len(self.slept), 2)
+        self.assertEqual(policy.retried, [2])
+        self.assertEqual(policy.attempts, 0)
+        self.assertTrue(policy.report().startswith("2 conflicts, 1 batches saved"))
+
+    def test_retries_are_used_up(self):
+        policy = self.policy(commit=True, retries=1, before_save=self.conflicting(2))
+        self.assertRaises(ConflictError, policy.save)
+        self.assertEqual(policy.commits, 0)
+        self.assertEqual(len(self.replayed), 1)
+
+    def test_replay_conflicts(self):
+        replays = [ConflictError()]
+
+        def replay():
+            self.replayed.append(1)
+            if replays:
+                raise replays.pop()
+
+        policy = self.policy(commit=True, replay=replay)
+        policy.retry(ConflictError())
+        self.assertEqual(policy.conflicts, 2)
+        self.assertEqual(len(self.replayed), 2)
+
+    def test_conflicts_without_commits_are_raised(self):
+        policy = self.policy()
+        self.assertRaises(ConflictError, policy.retry, ConflictError())
+        self.assertEqual(self.replayed, [])
+        self.assertEqual(self.slept, [])
+
+    def test_conflict_wait_grows(self):
+        for attempt in range(3):
+            wait = conflict_wait(attempt)
+            self.assertTrue(2**attempt * 0.5 <= wait <= 2**attempt)
+
+    def test_describe(self):
+        self.assertEqual(
+            self.policy(rows=100, seconds=60).describe(),
+            "Take a savepoint every 100 rows or 60 seconds and after each file",
+        )
+        self.assertEqual(
+            self.policy(commit=True).describe(), "Commit after each file only"
+        )
+
+
+class SavepointPerRowTest(unittest.TestCase):
+    """The policy in a ZODB connection taking a savepoint per row"""
+
+    def setUp(self):
+        self.db = ZODB.DB(None)
+        self.jar = self.db.open()
+        root = self.jar.root()
+        for i in range(10):
+            root[i] = PersistentMapping()
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.jar.close()
+        self.db.close()
+
+    def test_objects_changed_in_rows(self):
+        root = self.jar.root()
+        policy = CommitPolicy(self.jar, rows=0, seconds=0, objects=4)
+        for i in range(6):
+            savepoint = policy.savepoint()
+            root[i]["value"] = i
+            root[0]["count"] = i
+            if i == 2:
+                savepoint.rollback()
+            policy.row()
+            # saved once the objects of rows 0, 1, 3 and 4 were changed, the
+            # ones of row 2 were rolled back
+            self.assertEqual(policy.savepoints, 1 if i >= 4 else 0)
+        self.assertEqual(policy.changed_objects(), 2)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from senaite.locationsync.delta import changed_rows
+from senaite.locationsync.delta import latest_archived_file
+from senaite.locationsync.delta import read_snapshot
+from senaite.locationsync.records import NATURAL_KEYS
+from senaite.locationsync.records import SYSTEM_FILE_HEADERS
+from senaite.locationsync.records import SystemRow
+
+SYSTEMS = b"""Location_id,Equipment_ID,SystemID,Equipment_Description2,system_name,Inactive_Retired_Flag,system
+L1,E1,S1,desc1,Sys 1,0,boiler
+L1,E2,S2,desc2,Sys 2,0,tower
+"""
+
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content=SYSTEMS):
+        file_path = os.path.join(self.folder, name)
+        with open(file_path, "wb") as f:
+            f.write(content)
+        return file_path
+
+    def test_latest_archived_file(self):
+        self.assertIsNone(latest_archived_file(self.folder, "system lims.csv"))
+        self.write("system lims.20230102.0900.csv")
+        self.write("system lims.20230101.1200.csv")
+        self.write("location lims.20230103.0900.csv")
+        self.assertEqual(
+            latest_archived_file(self.folder, "system lims.csv"),
+            os.path.join(self.folder, "system lims.20230102.0900.csv"),
+        )
+        self.write("system lims.20230102.1000.csv.gz")
+        self.assertEqual(
+            latest_archived_file(self.folder, "system lims.csv"),
+            os.path.join(self.folder, "system lims.20230102.1000.csv.gz"),
+        )
+
+    def test_changed_rows(self):
+        file_path = self.write("system lims.20230101.1200.csv")
+        key_fields = NATURAL_KEYS["Systems"]
+        snapshot = read_snapshot(file_path, SYSTEM_FILE_HEADERS, key_fields)
+        rows = [
+            SystemRow(u"L1", u"E1", u"S1", u"desc1", u"Sys 1", u"0", u"boiler"),
+            SystemRow(u"L1", u"E2", u"S2", u"changed", u"Sys 2", u"0", u"tower"),
+            SystemRow(u"L2", u"E3", u"S3", u"desc3", u"Sys 3", u"0", u"tower"),
+        ]
+        stats = {"changed": 0, "unchanged": 0}
+        keys = set()
+        result = list(
+            changed_rows(enumerate(rows, 1), snapshot, key_fields, stats, keys)
+        )
+        self.assertEqual(result, [(2, rows[1]), (3, rows[2])])
+        self.assertEqual(stats, {"changed": 2, "unchanged": 1})
+        self.assertEqual(keys, set([(u"S2",), (u"S3",)]))
+
+    def test_parent_changes_are_passed_on(self):
+        file_path = self.write("system lims.20230101.1200.csv")
+        key_fields = NATURAL_KEYS["Systems"]
+        snapshot = read_snapshot(file_path, SYSTEM_FILE_HEADERS, key_fields)
+        row = SystemRow(u"L1", u"E1", u"S1", u"desc1", u"Sys 1", u"0", u"boiler")
+        stats = {"changed": 0, "unchanged": 0}
+        result = list(
+            changed_rows(
+                [(1, row)],
+                snapshot,
+                key_fields,
+                stats,
+                set(),
+                "Location_id",
+                set([(u"L1",)]),
+            )
+        )
+        self.assertEqual(result, [(1, row)])
+
+    def test_snapshot_with_other_headers(self):
+        file_path = self.write("system lims.20230101.1200.csv", b"a,b\n1,2\n")
+        self.assertIsNone(read_snapshot(file_path, SYSTEM_FILE_HEADERS, ("SystemID",)))
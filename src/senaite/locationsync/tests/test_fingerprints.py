@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from senaite.locationsync.fingerprints import file_fingerprint
+from senaite.locationsync.fingerprints import read_fingerprints
+from senaite.locationsync.fingerprints import write_fingerprints
+
+
+class FingerprintsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        file_path = os.path.join(self.folder, name)
+        with open(file_path, "wb") as f:
+            f.write(content)
+        return file_path
+
+    def test_fingerprint_follows_content(self):
+        first = self.write("a.csv", b"Customer_Number\nC1\n")
+        second = self.write("b.csv", b"Customer_Number\nC1\n")
+        third = self.write("c.csv", b"Customer_Number\nC2\n")
+        self.assertEqual(file_fingerprint(first), file_fingerprint(second))
+        self.assertNotEqual(file_fingerprint(first), file_fingerprint(third))
+
+    def test_gzipped_files_match_by_content(self):
+        plain = self.write("a.csv", b"Customer_Number\nC1\n")
+        first = os.path.join(self.folder, "a.csv.gz")
+        second = os.path.join(self.folder, "b.csv.gz")
+        for file_path, level in ((first, 9), (second, 1)):
+            with gzip.GzipFile(file_path, "wb", level, mtime=level) as f:
+                f.write(b"Customer_Number\nC1\n")
+        self.assertEqual(file_fingerprint(first), file_fingerprint(plain))
+        self.assertEqual(file_fingerprint(second), file_fingerprint(plain))
+
+    def test_store_merges_fingerprints(self):
+        self.assertEqual(read_fingerprints(self.folder), {})
+        write_fingerprints(self.folder, {"a.csv": "1", "b.csv": "2"})
+        write_fingerprints(self.folder, {"b.csv": "3"})
+        self.assertEqual(read_fingerprints(self.folder), {"a.csv": "1", "b.csv": "3"})
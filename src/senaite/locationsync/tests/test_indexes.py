@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from senaite.locationsync.indexes import contact_emails
+from senaite.locationsync.indexes import ExternalIdIndex
+from senaite.locationsync.indexes import frozen_address
+from senaite.locationsync.indexes import index_brains
+from senaite.locationsync.indexes import index_brains_in
+from senaite.locationsync.indexes import keys_with_prefix
+from senaite.locationsync.indexes import normalized_email
+from senaite.locationsync.indexes import normalized_name
+from senaite.locationsync.indexes import parent_path
+from senaite.locationsync.indexes import StoredBrain
+from senaite.locationsync.indexes import SyncIndex
+from senaite.locationsync.records import AccountRow
+from senaite.locationsync.records import ContactRow
+from senaite.locationsync.records import LocationRow
+from senaite.locationsync.records import SystemRow
+
+
+class Brain(dict):
+    def getPath(self):
+        return self["path"]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+class Contact(object):
+    def __init__(self, email):
+        self.email = email
+
+    def getEmailAddress(self):
+        return self.email
+
+
+class LabContact(object):
+    def __init__(self, uid, title):
+        self.uid = uid
+        self.title = title
+
+    def UID(self):
+        return self.uid
+
+    def Title(self):
+        return self.title
+
+
+class Client(object):
+    def __init__(self, path, contacts):
+        self.path = path
+        self.contacts = contacts
+
+    def getPath(self):
+        return self.path
+
+    def getObject(self):
+        return self
+
+    def getContacts(self):
+        return self.contacts
+
+
+class Tree(dict):
+    """Sorted keys from a minimum, like a BTree"""
+
+    def keys(self, min=None):
+        return [key for key in sorted(self) if min is None or key >= min]
+
+
+BRAINS = {
+    "Client": [Brain(path="/plone/clients/c1", getClientID="C1")],
+    "SamplePointLocation": [
+        Brain(
+            path="/plone/clients/c1/l1",
+            getSamplePointLocationID="L1",
+            review_state="active",
+        )
+    ],
+    "SamplePoint": [
+        Brain(
+            path="/plone/clients/c1/l1/s1",
+            getSamplePointID="S1",
+            review_state="active",
+        ),
+        Brain(
+            path="/plone/clients/c1/l1/s2",
+            getSamplePointID="S2",
+            review_state="inactive",
+        ),
+    ],
+}
+
+
+class IndexesTest(unittest.TestCase):
+    def test_first_brain_wins(self):
+        brains = [
+            {"getClientID": "C1", "Title": "One"},
+            {"getClientID": "C2", "Title": "Two"},
+            {"getClientID": "C1", "Title": "Duplicate"},
+        ]
+        index = index_brains(brains, "getClientID")
+        self.assertEqual(sorted(index), ["C1", "C2"])
+        self.assertEqual(index["C1"]["Title"], "One")
+
+    def test_brains_are_keyed_by_container(self):
+        brains = [
+            Brain(path="/plone/clients/c1/loc1", getSamplePointLocationID="L1"),
+            Brain(path="/plone/clients/c2/loc1", getSamplePointLocationID="L1"),
+        ]
+        index = index_brains_in(brains, "getSamplePointLocationID")
+        self.assertIs(index[("/plone/clients/c1", "L1")], brains[0])
+        self.assertIs(index[("/plone/clients/c2", "L1")], brains[1])
+        self.assertNotIn(("/plone/clients/c3", "L1"), index)
+
+    def test_contact_emails_are_normalized(self):
+        contacts = [Contact(" Ann@Example.com"), Contact(""), Contact(None)]
+        self.assertEqual(contact_emails(contacts), set(["ann@example.com"]))
+        self.assertIn(normalized_email("ANN@example.com "), contact_emails(contacts))
+
+    def test_frozen_address(self):
+        address = [{"city": "Town", "zip": "3000"}]
+        self.assertEqual(
+            frozen_address(address), frozen_address([{"zip": "3000", "city": "Town"}])
+        )
+        self.assertNotEqual(frozen_address(address), frozen_address([]))
+        self.assertEqual(frozen_address(None), ())
+
+    def test_normalized_name(self):
+        self.assertEqual(normalized_name("--- Smith"), "smith")
+        self.assertEqual(normalized_name(" John  Smith "), "john smith")
+        self.assertEqual(normalized_name("Mary-Jane Smith"), "mary-jane smith")
+
+
+class SyncIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.searched = []
+        self.index = SyncIndex(self.search, self.lab_contacts)
+
+    def search(self, portal_type, **query):
+        self.searched.append(portal_type)
+        return BRAINS[portal_type]
+
+    def lab_contacts(self):
+        return [LabContact("uid1", "--- Smith")]
+
+    def test_one_search_per_portal_type(self):
+        index = self.index
+        self.assertEqual(index.get_client("C1")["path"], "/plone/clients/c1")
+        self.assertIsNone(index.get_client("C2"))
+        self.assertIsNotNone(index.get_client_at("/plone/clients/c1"))
+        self.assertIsNotNone(index.get_location("/plone/clients/c1", "L1"))
+        self.assertIsNone(index.get_location("/plone/clients/c2", "L1"))
+        self.assertIsNotNone(index.get_location_by_id("L1"))
+        self.assertIsNotNone(index.get_system("/plone/clients/c1/l1", "S2"))
+        self.assertEqual(len(index.get_systems_in("/plone/clients/c1/l1")), 2)
+        self.assertEqual(
+            self.searched, ["Client", "SamplePointLocation", "SamplePoint"]
+        )
+        self.assertEqual(index.searches, 3)
+
+    def test_added_entities_are_found(self):
+        index = self.index
+        client_path = "/plone/clients/c2"
+        location_path = client_path + "/l2"
+        index.add_client("C2", Brain(path=client_path))
+        index.add_location(client_path, "L2", Brain(path=location_path))
+        index.add_system(location_path, "S3", Brain(path=location_path + "/s3"))
+        self.assertIsNotNone(index.get_client("C2"))
+        self.assertIsNotNone(index.get_client_at(client_path))
+        self.assertIsNotNone(index.get_location_by_id("L2"))
+        self.assertIsNotNone(index.get_system(location_path, "S3"))
+        self.assertEqual(index.searches, 3)
+
+    def test_reset_searches_again(self):
+        index = self.index
+        client_path = "/plone/clients/c2"
+        index.add_client("C2", Brain(path=client_path))
+        index.reset()
+        self.assertIsNone(index.get_client("C2"))
+        self.assertIsNotNone(index.get_client("C1"))
+        self.assertEqual(self.searched, ["Client", "Client"])
+
+    def test_rollback_undoes_the_changes_after_the_mark(self):
+        index = self.index
+        client = Client("/plone/clients/c1", [Contact("ann@example.com")])
+        index.get_client("C1")
+        index.get_contact_emails(client)
+        mark = index.mark()
+        client_path = "/plone/clients/c2"
+        index.add_client("C2", Brain(path=client_path))
+        index.add_location(client_path, "L1", Brain(path=client_path + "/l1"))
+        index.add_system("/plone/clients/c1/l1", "S3", Brain(path="s3"))
+        index.add_contact_email(client, "bob@example.com")
+        index.add_lab_contact("Ann Lee", "uid2", "Ann Lee")
+        index.set_review_state("/plone/clients/c1/l1", "inactive")
+        index.rollback(mark)
+        self.assertIsNone(index.get_client("C2"))
+        self.assertIsNone(index.get_client_at(client_path))
+        self.assertIsNone(index.get_location(client_path, "L1"))
+        self.assertEqual(index.get_location_by_id("L1")["path"], "/plone/clients/c1/l1")
+        self.assertIsNone(index.get_system("/plone/clients/c1/l1", "S3"))
+        self.assertEqual(index.get_contact_emails(client), set(["ann@example.com"]))
+        self.assertIsNone(index.get_lab_contact("Ann Lee"))
+        location = index.get_location_by_id("L1")
+        self.assertEqual(index.get_review_state(location), "active")
+        # what was loaded after the mark is loaded again, the rest is kept
+        self.assertEqual(
+            self.searched,
+            [
+                "Client",
+                "SamplePointLocation",
+                "SamplePoint",
+                "SamplePointLocation",
+                "SamplePoint",
+            ],
+        )
+
+    def test_saved_changes_are_kept(self):
+        index = self.index
+        mark = index.mark()
+        index.add_client("C2", Brain(path="/plone/clients/c2"))
+        index.saved()
+        self.assertEqual(index.mark(), 0)
+        index.rollback(mark)
+        self.assertIsNotNone(index.get_client("C2"))
+        self.assertEqual(self.searched, ["Client"])
+
+    def test_lab_contacts(self):
+        index = self.index
+        self.assertEqual(index.get_lab_contact("Smith"), "uid1")
+        self.assertEqual(index.get_lab_contact_title("uid1"), "--- Smith")
+        self.assertIsNone(index.get_lab_contact("Ann Lee"))
+        index.add_lab_contact("Ann Lee", "uid2", "Ann Lee")
+        self.assertEqual(index.get_lab_contact("ann lee"), "uid2")
+
+    def test_contact_emails(self):
+        client = Client("/plone/clients/c1", [Contact("ann@example.com")])
+        self.assertIn("ann@example.com", self.index.get_contact_emails(client))
+        client.contacts = []
+        self.index.add_contact_email(client, " Bob@example.com")
+        self.assertEqual(
+            self.index.get_contact_emails(client),
+            set(["ann@example.com", "bob@example.com"]),
+        )
+
+    def test_active_systems(self):
+        index = self.index
+        systems = index.get_active_systems_in(
+            ["/plone/clients/c1/l1", "/plone/clients/c2/l2"]
+        )
+        self.assertEqual(
+            [brain["getSamplePointID"] for brain in systems["/plone/clients/c1/l1"]],
+            ["S1"],
+        )
+        self.assertEqual(systems["/plone/clients/c2/l2"], [])
+        index.set_review_state("/plone/clients/c1/l1/s1", "inactive")
+        systems = index.get_active_systems_in(["/plone/clients/c1/l1"])
+        self.assertEqual(systems["/plone/clients/c1/l1"], [])
+        self.assertEqual(index.searches, 1)
+
+    def test_values_are_unknown(self):
+        location = self.index.get_location_by_id("L1")
+        self.assertIsNone(self.index.get_values(location))
+
+    def test_review_state_of_transitioned_brains(self):
+        location = self.index.get_location_by_id("L1")
+        self.assertEqual(self.index.get_review_state(location), "active")
+        self.index.set_review_state(location.getPath(), "inactive")
+        self.assertEqual(self.index.get_review_state(location), "inactive")
+
+
+def make_row(record, **values):
+    """Return a record with the values given, the other fields empty"""
+    return record(**dict((name, values.get(name, "")) for name in record._fields))
+
+
+class ExternalIdIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = {
+            "Client": Tree({"C1": "c1"}),
+            "SamplePointLocation": Tree(
+                {("L1", "/plone/clients/c1"): "l1", ("L1", "/plone/clients/c2"): "l9"}
+            ),
+            "SamplePoint": Tree(
+                {
+                    ("/plone/clients/c1/l1", "S1"): "s1",
+                    ("/plone/clients/c1/l1", "S2"): "s2",
+                    ("/plone/clients/c1/l10", "S3"): "s3",
+                }
+            ),
+            "Contact": Tree({("/plone/clients/c1", "ann@example.com"): "k1"}),
+            "objects": Tree(
+                {
+                    "c1": ("Client", "C1", "/plone/clients/c1"),
+                    "l1": (
+                        "SamplePointLocation",
+                        ("L1", "/plone/clients/c1"),
+                        "/plone/clients/c1/l1",
+                    ),
+                    "l9": (
+                        "SamplePointLocation",
+                        ("L1", "/plone/clients/c2"),
+                        "/plone/clients/c2/l9",
+                    ),
+                    "s1": (
+                        "SamplePoint",
+                        ("/plone/clients/c1/l1", "S1"),
+                        "/plone/clients/c1/l1/s1",
+                    ),
+                    "s2": (
+                        "SamplePoint",
+                        ("/plone/clients/c1/l1", "S2"),
+                        "/plone/clients/c1/l1/s2",
+                    ),
+                }
+            ),
+            "paths": Tree({"/plone/clients/c1": "c1"}),
+            "values": Tree({"s1": ("E1", "tower", "Roof")}),
+        }
+        self.queries = []
+        self.fetched = []
+        self.index = ExternalIdIndex(self.storage, self.search, lambda: [])
+
+    def search(self, portal_type, **query):
+        self.queries.append(query)
+        if "UID" in query:
+            self.fetched.append((portal_type, query["UID"]))
+            return [
+                Brain(path=self.storage["objects"][uid][2], UID=uid)
+                for uid in query["UID"]
+                if uid in self.storage["objects"]
+            ]
+        return [
+            brain
+            for brain in BRAINS[portal_type]
+            if brain.review_state == query["review_state"]
+            and parent_path(brain) in query["path"]["query"]
+        ]
+
+    def store_metadata(self):
+        self.storage["metadata"] = Tree(
+            {
+                "c1": (
+                    ("Title", "Client One"),
+                    ("review_state", "active"),
+                    ("getClientID", "C1"),
+                ),
+                "l1": (
+                    ("Title", "Loc One"),
+                    ("review_state", "inactive"),
+                    ("getSamplePointLocationID", "L1"),
+                    ("getAccountManagers", ("m1",)),
+                ),
+                "s1": (
+                    ("Title", "Sys One"),
+                    ("review_state", "active"),
+                    ("getSamplePointID", "S1"),
+                ),
+            }
+        )
+
+    def test_stored_brains_are_resolved_without_a_query(self):
+        self.store_metadata()
+        index = self.index
+        client = index.get_client("C1")
+        self.assertIsInstance(client, StoredBrain)
+        self.assertEqual(client.getPath(), "/plone/clients/c1")
+        self.assertEqual(client.Title, "Client One")
+        self.assertEqual(client["getClientID"], "C1")
+        location = index.get_location_by_id("L1")
+        self.assertEqual(index.get_review_state(location), "inactive")
+        self.assertEqual(location.getAccountManagers, ["m1"])
+        system = index.get_system(location.getPath(), "S1")
+        self.assertEqual(system["UID"], "s1")
+        self.assertEqual(self.queries, [])
+        self.assertEqual(index.searches, 0)
+
+    def test_only_entries_without_metadata_are_fetched(self):
+        self.store_metadata()
+        index = self.index
+        rows = [
+            make_row(SystemRow, Location_id="L1", SystemID="S1"),
+            make_row(SystemRow, Location_id="L1", SystemID="S2"),
+        ]
+        index.prefetch("Systems", rows)
+        self.assertEqual(self.fetched, [("SamplePoint", ["s2"])])
+        location = index.get_location_by_id("L1")
+        self.assertIsInstance(index.get_system(location.getPath(), "S1"), StoredBrain)
+        self.assertNotIsInstance(
+            index.get_system(location.getPath(), "S2"), StoredBrain
+        )
+        self.assertEqual(index.searches, 1)
+
+    def test_keys_with_prefix(self):
+        tree = self.storage["SamplePoint"]
+        self.assertEqual(
+            list(keys_with_prefix(tree, ("/plone/clients/c1/l1",))),
+            [("/plone/clients/c1/l1", "S1"), ("/plone/clients/c1/l1", "S2")],
+        )
+        self.assertEqual(list(keys_with_prefix(tree, ("/plone/clients/c2",))), [])
+
+    def test_keys_are_resolved_once(self):
+        index = self.index
+        self.assertEqual(index.get_client("C1")["UID"], "c1")
+        self.assertEqual(index.get_client("C1")["UID"], "c1")
+        self.assertIsNone(index.get_client("C2"))
+        self.assertIsNone(index.get_client("C2"))
+        self.assertEqual(index.get_client_at("/plone/clients/c1")["UID"], "c1")
+        self.assertEqual(index.get_location("/plone/clients/c2", "L1")["UID"], "l9")
+        self.assertEqual(index.get_location_by_id("L1")["UID"], "l1")
+        self.assertIsNone(index.get_system("/plone/clients/c1/l1", "S3"))
+        self.assertEqual(
+            self.fetched,
+            [
+                ("Client", ["c1"]),
+                ("SamplePointLocation", ["l9"]),
+                ("SamplePointLocation", ["l1"]),
+            ],
+        )
+        self.assertEqual(index.searches, 3)
+
+    def test_prefetch_systems(self):
+        index = self.index
+        rows = [
+            make_row(SystemRow, Location_id="L1", SystemID="S1"),
+            make_row(SystemRow, Location_id="L1", SystemID="S2"),
+            make_row(SystemRow, Location_id="L1", SystemID="S9"),
+            make_row(SystemRow, Location_id="L5", SystemID="S1"),
+        ]
+        index.prefetch("Systems", rows)
+        self.assertEqual(
+            sorted(self.fetched),
+            [("SamplePoint", ["s1", "s2"]), ("SamplePointLocation", ["l1"])],
+        )
+        location = index.get_location_by_id("L1")
+        self.assertEqual(location["UID"], "l1")
+        self.assertEqual(index.get_system(location.getPath(), "S2")["UID"], "s2")
+        self.assertIsNone(index.get_system(location.getPath(), "S9"))
+        self.assertIsNone(index.get_location_by_id("L5"))
+        self.assertEqual(index.searches, 2)
+
+    def test_prefetch_locations_and_contacts(self):
+        index = self.index
+        rows = [
+            make_row(LocationRow, Customer_Number="C1", Locations_id="L1"),
+            make_row(LocationRow, Customer_Number="C2", Locations_id="L2"),
+        ]
+        index.prefetch("Locations", rows)
+        self.assertEqual(
+            sorted(self.fetched),
+            [("Client", ["c1"]), ("SamplePointLocation", ["l1"])],
+        )
+        index.prefetch("Contacts", [make_row(ContactRow, Locations_id="L1")])
+        index.prefetch("Accounts", [make_row(AccountRow, Customer_Number="C1")])
+        client = index.get_client("C1")
+        self.assertEqual(index.get_location(client.getPath(), "L1")["UID"], "l1")
+        self.assertIs(index.get_client_at("/plone/clients/c1"), client)
+        self.assertEqual(index.searches, 2)
+
+    def test_reset_resolves_again(self):
+        index = self.index
+        index.get_client("C1")
+        index.add_location("/plone/clients/c3", "L3", Brain(UID="l3"))
+        index.reset()
+        self.assertIsNone(index.get_location_by_id("L3"))
+        index.get_client("C1")
+        self.assertEqual(self.fetched, [("Client", ["c1"]), ("Client", ["c1"])])
+
+    def test_rollback_forgets_the_brains_fetched_after_the_mark(self):
+        index = self.index
+        index.get_client("C1")
+        mark = index.mark()
+        index.get_location_by_id("L1")
+        brain = Brain(path="/plone/clients/c1/l2", UID="l2")
+        index.add_location("/plone/clients/c1", "L2", brain)
+        index.rollback(mark)
+        self.assertIsNone(index.get_location_by_id("L2"))
+        index.get_client("C1")
+        index.get_location_by_id("L1")
+        self.assertEqual(
+            self.fetched,
+            [
+                ("Client", ["c1"]),
+                ("SamplePointLocation", ["l1"]),
+                ("SamplePointLocation", ["l1"]),
+            ],
+        )
+
+    def test_systems_in_a_location(self):
+        systems = self.index.get_systems_in("/plone/clients/c1/l1")
+        self.assertEqual(sorted(brain["UID"] for brain in systems), ["s1", "s2"])
+        self.assertEqual(self.fetched, [("SamplePoint", ["s1", "s2"])])
+        self.index.add_system("/plone/clients/c1/l1", "S4", Brain(UID="s4"))
+        self.assertEqual(len(self.index.get_systems_in("/plone/clients/c1/l1")), 3)
+        self.assertEqual(self.index.searches, 1)
+
+    def test_added_locations_are_found(self):
+        brain = Brain(path="/plone/clients/c3/l3", UID="l3")
+        self.index.add_location("/plone/clients/c3", "L3", brain)
+        self.assertIs(self.index.get_location("/plone/clients/c3", "L3"), brain)
+        self.assertIs(self.index.get_location_by_id("L3"), brain)
+
+    def test_contact_emails(self):
+        client = Client("/plone/clients/c1", [])
+        self.assertEqual(
+            self.index.get_contact_emails(client), set(["ann@example.com"])
+        )
+        self.index.add_contact_email(client, "bob@example.com")
+        self.assertIn("bob@example.com", self.index.get_contact_emails(client))
+        self.assertEqual(self.queries, [])
+
+    def test_values(self):
+        system = self.index.get_system("/plone/clients/c1/l1", "S1")
+        self.assertEqual(self.index.get_values(system), ("E1", "tower", "Roof"))
+        system = self.index.get_system("/plone/clients/c1/l1", "S2")
+        self.assertIsNone(self.index.get_values(system))
+
+    def test_active_systems_with_one_query(self):
+        index = self.index
+        self.assertEqual(index.get_active_systems_in([]), {})
+        systems = index.get_active_systems_in(
+            ["/plone/clients/c1/l1", "/plone/clients/c2/l2"]
+        )
+        self.assertEqual(
+            [brain["getSamplePointID"] for brain in systems["/plone/clients/c1/l1"]],
+            ["S1"],
+        )
+        self.assertEqual(systems["/plone/clients/c2/l2"], [])
+        self.assertEqual(len(self.queries), 1)
+        system = index.get_system("/plone/clients/c1/l1", "S1")
+        self.assertIs(system, BRAINS["SamplePoint"][0])
+        self.assertEqual(self.fetched, [])
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from senaite.locationsync.memory import CacheGuard
+from senaite.locationsync.memory import ObjectCache
+
+
+class Cache(object):
+    cache_non_ghost_count = 3
+
+
+class Jar(object):
+    def __init__(self):
+        self.calls = []
+        self._cache = Cache()
+
+    def cacheMinimize(self):
+        self.calls.append("minimize")
+
+    def cacheGC(self):
+        self.calls.append("gc")
+
+
+class ObjectCacheTest(unittest.TestCase):
+    def test_objects_used_last_are_kept(self):
+        loaded = []
+
+        def loader(key):
+            def load():
+                loaded.append(key)
+                return key.upper()
+
+            return load
+
+        cache = ObjectCache(size=2)
+        self.assertEqual(cache.get("a", loader("a")), "A")
+        cache.get("b", loader("b"))
+        cache.get("a", loader("a"))
+        cache.get("c", loader("c"))
+        cache.get("a", loader("a"))
+        cache.get("b", loader("b"))
+        self.assertEqual(loaded, ["a", "b", "c", "b"])
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(len(cache.objects), 2)
+
+
+class CacheGuardTest(unittest.TestCase):
+    def test_cache_is_minimized_over_budget(self):
+        jar = Jar()
+        guard = CacheGuard(jar, budget=2)
+        for i in range(5):
+            guard.woke()
+        self.assertEqual(jar.calls, ["minimize", "minimize"])
+        self.assertEqual(guard.minimized, 2)
+        self.assertEqual(guard.woken, 1)
+        guard.committed()
+        self.assertEqual(jar.calls[-1], "gc")
+        self.assertEqual(guard.cached(), 3)
+        self.assertIn("3 objects cached, 2 minimizations", guard.report())
+
+    def test_no_budget(self):
+        jar = Jar()
+        guard = CacheGuard(jar, budget=0)
+        for i in range(5):
+            guard.woke()
+        self.assertEqual(jar.calls, [])
+
+    def test_no_connection(self):
+        guard = CacheGuard(None, budget=1)
+        guard.woke()
+        guard.committed()
+        self.assertEqual(guard.cached(), 0)
+        self.assertEqual(guard.minimized, 0)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from senaite.locationsync.preflight import parse_file
+from senaite.locationsync.records import ACCOUNT_FILE_HEADERS
+
+ACCOUNTS = b"""\xef\xbb\xbfCustomer_Number,Account_name,Inactive,On_HOLD
+C1,Client One,0,0
+C2,Client Two
+C3,Client Thr\xc3\xa9e,1,0
+"""
+
+
+class PreflightTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, "Account lims.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def parse(self, content, use_mmap=False):
+        with open(self.file_path, "wb") as f:
+            f.write(content)
+        job = (
+            "Accounts",
+            "Account lims.csv",
+            self.file_path,
+            ACCOUNT_FILE_HEADERS,
+            use_mmap,
+        )
+        return parse_file(job)
+
+    def test_valid_rows_and_errors(self):
+        result = self.parse(ACCOUNTS)
+        self.assertEqual(result["num_rows"], 2)
+        self.assertEqual(
+            result["batches"],
+            [
+                [
+                    (1, (u"C1", u"Client One", u"0", u"0")),
+                    (3, (u"C3", u"Client Thre", u"1", u"0")),
+                ]
+            ],
+        )
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertNotIn("header_error", result)
+
+    def test_mapped_file_gives_the_same_result(self):
+        self.assertEqual(self.parse(ACCOUNTS, use_mmap=True), self.parse(ACCOUNTS))
+
+    def test_header_error(self):
+        result = self.parse(b"Customer_Number,Account_name\nC1,Client One\n")
+        self.assertIn("header_error", result)
+        self.assertEqual(result["batches"], [])
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import csv
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from senaite.locationsync.cleaning import reference_clean_row
+from senaite.locationsync.reader import data_file_path
+from senaite.locationsync.reader import decoded_lines
+from senaite.locationsync.reader import decoding_warnings
+from senaite.locationsync.reader import iter_chunks
+from senaite.locationsync.reader import iter_values
+from senaite.locationsync.reader import mapped_lines
+from senaite.locationsync.reader import new_stats
+from senaite.locationsync.reader import open_data_file
+from senaite.locationsync.reader import read_header
+from senaite.locationsync.records import ACCOUNT_FILE_HEADERS
+from senaite.locationsync.records import AccountRow
+from senaite.locationsync.records import NATURAL_KEYS
+from senaite.locationsync.records import REQUIRED_FIELDS
+from senaite.locationsync.validation import new_report
+from senaite.locationsync.validation import validated_rows
+
+HEADERS = ["a", "b", "c"]
+
+
+def reference_values(lines):
+    """Cells cleaned and decoded one at a time, like the original reader"""
+    rows = []
+    for row in csv.reader(lines):
+        if len(row) != len(HEADERS):
+            continue
+        rows.append([cell.decode("utf-8", "replace") for cell in reference_clean_row(row)])
+    return rows
+
+
+def read_values(lines, stats):
+    reader = csv.reader(decoded_lines(lines, stats))
+    return [list(values) for _, values in iter_values(reader, "f", HEADERS, stats, lambda msg: None)]
+
+
+class ReaderTest(unittest.TestCase):
+    def test_values_match_reference(self):
+        rnd = random.Random(1)
+        pieces = [b"a", b" ", b",", b'"', b"\xc3\xa9", b"\xe2\x80\x99", b"\xc3\x80",
+                  b"\x92", b"\xe2\x80", b"\xef\xbb\xbf", b"\xff", b"\xc2\xa0"]
+        for _ in range(500):
+            lines = []
+            for _ in range(3):
+                line = b"".join(rnd.choice(pieces) for _ in range(rnd.randint(0, 12)))
+                lines.append(line + b"\n")
+            stats = new_stats()
+            values = read_values(lines, stats)
+            self.assertEqual(values, reference_values(lines), lines)
+
+    def test_aggregated_warnings(self):
+        lines = [b"x,O\xe2\x80\x99Brien,y\n", b"bad \x92,b,c\n"]
+        stats = new_stats()
+        values = read_values(lines, stats)
+        self.assertEqual(values, [[b"x", u"O\ufffdBrien", b"y"], [b"bad ", b"b", b"c"]])
+        self.assertEqual(stats["bad_offsets"], [len(lines[0]) + 4])
+        self.assertEqual(stats["encoding"], "cp1252")
+        self.assertEqual(len(decoding_warnings("f", stats)), 2)
+
+    def test_mapped_lines_match_file_lines(self):
+        rnd = random.Random(2)
+        pieces = [b"a", b" ", b",", b'"', b"\n", b"\r", b"\r\n", b"\xc3\xa9"]
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            for _ in range(500):
+                data = b"".join(rnd.choice(pieces) for _ in range(rnd.randint(0, 40)))
+                with open(path, "wb") as f:
+                    f.write(data)
+                with open(path, "rb") as f:
+                    expected = list(f)
+                with open(path, "rb") as f:
+                    lines = list(mapped_lines(f, chunk_size=rnd.randint(1, 8)))
+                self.assertEqual(lines, expected, data)
+        finally:
+            os.remove(path)
+
+    def test_mapped_lines_keep_quoted_newlines(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            with open(path, "wb") as f:
+                f.write(b'a,"two\nlines",c\r\nd,e,"f\r\n"\n')
+            with open(path, "rb") as f:
+                rows = list(csv.reader(mapped_lines(f, chunk_size=4)))
+            self.assertEqual(rows, [["a", "two\nlines", "c"], ["d", "e", "f\r\n"]])
+        finally:
+            os.remove(path)
+
+    def test_rows_are_applied_while_the_file_is_read(self):
+        read = []
+
+        def lines(count):
+            yield ",".join(ACCOUNT_FILE_HEADERS).encode("utf-8") + b"\n"
+            for num in range(1, count + 1):
+                read.append(num)
+                yield "C{},Client {},0,0\n".format(num, num).encode("utf-8")
+            raise IOError("the file was cut short")
+
+        stats = new_stats()
+        reader = csv.reader(decoded_lines(lines(3), stats))
+        self.assertIsNone(read_header(reader, "f", ACCOUNT_FILE_HEADERS))
+        rows = (
+            (row_num, AccountRow(*values))
+            for row_num, values in iter_values(
+                reader, "f", ACCOUNT_FILE_HEADERS, stats, lambda msg: None
+            )
+        )
+        rows = validated_rows(
+            rows,
+            REQUIRED_FIELDS["Accounts"],
+            NATURAL_KEYS["Accounts"],
+            new_report(),
+        )
+        applied = []
+        with self.assertRaises(IOError):
+            for row_num, row in rows:
+                # no line after the row's own was read yet
+                self.assertEqual(read[-1], row_num)
+                applied.append(row.Customer_Number)
+        # the rows before the failing line were applied as they were read
+        self.assertEqual(applied, ["C1", "C2", "C3"])
+
+    def test_iter_chunks(self):
+        self.assertEqual(list(iter_chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(iter_chunks([], 2)), [])
+
+    def test_gzipped_files_are_decompressed(self):
+        folder = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(data_file_path(folder, "system lims.csv"))
+            file_path = os.path.join(folder, "system lims.csv.gz")
+            with gzip.open(file_path, "wb") as f:
+                f.write(b'a,"two\nlines",c\r\nd,e,f\r\n')
+            self.assertEqual(data_file_path(folder, "system lims.csv"), file_path)
+            with open_data_file(file_path) as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows, [["a", "two\nlines", "c"], ["d", "e", "f"]])
+        finally:
+            shutil.rmtree(folder)
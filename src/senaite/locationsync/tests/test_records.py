@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import pickle
+import unittest
+
+from senaite.locationsync.records import RECORD_TYPES
+from senaite.locationsync.records import SYSTEM_FILE_HEADERS
+from senaite.locationsync.records import SystemRow
+
+
+class RecordsTest(unittest.TestCase):
+    def test_fields_follow_headers(self):
+        for record in RECORD_TYPES.values():
+            row = record(*record._fields)
+            self.assertEqual(list(row), list(record._fields))
+        self.assertEqual(list(SystemRow._fields), SYSTEM_FILE_HEADERS)
+
+    def test_attribute_access(self):
+        row = SystemRow(u"L1", u"E1", u"S1", u"desc", u"Sys 1", u"0", u"tower")
+        self.assertEqual(row.SystemID, u"S1")
+        self.assertEqual(row.Location_id, u"L1")
+        self.assertEqual(SystemRow.__slots__, ())
+
+    def test_pickle(self):
+        row = SystemRow(u"L1", u"E1", u"S1", u"desc", u"Sys 1", u"0", u"tower")
+        self.assertEqual(pickle.loads(pickle.dumps(row, 2)), row)
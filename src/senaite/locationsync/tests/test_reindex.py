@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from senaite.locationsync.reindex import indexes_of
+from senaite.locationsync.reindex import ReindexQueue
+
+
+class Content(object):
+    def __init__(self, path):
+        self.path = path
+        self.reindexed = []
+        self.modified = 0
+
+    def getPhysicalPath(self):
+        return tuple(self.path.split("/"))
+
+    def notifyModified(self):
+        self.modified += 1
+
+    def reindexObject(self, idxs=[]):
+        self.reindexed.append(idxs)
+
+
+class ReindexQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = ReindexQueue()
+        self.system = Content("/plone/clients/c1/l1/s1")
+        self.location = Content("/plone/clients/c1/l1")
+
+    def test_indexes_of(self):
+        self.assertEqual(
+            indexes_of(["EquipmentID", "SamplePointId"]),
+            set(["getSamplePointID", "listing_searchable_text"]),
+        )
+        self.assertRaises(KeyError, indexes_of, ["Unknown"])
+
+    def test_each_object_is_reindexed_once(self):
+        self.queue.add(self.system, "SamplePointId")
+        self.queue.add(self.location, "AccountManagers")
+        self.queue.add(self.system, "EquipmentID")
+        self.assertEqual(self.system.reindexed, [])
+        self.queue.flush()
+        self.assertEqual(
+            self.system.reindexed,
+            [["getSamplePointID", "listing_searchable_text", "modified"]],
+        )
+        self.assertEqual(self.location.reindexed, [["UID", "modified"]])
+        self.assertEqual(self.system.modified, 1)
+        self.queue.flush()
+        self.assertEqual(len(self.system.reindexed), 1)
+        self.assertEqual(self.queue.reindexed, 2)
+        self.assertEqual(self.queue.changes, 3)
+
+    def test_rollback_forgets_what_was_added(self):
+        self.queue.add(self.system, "EquipmentID")
+        mark = self.queue.mark()
+        self.queue.add(self.system, "SamplePointId")
+        self.queue.add(self.location, "Address")
+        self.queue.rollback(mark)
+        self.queue.flush()
+        self.assertEqual(
+            self.system.reindexed, [["listing_searchable_text", "modified"]]
+        )
+        self.assertEqual(self.location.reindexed, [])
+
+    def test_not_deferred(self):
+        queue = ReindexQueue(deferred=False)
+        queue.add(self.system, "EquipmentID")
+        queue.add(self.system, "EquipmentType")
+        self.assertEqual(self.system.reindexed, [[], []])
+        self.assertEqual(self.system.modified, 0)
+        self.assertTrue(queue.report().startswith("Reindexed 2 objects in all indexes"))
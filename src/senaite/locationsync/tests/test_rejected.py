@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import transaction
+
+from senaite.locationsync.rejected import read_rejected
+from senaite.locationsync.rejected import rejected_file_name
+from senaite.locationsync.rejected import RejectedFiles
+from senaite.locationsync.rejected import write_rejected
+
+HEADERS = ["Location_id", "SystemID", "system_name"]
+
+
+class RejectedTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, rejected_file_name("system lims.csv"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_file_name(self):
+        self.assertEqual(
+            rejected_file_name("system lims.csv"), "system lims.rejected.csv"
+        )
+
+    def test_rows_are_added_once(self):
+        self.assertEqual(write_rejected(self.path, HEADERS, [["L1", "S1", "Sys 1"]]), 1)
+        count = write_rejected(
+            self.path, HEADERS, [["L1", "S1", "Sys 1"], ["L1", "S2", u"Sys \xe9"]]
+        )
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            read_rejected(self.path),
+            [["L1", "S1", "Sys 1"], ["L1", "S2", "Sys \xc3\xa9"]],
+        )
+
+    def test_replace_keeps_rows_rejected_again(self):
+        write_rejected(
+            self.path, HEADERS, [["L1", "S1", "Sys 1"], ["L1", "S2", "Sys 2"]]
+        )
+        count = write_rejected(
+            self.path, HEADERS, [["L1", "S2", "Sys 2"]], replace=True
+        )
+        self.assertEqual(count, 1)
+        self.assertEqual(read_rejected(self.path), [["L1", "S2", "Sys 2"]])
+
+    def test_file_without_rows_is_removed(self):
+        self.assertEqual(write_rejected(self.path, HEADERS, []), 0)
+        self.assertFalse(os.path.exists(self.path))
+        write_rejected(self.path, HEADERS, [["L1", "S1", "Sys 1"]])
+        self.assertEqual(write_rejected(self.path, HEADERS, [], replace=True), 0)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(read_rejected(self.path), [])
+
+
+class RejectedFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, rejected_file_name("system lims.csv"))
+        # the rows rejected by an earlier run, a replay processes them
+        write_rejected(
+            self.path, HEADERS, [["L1", "S1", "Sys 1"], ["L1", "S2", "Sys 2"]]
+        )
+        self.rows = {"Systems": [["L1", "S2", "Sys 2"]]}
+        self.files = RejectedFiles(self.folder, self.rows, replace=True)
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        shutil.rmtree(self.folder)
+
+    def test_replay_aborted_leaves_the_file_unchanged(self):
+        self.files.keep("Systems", "system lims.csv", HEADERS)
+        transaction.abort()
+        self.assertEqual(
+            read_rejected(self.path), [["L1", "S1", "Sys 1"], ["L1", "S2", "Sys 2"]]
+        )
+
+    def test_replay_committed_replaces_the_rows(self):
+        self.files.keep("Systems", "system lims.csv", HEADERS)
+        transaction.commit()
+        self.assertEqual(read_rejected(self.path), [["L1", "S2", "Sys 2"]])
+        self.assertEqual(self.files.kept, [])
+
+    def test_file_is_removed_once_all_rows_were_replayed(self):
+        del self.rows["Systems"][:]
+        self.files.keep("Systems", "system lims.csv", HEADERS)
+        transaction.commit()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_failed_commit_leaves_the_file_unchanged(self):
+        def fail():
+            raise ValueError("commit failed")
+
+        self.files.keep("Systems", "system lims.csv", HEADERS)
+        transaction.get().addBeforeCommitHook(fail)
+        self.assertRaises(ValueError, transaction.commit)
+        transaction.abort()
+        self.assertEqual(len(read_rejected(self.path)), 2)
+        # the changes are made again in a new transaction, as after a
+        # conflict, the files are written when that one commits
+        transaction.begin()
+        self.files.join()
+        self.files.join()
+        self.assertEqual(len(list(transaction.get().getAfterCommitHooks())), 1)
+        transaction.commit()
+        self.assertEqual(read_rejected(self.path), [["L1", "S2", "Sys 2"]])
+
+    def test_rows_are_added_without_replace(self):
+        files = RejectedFiles(self.folder, {"Systems": [["L1", "S3", "Sys 3"]]})
+        files.keep("Systems", "system lims.csv", HEADERS)
+        transaction.commit()
+        self.assertEqual(len(read_rejected(self.path)), 3)
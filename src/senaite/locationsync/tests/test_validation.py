@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from senaite.locationsync.records import ContactRow
+from senaite.locationsync.records import NATURAL_KEYS
+from senaite.locationsync.records import REQUIRED_FIELDS
+from senaite.locationsync.validation import format_rows
+from senaite.locationsync.validation import new_report
+from senaite.locationsync.validation import validated_rows
+
+
+class ValidationTest(unittest.TestCase):
+    def validate(self, rows):
+        report = new_report()
+        result = list(
+            validated_rows(
+                enumerate(rows, 1),
+                REQUIRED_FIELDS["Contacts"],
+                NATURAL_KEYS["Contacts"],
+                report,
+            )
+        )
+        return result, report
+
+    def test_missing_and_duplicate_rows_are_held_back(self):
+        rows = [
+            ContactRow(u"K1", u"L1", u"Ann Lee", u"ann@example.com"),
+            ContactRow(u"", u"L1", u"Bob", u"bob@example.com"),
+            ContactRow(u"K1", u"L2", u"Ann Lee", u"ann@example.com"),
+            ContactRow(u"K1", u"L1", u"Ann Lee", u"ann@example.com"),
+            ContactRow(u"K2", u"", u"", u""),
+        ]
+        result, report = self.validate(rows)
+        self.assertEqual(result, [(1, rows[0]), (3, rows[2])])
+        self.assertEqual(report["valid"], 2)
+        self.assertEqual(report["missing"], {"contactID": [2], "Locations_id": [5]})
+        self.assertEqual(report["duplicates"], {(u"K1", u"L1"): [1, 4]})
+
+    def test_format_rows(self):
+        self.assertEqual(format_rows([1, 2]), "1, 2")
+        self.assertTrue(format_rows(list(range(25))).endswith("19 and 5 more"))
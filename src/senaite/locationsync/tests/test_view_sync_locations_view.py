@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
 import unittest
 
 from plone import api
@@ -6,6 +9,18 @@ from plone.app.testing import TEST_USER_ID, setRoles
 from zope.component import getMultiAdapter
 from zope.interface.interfaces import ComponentLookupError
 
+from senaite.locationsync.browser.sync_locations_view import ACCOUNT_FILE_NAME
+from senaite.locationsync.commits import CommitPolicy
+from senaite.locationsync.indexes import SyncIndex
+from senaite.locationsync.memory import CacheGuard
+from senaite.locationsync.records import ACCOUNT_FILE_HEADERS
+from senaite.locationsync.records import AccountRow
+from senaite.locationsync.records import LocationRow
+from senaite.locationsync.records import SystemRow
+from senaite.locationsync.reindex import ReindexQueue
+from senaite.locationsync.rejected import read_rejected
+from senaite.locationsync.rejected import rejected_file_name
+from senaite.locationsync.rejected import RejectedFiles
 from senaite.locationsync.testing import (
     SENAITE_LOCATIONSYNC_FUNCTIONAL_TESTING,
     SENAITE_LOCATIONSYNC_INTEGRATION_TESTING,
@@ -41,6 +56,122 @@ class ViewsIntegrationTest(unittest.TestCase):
             )
 
 
+def make_row(record, **values):
+    """Return a record with the values given, the other fields empty"""
+    return record(**dict((name, values.get(name, "")) for name in record._fields))
+
+
+class RejectedRowsIntegrationTest(unittest.TestCase):
+
+    layer = SENAITE_LOCATIONSYNC_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.folder = api.content.create(self.portal, "Folder", "accounts")
+        self.view = getMultiAdapter(
+            (self.folder, self.portal.REQUEST), name="sync_locations_view"
+        )
+        self.view.sync_error_folder = tempfile.mkdtemp()
+        self.start_run(self.view)
+
+    def tearDown(self):
+        shutil.rmtree(self.view.sync_error_folder)
+
+    def start_run(self, view):
+        """Set the view up the way sync_locations does, without the files"""
+        jar = self.portal._p_jar
+        view.policy = CommitPolicy(
+            jar,
+            on_save=view.saved,
+            before_save=view.flush_batch,
+            replay=view.replay_batch,
+        )
+        view.memory = CacheGuard(jar, savepoint=view.policy.savepoint)
+        view.reindex_queue = ReindexQueue()
+        view.rejected_files = RejectedFiles(view.sync_error_folder, view.rejected)
+        view.new_batch()
+        view.index = SyncIndex(view.search_portal_type, view.get_lab_contacts)
+
+    def process_row(self, row_num, row):
+        api.content.create(self.folder, "Document", row.Customer_Number)
+        self.view.index.set_review_state(row.Customer_Number, "inactive")
+        if row.Account_name == "fail":
+            raise ValueError("Account {} fails".format(row.Customer_Number))
+
+    def test_failing_row_is_rolled_back_and_rejected(self):
+        rows = [
+            (1, AccountRow("C1", "Account 1", "0", "0")),
+            (2, AccountRow("C2", "fail", "0", "0")),
+            (3, AccountRow("C3", "Account 3", "0", "0")),
+        ]
+        self.view.process_rows("Accounts", {"rows": rows}, self.process_row)
+        self.assertEqual(sorted(self.folder.objectIds()), ["C1", "C3"])
+        self.assertEqual(self.view.rejected_count, 1)
+        self.assertEqual(self.view.rejected["Accounts"], [rows[1][1]])
+        self.assertEqual(self.view.index.states, {"C1": "inactive", "C3": "inactive"})
+        errors = [log for log in self.view.logs if log["level"] == "Error"]
+        self.assertEqual(len(errors), 1)
+        self.assertIn("Row 2 of the Accounts file", errors[0]["message"])
+
+    def test_rows_of_a_rejected_parent_are_rejected_with_it(self):
+        self.view.rejected["Locations"] = [make_row(LocationRow, Locations_id="L1")]
+        rows = [
+            (1, make_row(SystemRow, Location_id="L1")),
+            (2, make_row(SystemRow, Location_id="L2")),
+        ]
+        processed = []
+        self.view.process_rows(
+            "Systems", {"rows": rows}, lambda i, row: processed.append(i)
+        )
+        self.assertEqual(processed, [2])
+        self.assertEqual(self.view.rejected["Systems"], [rows[0][1]])
+        self.assertEqual(self.view.rejected_count, 1)
+
+    def test_rejected_rows_are_kept_to_be_replayed(self):
+        rows = [
+            (1, AccountRow("C1", "fail", "0", "0")),
+            (2, AccountRow("C2", "Account 2", "0", "0")),
+        ]
+        self.view.process_rows("Accounts", {"rows": rows}, self.process_row)
+        self.view.keep_rejected("Accounts", ACCOUNT_FILE_HEADERS)
+        # the file is written once the changes are committed
+        self.view.rejected_files.write(True)
+        path = os.path.join(
+            self.view.sync_error_folder, rejected_file_name(ACCOUNT_FILE_NAME)
+        )
+        self.assertEqual(read_rejected(path), [["C1", "fail", "0", "0"]])
+        self.assertEqual(self.view.rejected_files.kept, [])
+
+
+class ArchiveFilesIntegrationTest(unittest.TestCase):
+
+    layer = SENAITE_LOCATIONSYNC_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.view = getMultiAdapter(
+            (self.portal, self.portal.REQUEST), name="sync_locations_view"
+        )
+        self.folder = tempfile.mkdtemp()
+        self.view.sync_current_folder = os.path.join(self.folder, "current")
+        self.view.sync_archive_folder = os.path.join(self.folder, "archive")
+        os.mkdir(self.view.sync_current_folder)
+        os.mkdir(self.view.sync_archive_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_archived_files_are_not_in_the_run_log(self):
+        with open(os.path.join(self.view.sync_current_folder, ACCOUNT_FILE_NAME), "w"):
+            pass
+        self.view.archive_files(True)
+        self.assertEqual(os.listdir(self.view.sync_current_folder), [])
+        self.assertEqual(len(os.listdir(self.view.sync_archive_folder)), 2)
+        # the run log was written and emailed before the commit
+        self.assertEqual(self.view.logs, [])
+
+
 class ViewsFunctionalTest(unittest.TestCase):
 
     layer = SENAITE_LOCATIONSYNC_FUNCTIONAL_TESTING
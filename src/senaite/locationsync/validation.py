@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Validation of the rows of a sync file in a single pass.
+
+Rows missing a required field and rows repeating the natural key of an
+earlier row are held back, so the rule processors only see clean rows.
+The rows held back are collected in a report that is logged once the file
+has been read, instead of one log entry per row.
+"""
+
+MAX_REPORTED_ROWS = 20
+
+
+def new_report():
+    """Return an empty validation report"""
+    return {"missing": {}, "duplicates": {}, "valid": 0}
+
+
+def validated_rows(rows, required_fields, key_fields, report):
+    """Yield the (row number, row) of the rows with all required fields and a
+    key not seen before
+
+    rows are (row number, row) pairs, the report has the row numbers of the
+    rows held back.
+    """
+    missing = report["missing"]
+    duplicates = report["duplicates"]
+    seen = {}
+    for row_num, row in rows:
+        empty = [field for field in required_fields if not getattr(row, field)]
+        if empty:
+            for field in empty:
+                missing.setdefault(field, []).append(row_num)
+            continue
+        key = tuple(getattr(row, field) for field in key_fields)
+        if key in seen:
+            duplicates.setdefault(key, [seen[key]]).append(row_num)
+            continue
+        seen[key] = row_num
+        report["valid"] += 1
+        yield row_num, row
+
+
+def format_rows(row_nums):
+    """Return the row numbers as text, cut short for long lists
+
+    Also used for the other numbers and places reported for a file, like
+    byte offsets.
+    """
+    text = ", ".join(str(num) for num in row_nums[:MAX_REPORTED_ROWS])
+    if len(row_nums) > MAX_REPORTED_ROWS:
+        text += " and {} more".format(len(row_nums) - MAX_REPORTED_ROWS)
+    return text
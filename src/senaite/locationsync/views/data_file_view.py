@@ -2,10 +2,13 @@
 
 # from senaite.locationsync import _
 import glob
+import gzip
 import logging
 import os
 from Products.Five.browser import BrowserView
 from senaite import api
+from senaite.locationsync.reader import GZIP_SUFFIX
+from senaite.locationsync.reader import is_gzipped
 import StringIO
 from zope.interface import Interface
 
@@ -82,10 +85,23 @@ class DataFileView(BrowserView):
         # get file and return it
         logger.info("return file '{}'".format(path))
         self.request.response.setHeader("Content-Type", "text/csv")
+        if is_gzipped(name):
+            # send gzipped files as they are to clients that accept gzip, the
+            # client decompresses them into the csv file
+            name = name[: -len(GZIP_SUFFIX)]
+            accept = self.request.getHeader("Accept-Encoding") or ""
+            if "gzip" in accept:
+                self.request.response.setHeader("Content-Encoding", "gzip")
+                self.request.response.setHeader("Vary", "Accept-Encoding")
+                opener = open
+            else:
+                opener = gzip.open
+        else:
+            opener = open
         self.request.response.setHeader(
             "Content-Disposition", 'attachment; filename="{}"'.format(name)
         )
-        with open(path) as f:
+        with opener(path, "rb") as f:
             contents = f.read()
         out = StringIO.StringIO(contents)
         return out.getvalue()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from plone.protect.interfaces import IDisableCSRFProtection
+from Products.Five.browser import BrowserView
+from senaite.locationsync.external_ids import check
+from senaite.locationsync.external_ids import rebuild
+import time
+from zope.interface import alsoProvides
+from zope.interface import Interface
+
+logger = logging.getLogger("locations_sync")
+
+
+class IExternalIdsView(Interface):
+    """Marker Interface for IExternalIdsView"""
+
+
+class ExternalIdsView(BrowserView):
+    """Rebuild and check the persistent external ID index"""
+
+    def rebuild(self):
+        alsoProvides(self.request, IDisableCSRFProtection)
+        start = time.time()
+        count = rebuild()
+        msg = "Indexed {} objects by their external IDs in {:.1f} seconds".format(
+            count, time.time() - start
+        )
+        logger.info("rebuild_external_ids: {}".format(msg))
+        self.request.response.setHeader("Content-Type", "text/plain")
+        return msg
+
+    def check(self):
+        self.request.response.setHeader("Content-Type", "text/plain")
+        result = check()
+        if result is None:
+            return "The external ID index was never built, run @@rebuild_external_ids"
+        lines = [
+            "{} missing, {} stale, {} duplicate and {} outdated entries".format(
+                len(result["missing"]),
+                len(result["stale"]),
+                len(result["duplicates"]),
+                len(result["outdated"]),
+            )
+        ]
+        for name in ("missing", "stale", "duplicates", "outdated"):
+            for portal_type, key, uid, path in result[name]:
+                lines.append(
+                    "{}: {} {} with UID {} at {}".format(
+                        name, portal_type, key, uid, path
+                    )
+                )
+        logger.info("check_external_ids: {}".format(lines[0]))
+        return "\n".join(lines)